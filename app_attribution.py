@@ -0,0 +1,278 @@
+import argparse
+import json
+import re
+from os import makedirs
+from pathlib import Path
+
+import numpy as np
+
+from log_parser import PROFILE_COLUMNS, open_log, log_stem, is_virt_line
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+from runs import discover_runs, parse_run_name, STRATEGIES
+
+# Splits the records of a multi-application run (replay_seq_app, replay_concurr_app) into one stream per application.
+# Records carry no application id, so they are matched against the op sequence each application has when it runs
+# alone (its apps_standalone log): the (bytes requested, bytes in-use, objects) change of every op. A record is
+# attributed to the app whose next op it matches (or part of it, bulk frees can be split over several records). When
+# several apps are due the op, the one whose phase comes first in the schedule gets it: in sequential runs only that
+# app is running, so this is exact (e.g. the teardown frees of identical apps stopping one after the other). In
+# concurrent runs two running apps can be due the same op (both allocating 4096 bytes), those ties are counted, as the
+# split between them is a guess. Records matching no app (e.g. failed allocations) stay unattributed.
+# The run header only lists app indices, "replay_seq_app 0 1 2 1 ..."; they index the app table of the robot script
+# running the experiment, which wraps around: hello, fibonacci, mltest, timer, hello, ... (--apps for other tables).
+# The mapping is checked against the records, an app whose records do not follow its template to the end is reported.
+# Apps with identical templates (fibonacci and timer) can not be told apart by their records, a mix-up between them
+# would go unnoticed, so they share one name ("fibonacci/timer#1"); the schedule still separates their instances.
+APP_NAMES = ("hello", "fibonacci", "mltest", "timer")
+SCHEDULE = re.compile(r"(replay_seq_app|replay_concurr_app)((?:\s+\d+)+)")
+UNATTRIBUTED = "unattributed"
+COUNTERS = ("slab_resets", "untyped_too_small", "oom")
+
+
+def read_schedule(file_path: str) -> tuple:
+    # Workload marker and the app indices listed after it, e.g. "CANTRIP> [sreplay_seq_app  0 1 2 1 2 3 best_fit"
+    with open_log(file_path) as file:
+        for line in file:
+            match = SCHEDULE.search(line) if not is_virt_line(line) else None
+            if match is not None:
+                return match[1], [int(index) for index in match[2].split()]
+    raise ValueError(f"No replay_seq_app / replay_concurr_app schedule found in {file_path}")
+
+
+def op_deltas(columns: dict) -> dict:
+    return {name: np.diff(np.asarray(columns[name], dtype=np.int64), prepend=0) for name in ("bytes_requested", "bytes_in_use", "objs_in_use")}
+
+
+def op_signatures(columns: dict) -> list:
+    deltas = op_deltas(columns)
+    return list(zip(*(deltas[name].tolist() for name in ("bytes_requested", "bytes_in_use", "objs_in_use"))))
+
+
+def find_templates(results_dir: str, strategy: str, cache_dir: str, use_cache: bool) -> dict:
+    templates = {}
+    for run in discover_runs(results_dir, (strategy,)):
+        if run["workload"] == "apps_standalone" and run["kind"] == "profile":
+            templates[run["app_name"]] = op_signatures(load_columns(run["path"], PROFILE_COLUMNS, cache_dir, use_cache).columns)
+    return templates
+
+
+def covers(due: tuple, signature: tuple) -> bool:
+    # A record is the op an app is due, or part of it when the allocator split a bulk free over several records
+    if signature == due:
+        return True
+    requested, in_use, objects = signature
+    return requested == due[0] == 0 and due[2] < objects < 0 and due[1] <= in_use <= 0
+
+
+def schedule_rank(schedule: list, index: int, template: list, progress: int) -> int:
+    # Position in the schedule of the phase an app is in: its first occurrence while it allocates, its second (the
+    # teardown) once only frees are left
+    occurrences = [position for position, scheduled in enumerate(schedule) if scheduled == index]
+    tearing_down = all(objects < 0 for _, _, objects in template[progress:]) and len(occurrences) > 1
+    return occurrences[tearing_down]
+
+
+def template_names(app_names, templates: dict) -> list:
+    # Name of every app, joined with the apps having the very same op template
+    return ["/".join(other for other in dict.fromkeys(app_names) if templates[other] == templates[name]) for name in app_names]
+
+
+def attribute(columns: dict, schedule: list, templates: dict, app_names=APP_NAMES, concurrent: bool = False):
+    # Returns the owner of every record (index into the returned app labels, -1 if unattributed), the labels, the
+    # number of records several concurrently running apps were due, and the labels of the apps whose records stopped
+    # short of the end of their template
+    instances = sorted(set(schedule), key=schedule.index)
+    names = template_names(app_names, templates)
+    labels = [f"{names[index % len(app_names)]}#{index}" for index in instances]
+    ops = [templates[app_names[index % len(app_names)]] for index in instances]
+    progress = [0] * len(instances)
+    # what is left of the op each app is due
+    due = [app_ops[0] if app_ops else None for app_ops in ops]
+    signatures = op_signatures(columns)
+    owners = np.full(len(signatures), -1, dtype=np.int64)
+    ties = 0
+    for row, signature in enumerate(signatures):
+        candidates = [app for app in range(len(instances)) if due[app] is not None and covers(due[app], signature)]
+        # a whole op before part of a bulk free
+        candidates = [app for app in candidates if due[app] == signature] or candidates
+        if not candidates:
+            continue
+        if concurrent and sum(1 for app in candidates if progress[app] or due[app] != ops[app][0]) > 1:
+            ties += 1
+        app = min(candidates, key=lambda app: schedule_rank(schedule, instances[app], ops[app], progress[app]))
+        owners[row] = app
+        due[app] = tuple(left - done for left, done in zip(due[app], signature))
+        if not any(due[app]):
+            progress[app] += 1
+            due[app] = ops[app][progress[app]] if progress[app] < len(ops[app]) else None
+    unfinished = [label for app, label in enumerate(labels) if progress[app] < len(ops[app])]
+    return owners, labels, ties, unfinished
+
+
+def app_streams(columns: dict, owners: np.ndarray, labels: list) -> dict:
+    # Per app, over the whole run: bytes and objects it holds, the fragmentation change of its own ops summed up,
+    # and the counter steps (slab resets, retype failures, OOMs) that happened on its ops
+    deltas = op_deltas(columns)
+    fragmentation = np.diff(np.asarray(columns["lhs_fragmentation"], dtype=np.int64) + np.asarray(columns["in_between_fragmentation"], dtype=np.int64), prepend=0)
+    steps = {counter: np.diff(np.asarray(columns[counter], dtype=np.int64), prepend=0) for counter in COUNTERS}
+    streams = {}
+    for app, label in enumerate(labels + [UNATTRIBUTED]):
+        mine = owners == (app if label != UNATTRIBUTED else -1)
+        streams[label] = {
+            "ops": mine,
+            "bytes_in_use": np.cumsum(np.where(mine, deltas["bytes_in_use"], 0)),
+            "objs_in_use": np.cumsum(np.where(mine, deltas["objs_in_use"], 0)),
+            "fragmentation": np.cumsum(np.where(mine, fragmentation, 0)),
+            **{counter: np.cumsum(np.where(mine, steps[counter], 0)) for counter in COUNTERS},
+        }
+    return streams
+
+
+def summarize(streams: dict) -> dict:
+    summary = {}
+    for label, stream in streams.items():
+        if not stream["ops"].any():
+            continue
+        summary[label] = {
+            "ops": int(stream["ops"].sum()),
+            "peak_bytes_in_use": int(stream["bytes_in_use"].max()),
+            "peak_objs_in_use": int(stream["objs_in_use"].max()),
+            "peak_fragmentation": int(stream["fragmentation"].max()),
+            "final_fragmentation": int(stream["fragmentation"][-1]),
+            **{counter: int(stream[counter][-1]) for counter in COUNTERS},
+        }
+    return summary
+
+
+def print_summary(summary: dict, ties: int, records: int, unfinished: list):
+    print(f"{'app':<16}{'ops':>6}{'peak bytes':>12}{'peak objs':>11}{'peak frag':>11}{'final frag':>12}{'resets':>8}{'retype':>8}{'oom':>6}")
+    for label, stats in summary.items():
+        print(f"{label:<16}{stats['ops']:>6}{stats['peak_bytes_in_use']:>12}{stats['peak_objs_in_use']:>11}{stats['peak_fragmentation']:>11}"
+              f"{stats['final_fragmentation']:>12}{stats['slab_resets']:>8}{stats['untyped_too_small']:>8}{stats['oom']:>6}")
+    if ties:
+        print(f"{ties} of {records} records matched the next op of several running apps, their split between those apps is a guess")
+    if unfinished:
+        print(f"The records of {', '.join(unfinished)} do not follow their apps_standalone op sequence to the end, check the --apps order")
+
+
+def plot_streams(columns: dict, streams: dict, args: argparse.Namespace):
+    import matplotlib.pyplot as plt
+    from plot_style import configure
+
+    configure(args.draft, font_scale=1.5)
+    labels = [label for label, stream in streams.items() if stream["ops"].any()]
+    ops = np.arange(len(columns["bytes_in_use"]))
+    fig, axs = plt.subplots(2, figsize=(20, 14), sharex=True)
+    # stacked per-app bytes in-use add up to the recorded total, up to unattributed records
+    polys = axs[0].stackplot(ops, [streams[label]["bytes_in_use"] for label in labels], labels=labels, step="post", alpha=0.8)
+    axs[0].plot(ops, columns["bytes_in_use"], color="black", linewidth=1, label="Recorded total")
+    for label, poly in zip(labels, polys):
+        color = poly.get_facecolor()[0]
+        axs[1].step(ops, streams[label]["fragmentation"], where="post", color=color, linewidth=2, label=label)
+        # which app's ops the slab resets and OOMs happened on
+        for counter, marker in (("slab_resets", "v"), ("oom", "X")):
+            rows = np.flatnonzero(np.diff(streams[label][counter], prepend=0) > 0)
+            axs[0].scatter(rows, columns["bytes_in_use"][rows], marker=marker, s=120, color=color, edgecolors="black")
+    axs[0].scatter([], [], marker="v", color="white", edgecolors="black", label="Slab reset")
+    axs[0].scatter([], [], marker="X", color="white", edgecolors="black", label="Out of Memory")
+    axs[0].set_title("Bytes in-use per application")
+    axs[0].set_ylabel("Bytes")
+    axs[1].set_title("Fragmentation added by each application's ops")
+    axs[1].set_ylabel("Bytes")
+    axs[1].set_xlabel("Op")
+    for ax in axs:
+        ax.legend(loc="upper left")
+    plt.tight_layout()
+    makedirs(args.output_dir, exist_ok=True)
+    plt.savefig(Path(args.output_dir) / Path(f"APPS_{log_stem(args.log_file)}.png"))
+    plt.savefig(Path(args.output_dir) / Path(f"APPS_{log_stem(args.log_file)}.pdf"), bbox_inches="tight")
+    plt.close(fig)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Attribute the records of a sequential or concurrent application run to the applications, with per-app memory accounting."
+            )
+
+    parser.add_argument(
+            "--log_file",
+            type=str,
+            required=True,
+            help="Path to the profile log of a replay_seq_app or replay_concurr_app run.",
+            )
+    parser.add_argument(
+            "--results_dir",
+            type=str,
+            default=".",
+            help="Path pointing to the dir holding the result trees, the apps_standalone logs of the same strategy give the per-app op sequences.",
+            )
+    parser.add_argument(
+            "--strategy",
+            type=str,
+            choices=STRATEGIES,
+            help="Strategy of the standalone logs used, taken from the log file name by default.",
+            )
+    parser.add_argument(
+            "--apps",
+            nargs="+",
+            default=list(APP_NAMES),
+            help="Application names of the app indices in the run header, in the order of the robot script's app table.",
+            )
+    parser.add_argument(
+            "--output_dir",
+            type=str,
+            default="./plots/app_attribution",
+            help="Path pointing to dir in which the resulting plot will be saved.",
+            )
+    parser.add_argument(
+            "--output_json",
+            type=str,
+            help="If set, also write the per-app summary to this JSON file.",
+            )
+    parser.add_argument(
+            "--no_plot",
+            action="store_true",
+            help="If set, only print the per-app summary.",
+            )
+    parser.add_argument(
+            "--draft",
+            action="store_true",
+            help="If set, render quickly through Agg with mathtext instead of pgf/pdflatex, for iterating on plots.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    run = parse_run_name(args.log_file) or {}
+    strategy = args.strategy or run.get("strategy")
+    if strategy is None:
+        raise SystemExit("Can not tell the strategy from the log file name, pass --strategy")
+    templates = find_templates(args.results_dir, strategy, args.cache_dir, not args.no_cache)
+    missing = sorted(set(args.apps) - set(templates))
+    if missing:
+        raise SystemExit(f"No {strategy} apps_standalone log in {args.results_dir} for {', '.join(missing)}")
+
+    columns = load_columns(args.log_file, PROFILE_COLUMNS, args.cache_dir, not args.no_cache).columns
+    workload, schedule = read_schedule(args.log_file)
+    owners, labels, ties, unfinished = attribute(columns, schedule, templates, args.apps, workload == "replay_concurr_app")
+    streams = app_streams(columns, owners, labels)
+    summary = summarize(streams)
+    print_summary(summary, ties, len(owners), unfinished)
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump({"log_file": args.log_file, "ties": ties, "records": len(owners), "unfinished": unfinished, "apps": summary}, file, indent=2)
+    if not args.no_plot:
+        plot_streams(columns, streams, args)
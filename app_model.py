@@ -0,0 +1,263 @@
+import argparse
+import json
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from log_parser import PROFILE_COLUMNS
+from op_trace import TRACE_DTYPE, TraceWriter, iter_ops
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+from runs import discover_runs, STRATEGIES
+from slab_sim import trace_from_columns
+
+# Stochastic model of the standalone applications, for replaying them at any length and concurrency.
+# An app run (session) is a first-order Markov chain over its ops: every allocation shape seen in the recordings
+# ((object size, objects) groups of one op), a mid-session free of the oldest live bundle, and the end of the session,
+# after which the app releases everything it holds in one op, as the recordings do. Transition counts are taken from
+# the apps_standalone logs, with --smoothing added between the states an app has shown, so sampled sessions vary in
+# order while keeping the shapes of the real app. A chain alone gives geometric session lengths, far longer than any
+# recording at times, so each session draws its length from the recorded ones within --length_jitter and only ends
+# there.
+# A sampled trace runs --instances app instances side by side, each op advancing a random running instance; an
+# instance whose session ended starts a new one, until --ops ops are written. Only the live objects of the running
+# instances are kept, rows are streamed to the trace file chunk by chunk.
+START, FREE, END = "start", "free", "end"
+CHUNK_ROWS = 1 << 16
+
+
+def op_states(trace: np.ndarray) -> list:
+    # State label per op of a standalone recording, the final frees left out (they are implied by END)
+    ops = list(iter_ops(trace))
+    last_alloc = max((i for i, (allocation, _) in enumerate(ops) if allocation), default=-1)
+    states = []
+    for allocation, rows in ops[:last_alloc + 1]:
+        if allocation:
+            shape = sorted(Counter(size for _, size in rows).items(), reverse=True)
+            states.append(json.dumps(shape))
+        else:
+            states.append(FREE)
+    return states
+
+
+def fit(sessions: list, smoothing: float) -> dict:
+    # {"states": [...], "transitions": row-normalized matrix}, rows and columns in state order, START first and END last
+    labels = sorted({state for session in sessions for state in session} - {FREE})
+    states = [START, *labels, *([FREE] if any(FREE in session for session in sessions) else []), END]
+    index = {state: i for i, state in enumerate(states)}
+    counts = np.zeros((len(states), len(states)))
+    for session in sessions:
+        path = [START, *session, END]
+        for current, following in zip(path, path[1:]):
+            counts[index[current], index[following]] += 1
+    # smoothing only between states the app uses, START never returns and nothing follows END
+    counts[:-1, 1:] += smoothing
+    counts[-1] = 0
+    counts[-1, -1] = 1
+    return {"states": states, "transitions": (counts / counts.sum(axis=1, keepdims=True)).tolist()}
+
+
+def find_recordings(args: argparse.Namespace) -> dict:
+    recordings = {}
+    if args.log_files:
+        for item in args.log_files:
+            app, path = item.split(":", 1)
+            recordings.setdefault(app, []).append(path)
+        return recordings
+    for run in discover_runs(args.results_dir, args.strategies):
+        if run["workload"] == "apps_standalone" and run["kind"] == "profile":
+            recordings.setdefault(run["app_name"], []).append(run["path"])
+    return recordings
+
+
+def fit_models(recordings: dict, args: argparse.Namespace) -> dict:
+    models = {}
+    for app, paths in sorted(recordings.items()):
+        sessions = [op_states(trace_from_columns(load_columns(path, PROFILE_COLUMNS, args.cache_dir, not args.no_cache).columns)) for path in paths]
+        models[app] = {**fit(sessions, args.smoothing), "recordings": paths, "recorded_ops": [len(session) for session in sessions]}
+    return models
+
+
+class Instance:
+    # One running app: its chain state, the ops left in its session and live bundles as (first object, object size,
+    # objects)
+
+    def __init__(self, model: dict, rng: np.random.Generator, length_jitter: float):
+        self.states = [None if state in (START, FREE, END) else json.loads(state) for state in model["states"]]
+        self.free = model["states"].index(FREE) if FREE in model["states"] else -1
+        self.end = len(self.states) - 1
+        # transitions without END, the session length decides when it ends
+        transitions = np.asarray(model["transitions"])[:, :-1]
+        totals = transitions.sum(axis=1, keepdims=True)
+        self.cumulative = np.cumsum(np.divide(transitions, totals, out=np.zeros_like(transitions), where=totals > 0), axis=1)
+        self.lengths = model["recorded_ops"]
+        self.rng = rng
+        self.length_jitter = length_jitter
+        self.state = 0
+        self.left = self.session_length()
+        self.live = []
+        self.sessions = 0
+
+    def session_length(self) -> int:
+        length = self.lengths[self.rng.integers(len(self.lengths))]
+        return max(1, round(length * (1 + self.length_jitter * (2 * self.rng.random() - 1))))
+
+    def step(self, draw: float):
+        # Returns (allocation, [(size, objects), ...]) for the op the instance does next, or a free of given bundles
+        if self.left == 0 or self.cumulative[self.state, -1] == 0:
+            # end of the session, release everything and start over
+            released, self.live, self.state = self.live, [], 0
+            self.left = self.session_length()
+            self.sessions += 1
+            return False, released
+        self.state = min(int(np.searchsorted(self.cumulative[self.state], draw, side="right")), self.end - 1)
+        self.left -= 1
+        if self.state == self.free:
+            if not self.live:
+                return None
+            return False, [self.live.pop(0)]
+        return True, self.states[self.state]
+
+
+def sample(models: dict, args: argparse.Namespace, writer: TraceWriter) -> dict:
+    rng = np.random.default_rng(args.seed)
+    apps = args.apps or sorted(models)
+    instances = [Instance(models[apps[i % len(apps)]], rng, args.length_jitter) for i in range(args.instances)]
+    rows = {field: array(code) for field, code in (("op", "Q"), ("obj", "Q"), ("size", "I"), ("allocation", "B"))}
+    next_obj, op = 0, 0
+
+    def flush():
+        chunk = np.empty(len(rows["op"]), dtype=TRACE_DTYPE)
+        for field, values in rows.items():
+            chunk[field] = np.frombuffer(values, dtype=values.typecode)
+            del values[:]
+        writer.write(chunk)
+
+    while op < args.ops:
+        n = min(CHUNK_ROWS, args.ops - op)
+        picks, draws = rng.integers(len(instances), size=n), rng.random(n)
+        for pick, draw in zip(picks.tolist(), draws.tolist()):
+            instance = instances[pick]
+            result = instance.step(draw)
+            if result is None or not result[1]:
+                continue
+            allocation, bundles = result
+            for bundle in bundles:
+                if allocation:
+                    size, count = bundle
+                    instance.live.append((next_obj, size, count))
+                    first = next_obj
+                    next_obj += count
+                else:
+                    first, size, count = bundle
+                for obj in range(first, first + count):
+                    rows["op"].append(op)
+                    rows["obj"].append(obj)
+                    rows["size"].append(size)
+                    rows["allocation"].append(allocation)
+            op += 1
+            if op == args.ops:
+                break
+        if len(rows["op"]) >= CHUNK_ROWS:
+            flush()
+    flush()
+    return {"ops": op, "objects": next_obj, "sessions": {f"{apps[i % len(apps)]}#{i}": instance.sessions for i, instance in enumerate(instances)}}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Fit a Markov model of each standalone app's allocations and sample concurrent app traces of any length, as a binary trace file."
+            )
+
+    parser.add_argument(
+            "--results_dir",
+            type=str,
+            default=".",
+            help="Path pointing to the dir holding the result trees whose apps_standalone profile logs are fitted.",
+            )
+    parser.add_argument(
+            "--log_files",
+            nargs="+",
+            help="app:path recordings to fit instead of discovering them in --results_dir.",
+            )
+    parser.add_argument(
+            "--strategies",
+            nargs="+",
+            choices=STRATEGIES,
+            default=["best_fit"],
+            help="Strategies whose recordings are fitted, the apps do the same ops under both.",
+            )
+    parser.add_argument(
+            "--smoothing",
+            type=float,
+            default=0.05,
+            help="Pseudo-count added between every pair of states of an app, 0 replays the recorded transitions only.",
+            )
+    parser.add_argument(
+            "--length_jitter",
+            type=float,
+            default=0.2,
+            help="Sessions last a recorded session length times a uniform factor within 1 +- this.",
+            )
+    parser.add_argument(
+            "--apps",
+            nargs="+",
+            help="Apps the instances run, assigned round-robin; defaults to every fitted app.",
+            )
+    parser.add_argument(
+            "--instances",
+            type=int,
+            default=4,
+            help="Number of app instances running concurrently.",
+            )
+    parser.add_argument(
+            "--ops",
+            type=int,
+            default=100000,
+            help="Number of ops of the sampled trace.",
+            )
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the random generator.")
+    parser.add_argument(
+            "--model_json",
+            type=str,
+            help="If set, write the fitted models to this JSON file.",
+            )
+    parser.add_argument(
+            "--output_file",
+            type=str,
+            help="Path of the binary trace to write, only the models are fitted if unset.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    models = fit_models(find_recordings(args), args)
+    if not models:
+        raise SystemExit("No apps_standalone recordings found")
+    missing = sorted(set(args.apps or ()) - set(models))
+    if missing:
+        raise SystemExit(f"No recording of {', '.join(missing)}")
+    for app, model in models.items():
+        print(f"{app}: {len(model['states']) - 2} states from {len(model['recordings'])} recordings of {', '.join(map(str, model['recorded_ops']))} ops")
+    if args.model_json:
+        with open(args.model_json, "w") as file:
+            json.dump(models, file, indent=2)
+    if args.output_file:
+        meta = {name: value for name, value in vars(args).items() if name not in ("output_file", "model_json", "cache_dir", "no_cache")}
+        with TraceWriter(args.output_file, meta) as writer:
+            result = sample(models, args, writer)
+        print(f"Wrote {writer.rows} rows ({result['ops']} ops, {result['objects']} objects) to {args.output_file}")
+        print("Sessions per instance: " + ", ".join(f"{name} {count}" for name, count in result["sessions"].items()))
@@ -0,0 +1,238 @@
+import argparse
+import json
+from os import makedirs
+from pathlib import Path
+
+import numpy as np
+
+from log_parser import PROFILE_COLUMNS, log_stem
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+from runs import discover_pairs
+from app_attribution import APP_NAMES, read_schedule, attribute, find_templates, op_signatures
+
+# Splits sequential application runs into phases and compares best_fit with next_fit phase by phase.
+# With the schedule from the run header ("replay_seq_app 0 0 1 1 ..."), every entry is a phase: the first time an app
+# index appears it starts, the second time it stops and releases what it still holds, with the records attributed to
+# the apps through app_attribution.py. Without a schedule, phases are the maximal runs of ops moving objs in-use in
+# the same direction (ramps and drops), found with vectorized diffs.
+# Footprint is the memory retyped out of the slabs, bytes in-use plus both fragmentations. When an app stops, its
+# reclamation efficiency is the footprint given back per byte freed (1 when the slabs holding it were reset), and its
+# reclamation time the ops until the footprint reaches its lowest point of the phase.
+METHODS = ("schedule", "changepoint")
+
+
+def schedule_phases(columns: dict, file_path: str, templates: dict, app_names=APP_NAMES):
+    # Phase index per record and a label per phase. Phases follow the schedule in order: a record goes to the next
+    # occurrence of its app, except that only the free leaving the app with no objects is its stop, the frees an app
+    # does while running stay in its start phase. Records no app matched stay in the phase before them.
+    workload, schedule = read_schedule(file_path)
+    owners, labels, _, _ = attribute(columns, schedule, templates, app_names, workload == "replay_concurr_app")
+    instances = sorted(set(schedule), key=schedule.index)
+    objects = np.array([signature[2] for signature in op_signatures(columns)])
+    positions = {}
+    for position, index in enumerate(schedule):
+        positions.setdefault(index, []).append(position)
+    live = [0] * len(instances)
+    phases = np.zeros(len(owners), dtype=np.int64)
+    current = 0
+    for row, owner in enumerate(owners.tolist()):
+        if owner >= 0:
+            live[owner] += int(objects[row])
+            occurrences = [position for position in positions[instances[owner]] if position >= current]
+            if occurrences:
+                stops = live[owner] == 0 and objects[row] < 0 and len(occurrences) > 1
+                current = occurrences[1 if stops else 0]
+        phases[row] = current
+    names = []
+    for position, index in enumerate(schedule):
+        stop = positions[index].index(position) > 0
+        names.append(f"{'stop' if stop else 'start'} {labels[instances.index(index)]}")
+    return phases, names
+
+
+def changepoint_phases(columns: dict):
+    # Runs of ops with the same sign of objs in-use change; ops not changing it stay in the current run
+    direction = np.sign(np.diff(np.asarray(columns["objs_in_use"], dtype=np.int64), prepend=0))
+    direction = direction[np.maximum.accumulate(np.where(direction != 0, np.arange(len(direction)), 0))]
+    phases = np.cumsum(np.diff(direction, prepend=direction[:1]) != 0)
+    names = ["ramp" if direction[np.argmax(phases == phase)] >= 0 else "drop" for phase in range(int(phases[-1]) + 1 if len(phases) else 0)]
+    return phases, names
+
+
+def phase_metrics(columns: dict, phases: np.ndarray, names: list) -> list:
+    bytes_in_use = np.asarray(columns["bytes_in_use"], dtype=np.int64)
+    fragmentation = np.asarray(columns["lhs_fragmentation"], dtype=np.int64) + np.asarray(columns["in_between_fragmentation"], dtype=np.int64)
+    footprint = bytes_in_use + fragmentation
+    metrics = []
+    for phase, name in enumerate(names):
+        rows = np.flatnonzero(phases == phase)
+        if len(rows) == 0:
+            continue
+        first, last = rows[0], rows[-1]
+        # values before the phase, all zero before the first record
+        before = {name: int(values[first - 1]) if first else 0 for name, values in
+                  (("bytes_in_use", bytes_in_use), ("fragmentation", fragmentation), ("footprint", footprint),
+                   *((counter, np.asarray(columns[counter])) for counter in ("slab_resets", "untyped_too_small", "oom")))}
+        stats = {
+            "phase": name,
+            "first_op": int(first),
+            "ops": len(rows),
+            "peak_bytes_in_use": int(bytes_in_use[rows].max()),
+            "mean_bytes_in_use": float(bytes_in_use[rows].mean()),
+            "peak_footprint": int(footprint[rows].max()),
+            "fragmentation_growth": int(fragmentation[last]) - before["fragmentation"],
+            **{counter: int(columns[counter][last]) - before[counter] for counter in ("slab_resets", "untyped_too_small", "oom")},
+        }
+        freed = before["bytes_in_use"] - int(bytes_in_use[last])
+        if freed > 0:
+            lowest = int(np.argmin(footprint[rows]))
+            stats["bytes_freed"] = freed
+            stats["reclamation_efficiency"] = (before["footprint"] - int(footprint[rows][lowest])) / freed
+            stats["reclamation_ops"] = lowest + 1
+        metrics.append(stats)
+    return metrics
+
+
+def split_run(file_path: str, method: str, templates: dict, args: argparse.Namespace):
+    columns = load_columns(file_path, PROFILE_COLUMNS, args.cache_dir, not args.no_cache).columns
+    if method == "schedule":
+        phases, names = schedule_phases(columns, file_path, templates, args.apps)
+    else:
+        phases, names = changepoint_phases(columns)
+    return columns, phases, phase_metrics(columns, phases, names)
+
+
+def print_comparison(name: str, metrics: dict):
+    print(name)
+    strategies = list(metrics)
+    print(f"  {'phase':<22}" + "".join(f"{strategy + ' ' + column:>24}" for column in ("peak in-use", "frag growth", "resets", "reclaimed", "reclaim ops") for strategy in strategies))
+    # phases side by side by name, a phase one strategy has no records in is left empty
+    phases = list(dict.fromkeys(stats["phase"] for stats_list in metrics.values() for stats in stats_list))
+    by_phase = [{stats["phase"]: stats for stats in stats_list} for stats_list in metrics.values()]
+    for phase in phases:
+        rows = [phase_stats.get(phase, {}) for phase_stats in by_phase]
+        cells = []
+        for column in ("peak_bytes_in_use", "fragmentation_growth", "slab_resets", "reclamation_efficiency", "reclamation_ops"):
+            for stats in rows:
+                value = stats.get(column)
+                cells.append(f"{'-':>24}" if value is None else f"{value:>24.2f}" if isinstance(value, float) else f"{value:>24}")
+        print(f"  {phase:<22}" + "".join(cells))
+
+
+def plot_comparison(name: str, runs: dict, args: argparse.Namespace):
+    import matplotlib.pyplot as plt
+    from plot_style import configure
+
+    configure(args.draft, font_scale=1.5)
+    fig, axs = plt.subplots(len(runs) + 1, figsize=(20, 7 * (len(runs) + 1)))
+    for ax, (strategy, (columns, phases, metrics)) in zip(axs, runs.items()):
+        ops = np.arange(len(columns["bytes_in_use"]))
+        footprint = np.asarray(columns["bytes_in_use"]) + np.asarray(columns["lhs_fragmentation"]) + np.asarray(columns["in_between_fragmentation"])
+        ax.plot(ops, columns["bytes_in_use"], linewidth=2, label="Bytes in-use")
+        ax.plot(ops, footprint, linewidth=2, label="Footprint (in-use + fragmentation)")
+        for i, stats in enumerate(metrics):
+            # stopping phases shaded, every phase labelled at its start
+            if "bytes_freed" in stats:
+                ax.axvspan(stats["first_op"] - 0.5, stats["first_op"] + stats["ops"] - 0.5, color="tab:red", alpha=0.1)
+            ax.axvline(stats["first_op"] - 0.5, color="gray", linewidth=0.5)
+            ax.annotate(stats["phase"], (stats["first_op"], 1), xycoords=("data", "axes fraction"), rotation=90, va="top", fontsize="small")
+        ax.set_title(strategy)
+        ax.set_xlabel("Op")
+        ax.set_ylabel("Bytes")
+        ax.legend(loc="upper right")
+    # reclamation efficiency of every phase that freed memory, per strategy
+    width = 0.8 / len(runs)
+    freeing = list(dict.fromkeys(stats["phase"] for _, _, metrics in runs.values() for stats in metrics if "bytes_freed" in stats))
+    for i, (strategy, (_, _, metrics)) in enumerate(runs.items()):
+        efficiency = {stats["phase"]: stats["reclamation_efficiency"] for stats in metrics if "bytes_freed" in stats}
+        axs[-1].bar(np.arange(len(freeing)) + i * width, [efficiency.get(phase, np.nan) for phase in freeing], width=width, label=strategy)
+    axs[-1].set_xticks(np.arange(len(freeing)) + width * (len(runs) - 1) / 2, freeing, rotation=30, ha="right")
+    axs[-1].axhline(1, color="black", linewidth=1)
+    axs[-1].set_title("Footprint given back per byte freed")
+    axs[-1].set_ylabel("Reclamation efficiency")
+    axs[-1].legend(loc="upper right")
+    plt.tight_layout()
+    makedirs(args.output_dir, exist_ok=True)
+    plt.savefig(Path(args.output_dir) / f"PHASES_{name}.png")
+    plt.savefig(Path(args.output_dir) / f"PHASES_{name}.pdf", bbox_inches="tight")
+    plt.close(fig)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Split sequential application runs into phases and compare best_fit with next_fit per phase, including how they reclaim memory when an app stops."
+            )
+
+    parser.add_argument(
+            "--results_dir",
+            type=str,
+            default=".",
+            help="Path pointing to the dir holding the best_fit/ and next_fit/ result trees.",
+            )
+    parser.add_argument(
+            "--method",
+            type=str,
+            choices=METHODS,
+            default="schedule",
+            help="schedule: phases from the replay_seq_app argument list, changepoint: ramps and drops of objs in-use.",
+            )
+    parser.add_argument(
+            "--apps",
+            nargs="+",
+            default=list(APP_NAMES),
+            help="Application names of the app indices in the run header, in order.",
+            )
+    parser.add_argument(
+            "--output_dir",
+            type=str,
+            default="./plots/app_phases",
+            help="Path pointing to dir in which the resulting plots will be saved.",
+            )
+    parser.add_argument(
+            "--output_json",
+            type=str,
+            help="If set, also write the per-phase metrics to this JSON file.",
+            )
+    parser.add_argument(
+            "--no_plot",
+            action="store_true",
+            help="If set, only print the per-phase tables.",
+            )
+    parser.add_argument(
+            "--draft",
+            action="store_true",
+            help="If set, render quickly through Agg with mathtext instead of pgf/pdflatex, for iterating on plots.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = []
+    for best_run, next_run in discover_pairs(args.results_dir):
+        if best_run["workload"] != "apps_sequential" or best_run["kind"] != "profile":
+            continue
+        runs = {}
+        for run in (best_run, next_run):
+            templates = find_templates(args.results_dir, run["strategy"], args.cache_dir, not args.no_cache) if args.method == "schedule" else {}
+            runs[run["strategy"]] = split_run(run["path"], args.method, templates, args)
+        name = log_stem(best_run["path"]).replace("_best_fit", "")
+        print_comparison(name, {strategy: metrics for strategy, (_, _, metrics) in runs.items()})
+        report.append({"run": name, **{strategy: metrics for strategy, (_, _, metrics) in runs.items()}})
+        if not args.no_plot:
+            plot_comparison(name, runs, args)
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump(report, file, indent=2)
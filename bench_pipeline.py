@@ -0,0 +1,327 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from log_parser import KIND_COLUMNS, OUTPUT_TAG, format_log_line, format_record, open_log, find_workload_start, iter_records, columns_from_records, load_columns
+
+# Benchmarks the analysis pipeline itself on synthetic uart5 logs of growing size, in the formats the parsers accept.
+# Every stage runs in a fresh process, so its time is not skewed by what an earlier stage left in memory and its peak
+# RSS is its own. Stages build on each other (decode reads, build decodes), the exclusive time of a stage is its time
+# minus the time of the stage it builds on. Results are appended to a JSON history to track the pipeline over time.
+SCENARIOS = {
+    # name: (record kind, first line of the run, plot module rendering it)
+    "synthetic_latency": ("latency", "Begin synthetic workload!", "plot_allocation_latency"),
+    "synthetic_stats": ("stats", "Begin synthetic workload!", "plot_memory_stats_per_slab"),
+    "replay_app": ("profile", "CANTRIP> [sreplay_app hello best_fit", "plot_memory_profiles"),
+    "replay_seq_app": ("profile", "CANTRIP> [sreplay_seq_app  0 1 2 1 2 3 best_fit", "plot_memory_profiles"),
+}
+STAGES = ("read", "decode", "build", "load_columns", "render", "save")
+# Stage each stage builds on, for the exclusive times
+STAGE_BASE = {"decode": "read", "build": "decode"}
+DEFAULT_SIZES = (1000, 10000, 100000)
+SLABS = 22
+# Memory stats runs print only per-slab snapshots, one before the first op and one every this many ops
+SNAPSHOT_EVERY = 250
+GENERATE_CHUNK = 1 << 16
+# Part of the generated log names, bumped when generate_log changes so stale logs are not reused
+GENERATOR_VERSION = 2
+DEFAULT_HISTORY = "bench_history.json"
+
+
+def synthetic_columns(kind: str, rng: np.random.Generator, count: int) -> dict:
+    # Plausible record values: a bounded random walk of the heap, cumulative event counters, heavy-tailed latencies
+    allocation = rng.random(count) < 0.6
+    sizes = (1 << rng.integers(4, 15, count)).astype(np.int64)
+    bytes_in_use = np.clip(np.cumsum(np.where(allocation, sizes, -sizes)), 0, 1 << 21)
+    counters = {name: np.cumsum(rng.random(count) < chance) for name, chance in (("slab_resets", 0.002), ("untyped_too_small", 0.001), ("oom", 0.0005))}
+    columns = {
+        "bytes_in_use": bytes_in_use,
+        "bytes_requested": np.cumsum(np.where(allocation, sizes, 0)),
+        "objs_in_use": np.maximum(np.cumsum(np.where(allocation, 1, -1)), 0),
+        **counters,
+    }
+    if kind == "latency":
+        columns["instruction_count"] = rng.lognormal(8, 1, count).astype(np.int64) + 500
+        columns["allocation"] = allocation
+    else:
+        columns["bytes_free"] = (1 << 21) + (1 << 19) - bytes_in_use
+        columns["lhs_fragmentation"] = (bytes_in_use * rng.uniform(0, 0.3, count)).astype(np.int64)
+        columns["in_between_fragmentation"] = (bytes_in_use * rng.uniform(0, 0.1, count)).astype(np.int64)
+    return columns
+
+
+def snapshot_columns(rng: np.random.Generator, index: np.ndarray, counters: dict) -> dict:
+    capacity = np.tile(524288 >> np.minimum(np.arange(SLABS) // 2, 10), (len(index), 1))
+    occupied = (capacity * rng.uniform(0, 1, capacity.shape)).astype(np.int64)
+    return {
+        "idx": index + 1,
+        **{name: values[index] for name, values in counters.items()},
+        "lhs_fragmentation_per_slab": (occupied * rng.uniform(0, 0.3, capacity.shape)).astype(np.int64),
+        "in_between_fragmentation_per_slab": (occupied * rng.uniform(0, 0.1, capacity.shape)).astype(np.int64),
+        "occupied_memory_per_slab": occupied,
+        "available_space_per_slab": capacity,
+    }
+
+
+def write_lines(file, text: str, seconds: float):
+    # Every line twice, as Renode prints it: once as "[output]" and once with the virtual time
+    line = format_log_line(text, seconds)
+    file.write(line)
+    file.write(line.replace(OUTPUT_TAG, f"[virt: {seconds:6.2f}s (+0.6ms)]", 1))
+
+
+def generate_log(file_path: Path, scenario: str, count: int, seed: int):
+    kind, header, _ = SCENARIOS[scenario]
+    rng = np.random.default_rng(seed)
+    tmp_path = file_path.with_name(".tmp_" + file_path.name)
+    with open(tmp_path, "w") as file:
+        write_lines(file, header, 0)
+        if kind == "stats":
+            counters = {name: np.zeros(1, dtype=np.int64) for name in ("slab_resets", "untyped_too_small", "oom")}
+            write_lines(file, format_record("stats", {name: values[0] for name, values in snapshot_columns(rng, np.array([-1]), counters).items()}), 0)
+        for start in range(0, count, GENERATE_CHUNK):
+            stop = min(start + GENERATE_CHUNK, count)
+            # stats runs draw the ops only for the counters of their snapshots
+            columns = synthetic_columns("profile" if kind == "stats" else kind, rng, stop - start)
+            if kind == "stats":
+                index = np.flatnonzero((np.arange(start, stop) + 1) % SNAPSHOT_EVERY == 0)
+                snapshot = snapshot_columns(rng, index, {name: columns[name] for name in ("slab_resets", "untyped_too_small", "oom")})
+                snapshot["idx"] = snapshot["idx"] + start
+                for n, i in enumerate(index.tolist()):
+                    write_lines(file, format_record("stats", {name: values[n] for name, values in snapshot.items()}), (start + i) * 0.0006)
+                continue
+            rows = [dict(zip(columns, values)) for values in zip(*(column.tolist() for column in columns.values()))]
+            for i, row in enumerate(rows):
+                write_lines(file, format_record(kind, row), (start + i) * 0.0006)
+        write_lines(file, "Done :)", count * 0.0006)
+    tmp_path.replace(file_path)
+
+
+def log_path(work_dir: str, scenario: str, count: int, seed: int) -> Path:
+    # Generated logs are kept and reused, generating the large ones takes longer than parsing them
+    path = Path(work_dir) / f"{scenario}_{count}_seed_{seed}_v{GENERATOR_VERSION}.log"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        generate_log(path, scenario, count, seed)
+    return path
+
+
+def peak_rss() -> int:
+    # bytes, ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_stage(stage: str, scenario: str, file_path: str, options: dict) -> dict:
+    # Runs in a fresh process; returns the seconds of the stage (of render and save for "plot"), its peak RSS and the
+    # RSS before it started
+    kind, _, module_name = SCENARIOS[scenario]
+    columns = KIND_COLUMNS[kind]
+    timings = {}
+    if stage == "plot":
+        import importlib
+        import matplotlib.pyplot as plt
+
+        module = importlib.import_module(module_name)
+        if kind == "stats":
+            data = module.load_snapshots(file_path, use_cache=False)
+        else:
+            data = load_columns(file_path, columns).columns
+        args = argparse.Namespace(
+            best_fit_log_file=file_path, next_fit_log_file=file_path, output_dir=options["output_dir"], separate_axis=False,
+            max_points=options["max_points"], rasterize=False, draft=True, snapshots=4, cache_dir="", no_cache=True, parse_jobs=1,
+        )
+        # savefig still runs, it is only timed, so render is what plot_metrics spends outside of it
+        savefig = plt.savefig
+
+        def timed_savefig(*save_args, **save_kwargs):
+            start = time.perf_counter()
+            savefig(*save_args, **save_kwargs)
+            timings["save"] = timings.get("save", 0.0) + time.perf_counter() - start
+
+        plt.savefig = timed_savefig
+    base = peak_rss()
+    start = time.perf_counter()
+    if stage == "read":
+        with open_log(file_path) as file:
+            for _ in file:
+                pass
+    elif stage == "decode":
+        with open_log(file_path) as file:
+            find_workload_start(file, file_path)
+            for _ in iter_records(file):
+                pass
+    elif stage == "build":
+        with open_log(file_path) as file:
+            find_workload_start(file, file_path)
+            columns_from_records(iter_records(file), columns)
+    elif stage == "load_columns":
+        load_columns(file_path, columns, options["parse_jobs"])
+    else:
+        # the plot scripts print their own summaries, which would break up the results table
+        with contextlib.redirect_stdout(io.StringIO()):
+            module.plot_metrics(best_data=data, next_data=data, args=args)
+    seconds = time.perf_counter() - start
+    if stage == "plot":
+        timings["render"] = seconds - timings.get("save", 0.0)
+    else:
+        timings[stage] = seconds
+    return {"timings": timings, "peak_rss": peak_rss(), "base_rss": base}
+
+
+def measure(stage: str, scenario: str, file_path: str, options: dict, repeat: int) -> dict:
+    # Fastest of repeat fresh processes per timed stage, and the highest peak RSS seen
+    runs = []
+    context = multiprocessing.get_context("spawn")
+    for _ in range(repeat):
+        with context.Pool(1) as pool:
+            runs.append(pool.apply(run_stage, (stage, scenario, file_path, options)))
+    memory = {
+        "peak_rss_mb": max(run["peak_rss"] for run in runs) / (1 << 20),
+        "stage_rss_mb": max(run["peak_rss"] - run["base_rss"] for run in runs) / (1 << 20),
+    }
+    return {name: {"seconds": min(run["timings"][name] for run in runs), **memory} for name in runs[0]["timings"]}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def read_history(file_path: str) -> list:
+    try:
+        with open(file_path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return []
+
+
+def previous_results(history: list) -> dict:
+    # Latest recorded seconds per (scenario, records, stage)
+    previous = {}
+    for entry in history:
+        for result in entry["results"]:
+            previous[(result["scenario"], result["records"], result["stage"])] = result["seconds"]
+    return previous
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Time every stage of the parse -> extract -> plot pipeline on synthetic logs of growing size."
+            )
+
+    parser.add_argument(
+            "--scenarios",
+            nargs="+",
+            choices=list(SCENARIOS),
+            default=list(SCENARIOS),
+            help="Log formats to benchmark.",
+            )
+    parser.add_argument(
+            "--sizes",
+            nargs="+",
+            type=int,
+            default=list(DEFAULT_SIZES),
+            help=f"Numbers of ops per log, up to 10000000 (generating the largest logs takes minutes and GBs of disk); stats logs hold one snapshot per {SNAPSHOT_EVERY} ops.",
+            )
+    parser.add_argument(
+            "--stages",
+            nargs="+",
+            choices=STAGES,
+            default=list(STAGES),
+            help="Stages to time.",
+            )
+    parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Runs per stage, the fastest is kept.",
+            )
+    parser.add_argument(
+            "--parse_jobs",
+            type=int,
+            default=1,
+            help="Worker processes used by the load_columns stage on large logs.",
+            )
+    parser.add_argument(
+            "--max_points",
+            type=int,
+            default=6000,
+            help="Most records drawn per line in the render stage, as in the plot scripts.",
+            )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated logs.")
+    parser.add_argument(
+            "--work_dir",
+            type=str,
+            default="./.bench_logs",
+            help="Path pointing to dir in which generated logs and plots are kept between runs.",
+            )
+    parser.add_argument(
+            "--history_file",
+            type=str,
+            default=DEFAULT_HISTORY,
+            help="JSON file the results are appended to, and compared against.",
+            )
+    parser.add_argument(
+            "--no_history",
+            action="store_true",
+            help="If set, only print the results.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    history = read_history(args.history_file)
+    previous = previous_results(history)
+    options = {"parse_jobs": args.parse_jobs, "max_points": args.max_points, "output_dir": str(Path(args.work_dir) / "plots")}
+
+    results = []
+    print(f"{'scenario':<20}{'records':>10}{'stage':>14}{'seconds':>10}{'exclusive':>11}{'rec/s':>12}{'peak MB':>9}{'stage MB':>10}{'vs last':>9}")
+    for scenario in args.scenarios:
+        for count in args.sizes:
+            file_path = str(log_path(args.work_dir, scenario, count, args.seed))
+            measured = {}
+            # render and save come out of one run of the plot script
+            runs = [stage for stage in args.stages if stage not in ("render", "save")]
+            if "render" in args.stages or "save" in args.stages:
+                runs.append("plot")
+            stage_results = {}
+            for run in runs:
+                stage_results.update(measure(run, scenario, file_path, options, args.repeat))
+            for stage in (stage for stage in STAGES if stage in args.stages):
+                result = stage_results[stage]
+                measured[stage] = result["seconds"]
+                base = STAGE_BASE.get(stage)
+                exclusive = result["seconds"] - measured[base] if base in measured else result["seconds"]
+                result = {"scenario": scenario, "records": count, "stage": stage, **result, "exclusive_seconds": exclusive, "log_bytes": Path(file_path).stat().st_size}
+                results.append(result)
+                last = previous.get((scenario, count, stage))
+                speedup = f"{last / result['seconds']:.2f}x" if last and result["seconds"] else "-"
+                print(f"{scenario:<20}{count:>10}{stage:>14}{result['seconds']:>10.3f}{exclusive:>11.3f}{count / max(result['seconds'], 1e-9):>12.0f}"
+                      f"{result['peak_rss_mb']:>9.0f}{result['stage_rss_mb']:>10.0f}{speedup:>9}", flush=True)
+
+    if not args.no_history:
+        history.append({
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": multiprocessing.cpu_count(),
+            "results": results,
+        })
+        with open(args.history_file, "w") as file:
+            json.dump(history, file, indent=1)
@@ -0,0 +1,270 @@
+import argparse
+import json
+from os import makedirs
+from pathlib import Path
+
+import numpy as np
+
+from log_parser import KIND_COLUMNS
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+from runs import discover_runs, STRATEGIES, INT_PARAMS
+from derived_metrics import with_derived
+
+# Compares any number of strategies, each with any number of runs (seeds), instead of one best_fit / next_fit pair.
+# Every run is resampled onto one common grid of op indices or bytes requested, so the runs of a strategy stack into
+# a (run x grid point) matrix per metric: aggregates over seeds, and deltas / ratios against the baseline strategy,
+# are then plain reductions over the run axis.
+# Discovered runs are only pooled when they differ in seed alone: every workload and parameter set (dealloc chance,
+# app, sequence, count) is compared on its own.
+ALIGN_AXES = ("op", "bytes_requested")
+DEFAULT_METRICS = ("bytes_in_use", "lhs_fragmentation", "in_between_fragmentation")
+AGGREGATES = ("mean", "std", "min", "median", "max")
+
+
+def comparison_key(run: dict) -> str:
+    # Workload and every run parameter but the seed
+    params = [f"{name}={run[name]}" for name in (*INT_PARAMS, "app_name") if name in run and name != "seed"]
+    return " ".join([run["workload"], *params])
+
+
+def collect_inputs(args: argparse.Namespace) -> dict:
+    # {comparison: {strategy label: [log path, ...]}}, from explicit label:path inputs (one comparison) or from the
+    # results dir, one comparison per workload and parameter set
+    if args.inputs:
+        groups = {}
+        for item in args.inputs:
+            label, path = item.split(":", 1)
+            groups.setdefault(label, []).append(path)
+        return {"inputs": groups}
+    filters = dict(item.split("=", 1) for item in args.filter)
+    comparisons = {}
+    for run in discover_runs(args.results_dir, args.strategies):
+        if run["kind"] != args.kind or (args.workload and run["workload"] != args.workload):
+            continue
+        if all(str(run.get(name)) == value for name, value in filters.items()):
+            comparisons.setdefault(comparison_key(run), {}).setdefault(run["strategy"], []).append(run["path"])
+    return dict(sorted(comparisons.items()))
+
+
+def axis_values(columns: dict, axis: str) -> np.ndarray:
+    if axis == "op":
+        return np.arange(len(columns["bytes_requested"]), dtype=float)
+    return np.asarray(columns[axis], dtype=float)
+
+
+def common_grid(runs: list, axis: str, points: int) -> np.ndarray:
+    # Only the range every run covers, so no run is extrapolated
+    end = min(axis_values(columns, axis)[-1] for columns in runs)
+    start = max(axis_values(columns, axis)[0] for columns in runs)
+    return np.linspace(start, end, points)
+
+
+def align(runs: list, metric: str, axis: str, grid: np.ndarray) -> np.ndarray:
+    # (run x grid point) matrix; bytes requested stays flat over frees, interp then takes the last value at a tie
+    return np.stack([np.interp(grid, axis_values(columns, axis), np.asarray(columns[metric], dtype=float)) for columns in runs])
+
+
+def aggregate(matrix: np.ndarray) -> dict:
+    return {
+        "mean": matrix.mean(axis=0),
+        "std": matrix.std(axis=0),
+        "min": matrix.min(axis=0),
+        "median": np.median(matrix, axis=0),
+        "max": matrix.max(axis=0),
+    }
+
+
+def compare(name: str, groups: dict, metrics, axis: str, points: int, baseline: str) -> dict:
+    grid = common_grid([columns for runs in groups.values() for columns in runs], axis, points)
+    result = {"comparison": name, "axis": axis, "grid": grid, "baseline": baseline, "metrics": {}}
+    for metric in metrics:
+        series = {label: aggregate(align(runs, metric, axis, grid)) for label, runs in groups.items()}
+        base = series[baseline]["mean"]
+        for label, stats in series.items():
+            stats["delta"] = stats["mean"] - base
+            with np.errstate(divide="ignore", invalid="ignore"):
+                stats["ratio"] = np.where(base != 0, stats["mean"] / base, np.nan)
+            # per-run summaries, before alignment, so peaks between grid points are not lost
+            stats["runs"] = len(groups[label])
+            stats["final"] = [float(columns[metric][-1]) for columns in groups[label]]
+            stats["peak"] = [float(np.max(columns[metric])) for columns in groups[label]]
+            # the grid is uniform, so this is the average over the whole aligned range
+            stats["average"] = float(np.mean(stats["mean"]))
+        result["metrics"][metric] = series
+    return result
+
+
+def format_spread(values: list) -> str:
+    # byte and count metrics as whole numbers, ratios (derived metrics) with their significant digits
+    spec = ".0f" if all(float(value).is_integer() for value in values) else ".4g"
+    return f"{np.mean(values):{spec}} +- {np.std(values):{spec}}"
+
+
+def print_table(result: dict):
+    for metric, series in result["metrics"].items():
+        print(f"{result['comparison']}: {metric} (aligned on {result['axis']}, baseline {result['baseline']})")
+        print(f"  {'strategy':<16}{'runs':>6}{'final':>24}{'peak':>24}{'mean ratio':>12}")
+        base_average = series[result["baseline"]]["average"]
+        for label, stats in series.items():
+            final, peak = format_spread(stats["final"]), format_spread(stats["peak"])
+            ratio = f"{stats['average'] / base_average:.3f}" if base_average else "-"
+            print(f"  {label:<16}{stats['runs']:>6}{final:>24}{peak:>24}{ratio:>12}")
+
+
+def plot_comparison(result: dict, args: argparse.Namespace):
+    import matplotlib.pyplot as plt
+    from plot_style import configure
+
+    configure(args.draft, font_scale=1.5)
+    grid = result["grid"]
+    metrics = result["metrics"]
+    fig, axs = plt.subplots(len(metrics), 2, figsize=(20, 6 * len(metrics)), squeeze=False)
+    fig.suptitle(result["comparison"])
+    for row, (metric, series) in enumerate(metrics.items()):
+        title = metric.replace("_", " ").title()
+        for label, stats in series.items():
+            line, = axs[row][0].plot(grid, stats["mean"], label=f"{label} ({stats['runs']} runs)", linewidth=2)
+            if stats["runs"] > 1:
+                axs[row][0].fill_between(grid, stats["min"], stats["max"], color=line.get_color(), alpha=0.2)
+            if label != result["baseline"]:
+                axs[row][1].plot(grid, stats["ratio"], label=label, color=line.get_color(), linewidth=2)
+        axs[row][0].set_title(f"{title}, mean and min/max over runs")
+        axs[row][0].set_ylabel(title)
+        axs[row][1].axhline(1, color="black", linewidth=1)
+        axs[row][1].set_title(f"{title}, ratio to {result['baseline']}")
+        for ax in axs[row]:
+            ax.set_xlabel("Op" if result["axis"] == "op" else "Bytes Requested")
+            ax.legend()
+            ax.grid(True)
+    plt.tight_layout()
+    makedirs(args.output_dir, exist_ok=True)
+    name = f"compare_{args.kind}_{result['axis']}_" + result["comparison"].replace(" ", "_").replace("=", "_")
+    plt.savefig(Path(args.output_dir) / f"{name}.png")
+    plt.savefig(Path(args.output_dir) / f"{name}.pdf", bbox_inches="tight")
+    plt.close(fig)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Compare any number of strategies over any number of runs each, aligned on op index or bytes requested."
+            )
+
+    parser.add_argument(
+            "--inputs",
+            nargs="+",
+            help="Runs as strategy:path, repeat a strategy label for several seeds. Replaces discovery in --results_dir.",
+            )
+    parser.add_argument(
+            "--results_dir",
+            type=str,
+            default=".",
+            help="Path pointing to the dir holding one result tree per strategy.",
+            )
+    parser.add_argument(
+            "--strategies",
+            nargs="+",
+            default=list(STRATEGIES),
+            help="Strategies (result tree names) to discover in --results_dir.",
+            )
+    parser.add_argument(
+            "--kind",
+            type=str,
+            choices=["profile", "latency"],
+            default="profile",
+            help="Kind of log compared.",
+            )
+    parser.add_argument(
+            "--workload",
+            type=str,
+            help="Only compare runs of this workload, e.g. random_uniform.",
+            )
+    parser.add_argument(
+            "--filter",
+            nargs="*",
+            default=[],
+            help="Only compare runs with these parameters, e.g. dealloc_chance=16 count=1000. Runs left differing only in seed are pooled.",
+            )
+    parser.add_argument(
+            "--metrics",
+            nargs="+",
+            default=list(DEFAULT_METRICS),
+            help="Columns compared, parsed or derived (see derived_metrics.py, e.g. utilization).",
+            )
+    parser.add_argument(
+            "--align",
+            type=str,
+            choices=ALIGN_AXES,
+            default="bytes_requested",
+            help="Axis the runs are aligned on.",
+            )
+    parser.add_argument(
+            "--grid_points",
+            type=int,
+            default=2000,
+            help="Number of points of the common grid.",
+            )
+    parser.add_argument(
+            "--baseline",
+            type=str,
+            help="Strategy the others are compared against, the first one by default.",
+            )
+    parser.add_argument(
+            "--output_dir",
+            type=str,
+            default="./plots/comparisons",
+            help="Path pointing to dir in which the resulting plot will be saved.",
+            )
+    parser.add_argument(
+            "--output_json",
+            type=str,
+            help="If set, also write the aligned aggregates to this JSON file.",
+            )
+    parser.add_argument(
+            "--no_plot",
+            action="store_true",
+            help="If set, only print the comparison table.",
+            )
+    parser.add_argument(
+            "--draft",
+            action="store_true",
+            help="If set, render quickly through Agg with mathtext instead of pgf/pdflatex, for iterating on plots.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    comparisons = collect_inputs(args)
+    if not comparisons:
+        raise SystemExit("No runs to compare")
+    results = []
+    for name, paths in comparisons.items():
+        baseline = args.baseline or next(iter(paths))
+        if len(paths) < 2 or baseline not in paths:
+            print(f"{name}: only {', '.join(paths)} runs, nothing to compare against {baseline}")
+            continue
+        groups = {
+            label: [with_derived(load_columns(path, KIND_COLUMNS[args.kind], args.cache_dir, not args.no_cache).columns) for path in label_paths]
+            for label, label_paths in paths.items()
+        }
+        result = compare(name, groups, args.metrics, args.align, args.grid_points, baseline)
+        print_table(result)
+        results.append(result)
+        if not args.no_plot:
+            plot_comparison(result, args)
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            # ratios against a zero baseline are NaN, written as null
+            json.dump(results, file, allow_nan=False, default=lambda value: [None if np.isnan(item) else item for item in value.tolist()] if value.dtype.kind == "f" else value.tolist())
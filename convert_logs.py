@@ -0,0 +1,79 @@
+import argparse
+import os
+from pathlib import Path
+
+from log_parser import ARCHIVE_SUFFIX, LOG_SUFFIXES, log_stem, write_archive
+from runs import parse_run_name
+
+# Converts raw uart5 logs (plain, .gz or .zst) into compressed column archives: every record kind of a log stored as
+# int64 / bool columns, per-slab vectors as (record x slab) arrays, without the duplicated "[virt:" lines and the
+# key names repeated on every line. All parsing entry points read the archives directly.
+
+
+def suffix_rank(path: Path) -> int:
+    return next(i for i, suffix in enumerate(LOG_SUFFIXES) if path.name.endswith(suffix))
+
+
+def find_logs(inputs, output_dir: str = None) -> list:
+    # (log path, archive path) pairs, one log per archive: when a run is stored in several formats the one cheapest to
+    # parse is converted, as runs.discover_runs would pick it. Under output_dir, result logs go to the
+    # <strategy>/<workload>/ dir their name gives, whether the results root, a strategy tree, a workload dir or the
+    # logs themselves were passed, so the result trees stay discoverable; other logs keep their path relative to the
+    # input dir.
+    archives = {}
+    for path in map(Path, inputs):
+        if path.is_dir():
+            found = [(log, log.parent.relative_to(path)) for suffix in LOG_SUFFIXES if suffix != ARCHIVE_SUFFIX for log in path.rglob(f"*{suffix}")]
+        else:
+            found = [(path, Path())]
+        for log, relative in found:
+            run = parse_run_name(log)
+            if run is not None:
+                relative = Path(run["strategy"], run["workload"])
+            archive = (Path(output_dir) / relative if output_dir else log.parent) / f"{log_stem(log)}{ARCHIVE_SUFFIX}"
+            if archive in archives:
+                kept, skipped = sorted((archives[archive], log), key=suffix_rank)
+                print(f"Skipping {skipped}, {kept} is converted to the same archive")
+                log = kept
+            archives[archive] = log
+    return sorted((log, archive) for archive, log in archives.items())
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Convert log files produced by the robot script into compact column archives (.npz)."
+            )
+
+    parser.add_argument(
+            "inputs",
+            nargs="+",
+            help="Log files, or dirs searched recursively for .log / .log.gz / .log.zst files: the results root, strategy trees or workload dirs.",
+            )
+    parser.add_argument(
+            "--output_dir",
+            type=str,
+            help="Path pointing to dir in which the archives are written as a results root, result logs under the <strategy>/<workload>/ dir of their name whichever input they were found through, other logs keeping their path relative to the input dir; next to each log by default.",
+            )
+    parser.add_argument(
+            "--remove_source",
+            action="store_true",
+            help="If set, delete each log once its archive has been written.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    total_in, total_out = 0, 0
+    for log_path, archive_path in find_logs(args.inputs, args.output_dir):
+        archive_path.parent.mkdir(parents=True, exist_ok=True)
+        write_archive(str(archive_path), str(log_path))
+
+        size_in, size_out = log_path.stat().st_size, archive_path.stat().st_size
+        total_in, total_out = total_in + size_in, total_out + size_out
+        print(f"{log_path} -> {archive_path}: {size_in} -> {size_out} bytes")
+        if args.remove_source:
+            os.remove(log_path)
+    if total_in:
+        print(f"Total: {total_in} -> {total_out} bytes ({100 * total_out / total_in:.1f}%)")
@@ -0,0 +1,165 @@
+import argparse
+import json
+
+import numpy as np
+
+from log_parser import KIND_COLUMNS
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+from runs import discover_runs, STRATEGIES, WORKLOADS
+
+# Efficiency indices derived from the raw columns of a run, as whole-run NumPy columns next to the parsed ones.
+# Committed memory is what the slabs have retyped: bytes in-use plus both fragmentations. "bytes free" is everything
+# else, so the lhs (watermarking) fragmentation is the part of it no allocation can use until its slab resets.
+# Profile logs give:
+#   utilization                  bytes in-use / committed
+#   external_fragmentation       lhs fragmentation / bytes free
+#   fragmentation_per_object     (lhs + in-between fragmentation) / objs in-use
+#   bytes_reclaimed              committed memory given back by a free op, 0 on the other ops
+# Profile and latency logs give:
+#   slab_resets_per_1k_ops       slab resets per 1000 ops over the last RATE_WINDOW ops (fewer at the start)
+# Stats logs give, per snapshot:
+#   slab_utilization             (snapshot x slab) bytes in-use / slab size
+#   slab_imbalance               highest slab utilization over the mean one, minus 1 (0 when evenly spread)
+# An index whose denominator is 0 takes the value of a run wasting nothing (utilization 1, the others 0), so no
+# column holds NaN and the summaries stay comparable between runs.
+RATE_WINDOW = 1000
+
+
+def ratio(numerator, denominator, empty: float = 0.0) -> np.ndarray:
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    return np.divide(numerator, denominator, out=np.full(np.broadcast(numerator, denominator).shape, empty), where=denominator != 0)
+
+
+def derive(columns: dict) -> dict:
+    # Derived columns computable from the given ones, see above
+    derived = {}
+    if "slab_resets" in columns and "idx" not in columns:
+        resets = np.asarray(columns["slab_resets"], dtype=np.int64)
+        before = np.concatenate([np.zeros(min(RATE_WINDOW, len(resets)), dtype=np.int64), resets[:-RATE_WINDOW]])
+        derived["slab_resets_per_1k_ops"] = (resets - before) * 1000 / np.minimum(np.arange(1, len(resets) + 1), RATE_WINDOW)
+    if "lhs_fragmentation" in columns:
+        lhs = np.asarray(columns["lhs_fragmentation"], dtype=np.int64)
+        fragmentation = lhs + np.asarray(columns["in_between_fragmentation"], dtype=np.int64)
+        committed = np.asarray(columns["bytes_in_use"], dtype=np.int64) + fragmentation
+        freeing = np.diff(np.asarray(columns["objs_in_use"], dtype=np.int64), prepend=0) < 0
+        derived["utilization"] = ratio(columns["bytes_in_use"], committed, empty=1.0)
+        derived["external_fragmentation"] = ratio(lhs, columns["bytes_free"])
+        derived["fragmentation_per_object"] = ratio(fragmentation, columns["objs_in_use"])
+        derived["bytes_reclaimed"] = np.where(freeing, -np.diff(committed, prepend=0), 0)
+    if "occupied_memory_per_slab" in columns:
+        in_use = (np.asarray(columns["occupied_memory_per_slab"], dtype=np.int64)
+                  - np.asarray(columns["lhs_fragmentation_per_slab"], dtype=np.int64)
+                  - np.asarray(columns["in_between_fragmentation_per_slab"], dtype=np.int64))
+        utilization = ratio(in_use, columns["available_space_per_slab"])
+        mean = utilization.mean(axis=1) if utilization.shape[1] else np.zeros(len(utilization))
+        derived["slab_utilization"] = utilization
+        derived["slab_imbalance"] = ratio(utilization.max(axis=1, initial=0) - mean, mean)
+    return derived
+
+
+def with_derived(columns: dict) -> dict:
+    return {**columns, **derive(columns)}
+
+
+def mean(values, empty: float = 0.0) -> float:
+    return float(np.mean(values)) if np.size(values) else empty
+
+
+def summarize(columns: dict) -> dict:
+    # One row of numbers per run: means over the ops, extremes and whole-run rates
+    derived = derive(columns)
+    summary = {}
+    if "slab_resets_per_1k_ops" in derived:
+        resets = np.asarray(columns["slab_resets"])
+        summary["slab_resets_per_1k_ops"] = float(resets[-1]) * 1000 / len(resets) if len(resets) else 0.0
+        # peak over full windows only, the first ops alone say little; a run shorter than one window has its own rate
+        summary["peak_slab_resets_per_1k_ops"] = float(derived["slab_resets_per_1k_ops"][RATE_WINDOW - 1:].max(initial=summary["slab_resets_per_1k_ops"]))
+    if "utilization" in derived:
+        freeing = np.diff(np.asarray(columns["objs_in_use"], dtype=np.int64), prepend=0) < 0
+        summary["mean_utilization"] = mean(derived["utilization"], empty=1.0)
+        summary["min_utilization"] = float(derived["utilization"].min(initial=1))
+        summary["mean_external_fragmentation"] = mean(derived["external_fragmentation"])
+        summary["peak_external_fragmentation"] = float(derived["external_fragmentation"].max(initial=0))
+        summary["mean_fragmentation_per_object"] = mean(derived["fragmentation_per_object"])
+        summary["bytes_reclaimed_per_free"] = mean(derived["bytes_reclaimed"][freeing])
+    if "slab_imbalance" in derived:
+        summary["mean_slab_utilization"] = mean(derived["slab_utilization"])
+        summary["mean_slab_imbalance"] = mean(derived["slab_imbalance"])
+        summary["peak_slab_imbalance"] = float(derived["slab_imbalance"].max(initial=0))
+    return summary
+
+
+def print_table(rows: list):
+    names = list(dict.fromkeys(name for row in rows for name in row["summary"]))
+    for row in rows:
+        print(f"{row['run']} ({row['kind']})")
+        for name in names:
+            if name in row["summary"]:
+                print(f"  {name:<32}{row['summary'][name]:>14.4f}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Compute derived utilization, fragmentation, reset rate, reclamation and per-slab balance indices of result logs and export one summary row per run."
+            )
+
+    parser.add_argument(
+            "--results_dir",
+            type=str,
+            default=".",
+            help="Path pointing to the dir holding the best_fit/ and next_fit/ result trees.",
+            )
+    parser.add_argument(
+            "--log_files",
+            nargs="+",
+            help="kind:path logs to summarize instead of discovering them in --results_dir.",
+            )
+    parser.add_argument(
+            "--strategies",
+            nargs="+",
+            default=list(STRATEGIES),
+            choices=STRATEGIES,
+            help="Strategies whose runs are summarized.",
+            )
+    parser.add_argument(
+            "--workloads",
+            nargs="+",
+            default=list(WORKLOADS),
+            choices=WORKLOADS,
+            help="Workloads whose runs are summarized.",
+            )
+    parser.add_argument(
+            "--output_json",
+            type=str,
+            help="If set, also write the summary rows to this JSON file.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.log_files:
+        runs = [dict(zip(("kind", "path"), item.split(":", 1))) for item in args.log_files]
+    else:
+        runs = [run for run in discover_runs(args.results_dir, args.strategies) if run["workload"] in args.workloads]
+    rows = []
+    for run in runs:
+        columns = load_columns(run["path"], KIND_COLUMNS[run["kind"]], args.cache_dir, not args.no_cache).columns
+        rows.append({"run": run["path"], "kind": run["kind"], **{field: run[field] for field in ("strategy", "workload", "params") if field in run}, "summary": summarize(columns)})
+    print_table(rows)
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump(rows, file, indent=2)
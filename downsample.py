@@ -0,0 +1,79 @@
+import numpy as np
+
+# Level-of-detail reduction of long series before plotting. Rows are split into equal buckets (a few per pixel
+# column at the default budget) and only the first and last row of a bucket plus the lowest and highest row of every
+# series in it are kept, so spikes and the envelope look the same as with every row drawn. Rows flagged in keep
+# (OOM, slab reset steps) always survive. Buckets are reduced a block at a time so memory-mapped columns are never
+# loaded whole.
+DEFAULT_MAX_POINTS = 6000
+BLOCK_ROWS = 1 << 20
+# Zoomable views (zoom_report.py) keep every row plus min/max levels, each this many times coarser than the one before
+DEFAULT_PYRAMID_FACTOR = 8
+DEFAULT_PYRAMID_BUCKETS = 2048
+
+
+def step_rows(counter: np.ndarray) -> np.ndarray:
+    # Mask of the rows where a cumulative counter changes and the rows just before, which keeps the steps sharp
+    counter = np.asarray(counter)
+    steps = np.diff(counter, prepend=counter[:1]) != 0
+    steps[:-1] |= steps[1:]
+    return steps
+
+
+def lod_indices(series, max_points: int = DEFAULT_MAX_POINTS, keep: np.ndarray = None) -> np.ndarray:
+    # Sorted row indices to plot for series sharing one x axis, all of them if they already fit in max_points.
+    # NaN values are ignored, so one column can be split into several series by masking it.
+    rows = len(series[0])
+    if max_points <= 0 or rows <= max_points:
+        return np.arange(rows)
+    buckets = max(1, max_points // (2 + 2 * len(series)))
+    size = -(-rows // buckets)
+    block = max(1, BLOCK_ROWS // size) * size
+
+    picked = [np.arange(0, rows, size), np.minimum(np.arange(size, rows + size, size), rows) - 1]
+    for start in range(0, rows, block):
+        stop = min(start + block, rows)
+        starts = np.arange(start, stop, size)
+        for y in series:
+            y = np.asarray(y[start:stop], dtype=float)
+            y = np.pad(y, (0, len(starts) * size - len(y)), constant_values=np.nan).reshape(-1, size)
+            nan = np.isnan(y)
+            picked.append(starts + np.argmin(np.where(nan, np.inf, y), axis=1))
+            picked.append(starts + np.argmax(np.where(nan, -np.inf, y), axis=1))
+    if keep is not None:
+        picked.append(np.flatnonzero(keep))
+    return np.unique(np.minimum(np.concatenate(picked), rows - 1))
+
+
+def rasterize_lines(fig, rasterize: bool = True):
+    # Draw the dense line layers as an image inside vector output, axes, text and markers stay vector
+    for ax in fig.axes:
+        for line in ax.get_lines():
+            line.set_rasterized(rasterize)
+
+
+def minmax_pyramid(values, factor: int = DEFAULT_PYRAMID_FACTOR, min_buckets: int = DEFAULT_PYRAMID_BUCKETS) -> list:
+    # Coarser levels of one series for zoomable views, [(mins, maxs), ...] with level k holding the extremes of
+    # factor**k consecutive rows (level 0 is the series itself, not repeated), down to the first level with at most
+    # min_buckets buckets. The first level is reduced a block at a time, the later ones from the level before.
+    rows = len(values)
+    levels = []
+    if rows <= min_buckets:
+        return levels
+    block = max(1, BLOCK_ROWS // factor) * factor
+    mins, maxs = [], []
+    for start in range(0, rows, block):
+        y = np.asarray(values[start:start + block])
+        buckets = -(-len(y) // factor)
+        # the last bucket is padded with its own first value, which changes neither extreme
+        y = np.concatenate([y, np.full(buckets * factor - len(y), y[-(len(y) % factor or factor)])]).reshape(buckets, factor)
+        mins.append(y.min(axis=1))
+        maxs.append(y.max(axis=1))
+    levels.append((np.concatenate(mins), np.concatenate(maxs)))
+    while len(levels[-1][0]) > min_buckets:
+        mins, maxs = levels[-1]
+        pad = -len(mins) % factor
+        mins = np.concatenate([mins, np.repeat(mins[-1:], pad)]).reshape(-1, factor).min(axis=1)
+        maxs = np.concatenate([maxs, np.repeat(maxs[-1:], pad)]).reshape(-1, factor).max(axis=1)
+        levels.append((mins, maxs))
+    return levels
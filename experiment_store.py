@@ -0,0 +1,302 @@
+import argparse
+import re
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+
+from log_parser import KIND_COLUMNS, PROFILE_COLUMNS, LATENCY_COLUMNS
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+from runs import discover_runs
+from latency_stats import LatencyHistogram, OPS, EVENTS, PERCENTILES, run_histograms
+from derived_metrics import summarize
+
+# Every run of the result trees in one SQLite file: the run metadata from the file name as indexed columns, the
+# per-op records, per-run summaries and, for latency runs, the instruction count histograms (see latency_stats.py),
+# so percentiles over any group of runs are pooled exactly without going back to the logs.
+# Re-ingesting only re-reads logs whose size or mtime changed, or every log when the store was written with another
+# SUMMARY_VERSION (kept in the SQLite user_version); bump it whenever run_summaries or the stored columns change.
+DEFAULT_DB = "experiments.sqlite"
+SUMMARY_VERSION = 1
+RUN_FIELDS = ("kind", "workload", "strategy", "params", "seed", "count", "dealloc_chance", "app_name", "sequence")
+OP_COLUMNS = tuple(dict.fromkeys((*PROFILE_COLUMNS, *LATENCY_COLUMNS)))
+POOLED_PERCENTILE = re.compile(r"^(alloc|free)_p([\d.]+)$")
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    workload TEXT NOT NULL,
+    strategy TEXT NOT NULL,
+    params TEXT NOT NULL,
+    seed INTEGER,
+    count INTEGER,
+    dealloc_chance INTEGER,
+    app_name TEXT,
+    sequence INTEGER,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_run ON runs (strategy, workload, kind);
+CREATE INDEX IF NOT EXISTS runs_seed ON runs (seed);
+CREATE INDEX IF NOT EXISTS runs_dealloc_chance ON runs (dealloc_chance);
+CREATE INDEX IF NOT EXISTS runs_app_name ON runs (app_name);
+CREATE INDEX IF NOT EXISTS runs_sequence ON runs (sequence);
+CREATE TABLE IF NOT EXISTS ops (
+    run_id INTEGER NOT NULL REFERENCES runs ON DELETE CASCADE,
+    op INTEGER NOT NULL,
+    {", ".join(f"{name} INTEGER" for name in OP_COLUMNS)},
+    PRIMARY KEY (run_id, op)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS summaries (
+    run_id INTEGER NOT NULL REFERENCES runs ON DELETE CASCADE,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (run_id, metric)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS summaries_metric ON summaries (metric, run_id);
+CREATE TABLE IF NOT EXISTS histograms (
+    run_id INTEGER NOT NULL REFERENCES runs ON DELETE CASCADE,
+    op TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (run_id, op, bucket)
+) WITHOUT ROWID;
+"""
+
+
+def connect(db_path: str = DEFAULT_DB) -> sqlite3.Connection:
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def run_summaries(run: dict, columns: dict) -> dict:
+    summaries = {"records": len(next(iter(columns.values())))}
+    for counter in ("slab_resets", "untyped_too_small", "oom"):
+        summaries[counter] = int(columns[counter][-1]) if len(columns[counter]) else 0
+    summaries.update(summarize(columns))
+    if run["kind"] == "stats":
+        return summaries
+    summaries["peak_bytes_in_use"] = int(np.max(columns["bytes_in_use"], initial=0))
+    summaries["peak_objs_in_use"] = int(np.max(columns["objs_in_use"], initial=0))
+    if run["kind"] == "profile":
+        fragmentation = np.asarray(columns["lhs_fragmentation"]) + np.asarray(columns["in_between_fragmentation"])
+        summaries["peak_fragmentation"] = int(np.max(fragmentation, initial=0))
+        summaries["final_fragmentation"] = int(fragmentation[-1]) if len(fragmentation) else 0
+    return summaries
+
+
+def op_histograms(columns: dict) -> dict:
+    histograms = run_histograms(columns)
+    totals = {op: LatencyHistogram() for op in OPS}
+    for op in OPS:
+        for event in EVENTS:
+            totals[op].merge(histograms[(op, event)])
+    return totals
+
+
+def store_run(connection: sqlite3.Connection, run: dict, columns: dict, stat):
+    connection.execute("DELETE FROM runs WHERE path = ?", (run["path"],))
+    cursor = connection.execute(
+        f"INSERT INTO runs ({', '.join(RUN_FIELDS)}, path, size, mtime_ns) VALUES ({', '.join('?' * (len(RUN_FIELDS) + 3))})",
+        (*(run.get(field) for field in RUN_FIELDS), run["path"], stat.st_size, stat.st_mtime_ns),
+    )
+    run_id = cursor.lastrowid
+    summaries = run_summaries(run, columns)
+    if run["kind"] != "stats":
+        names = [name for name in OP_COLUMNS if name in columns]
+        rows = zip(*(np.asarray(columns[name]).astype(np.int64).tolist() for name in names))
+        connection.executemany(
+            f"INSERT INTO ops (run_id, op, {', '.join(names)}) VALUES (?, ?, {', '.join('?' * len(names))})",
+            ((run_id, op, *values) for op, values in enumerate(rows)),
+        )
+    if run["kind"] == "latency":
+        for op, histogram in op_histograms(columns).items():
+            if len(histogram) == 0:
+                continue
+            buckets = np.flatnonzero(histogram.counts)
+            connection.executemany(
+                "INSERT INTO histograms (run_id, op, bucket, count) VALUES (?, ?, ?, ?)",
+                ((run_id, op, bucket, count) for bucket, count in zip(buckets.tolist(), histogram.counts[buckets].tolist())),
+            )
+            summaries[f"{op}_count"] = len(histogram)
+            summaries[f"{op}_max"] = histogram.max
+            summaries[f"{op}_mean"] = float(np.mean(np.asarray(columns["instruction_count"])[np.asarray(columns["allocation"]) == (op == "alloc")]))
+            for p, value in zip(PERCENTILES, histogram.percentiles()):
+                summaries[f"{op}_p{p:g}"] = int(value)
+    connection.executemany("INSERT INTO summaries (run_id, metric, value) VALUES (?, ?, ?)", ((run_id, metric, value) for metric, value in summaries.items()))
+
+
+def ingest(connection: sqlite3.Connection, results_dir: str, cache_dir: str = DEFAULT_CACHE_DIR, use_cache: bool = True):
+    # Returns the number of runs (re-)read and the number dropped because their log is gone
+    stored = {path: (size, mtime_ns) for path, size, mtime_ns in connection.execute("SELECT path, size, mtime_ns FROM runs")}
+    if connection.execute("PRAGMA user_version").fetchone()[0] != SUMMARY_VERSION:
+        # summaries of another version, every run is read again
+        stored = {path: None for path in stored}
+    # runs are keyed on their absolute path, so a log reached through another spelling of --results_dir is the same run
+    read = 0
+    for run in discover_runs(results_dir):
+        run = {**run, "path": str(Path(run["path"]).resolve())}
+        stat = Path(run["path"]).stat()
+        if stored.get(run["path"]) == (stat.st_size, stat.st_mtime_ns):
+            continue
+        columns = load_columns(run["path"], KIND_COLUMNS[run["kind"]], cache_dir, use_cache).columns
+        with connection:
+            store_run(connection, run, columns, stat)
+        read += 1
+    # relative paths stored by earlier versions depend on the directory ingest ran from, their runs are read again
+    gone = [(path,) for path in stored if not Path(path).is_absolute() or not Path(path).exists()]
+    with connection:
+        connection.executemany("DELETE FROM runs WHERE path = ?", gone)
+        connection.execute(f"PRAGMA user_version = {SUMMARY_VERSION}")
+    return read, len(gone)
+
+
+def where_clause(filters: dict):
+    for field in filters:
+        if field not in RUN_FIELDS:
+            raise ValueError(f"Unknown run field {field}, expected one of {', '.join(RUN_FIELDS)}")
+    clause = " AND ".join(f"runs.{field} = ?" for field in filters)
+    return (f" AND {clause}" if clause else ""), list(filters.values())
+
+
+def query(connection: sqlite3.Connection, metric: str, by=(), **filters) -> list:
+    # One row per group of runs: the group values, the number of runs and the metric. alloc_pN / free_pN of latency
+    # runs are pooled from the histograms, other metrics are the mean, min and max of the per-run summaries.
+    for field in by:
+        if field not in RUN_FIELDS:
+            raise ValueError(f"Unknown run field {field}, expected one of {', '.join(RUN_FIELDS)}")
+    where, values = where_clause(filters)
+    group = ", ".join(f"runs.{field}" for field in by)
+    match = POOLED_PERCENTILE.match(metric)
+    if match is not None:
+        op, percentile = match[1], float(match[2])
+        maxima = connection.execute(
+            f"SELECT {group + ', ' if group else ''}COUNT(*), MAX(value) FROM summaries JOIN runs USING (run_id) "
+            f"WHERE metric = ?{where} {'GROUP BY ' + group if group else ''} {'ORDER BY ' + group if group else ''}",
+            [f"{op}_max", *values],
+        ).fetchall()
+        rows = []
+        for *key, runs, maximum in maxima:
+            key_where, key_values = where_clause({**filters, **dict(zip(by, key))})
+            buckets = connection.execute(
+                f"SELECT histograms.bucket, SUM(histograms.count) FROM histograms JOIN runs USING (run_id) WHERE histograms.op = ?{key_where} GROUP BY histograms.bucket",
+                [op, *key_values],
+            ).fetchall()
+            histogram = LatencyHistogram()
+            histogram.counts = np.zeros(max(bucket for bucket, _ in buckets) + 1, dtype=np.int64)
+            for bucket, count in buckets:
+                histogram.counts[bucket] = count
+            histogram.max = int(maximum)
+            rows.append({**dict(zip(by, key)), "runs": runs, metric: int(histogram.percentiles((percentile,))[0])})
+        return rows
+    result = connection.execute(
+        f"SELECT {group + ', ' if group else ''}COUNT(*), AVG(value), MIN(value), MAX(value) FROM summaries JOIN runs USING (run_id) "
+        f"WHERE metric = ?{where} {'GROUP BY ' + group if group else ''} {'ORDER BY ' + group if group else ''}",
+        [metric, *values],
+    ).fetchall()
+    return [{**dict(zip(by, key)), "runs": runs, metric: mean, "min": low, "max": high} for *key, runs, mean, low, high in result]
+
+
+def print_rows(rows: list, columns: list):
+    widths = [max([len(str(column))] + [len(format_cell(row[i])) for row in rows]) for i, column in enumerate(columns)]
+    print("  ".join(f"{str(column):>{width}}" for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(f"{format_cell(value):>{width}}" for value, width in zip(row, widths)))
+
+
+def format_cell(value) -> str:
+    return f"{value:.6g}" if isinstance(value, float) else str(value)
+
+
+def parse_filter(text: str):
+    field, _, value = text.partition("=")
+    return field, int(value) if value.lstrip("-").isdigit() else value
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Load every run into an indexed SQLite store and query run summaries and pooled percentiles from it."
+            )
+
+    parser.add_argument(
+            "--db",
+            type=str,
+            default=DEFAULT_DB,
+            help="Path to the SQLite store.",
+            )
+    parser.add_argument(
+            "--ingest",
+            action="store_true",
+            help="If set, first load new or changed runs of --results_dir into the store and drop runs whose log is gone.",
+            )
+    parser.add_argument(
+            "--results_dir",
+            type=str,
+            default=".",
+            help="Path pointing to the dir holding the best_fit/ and next_fit/ result trees.",
+            )
+    parser.add_argument(
+            "--metric",
+            type=str,
+            help="Summary to query, e.g. peak_fragmentation, oom or alloc_p99 (alloc_pN / free_pN are pooled over the runs of a group).",
+            )
+    parser.add_argument(
+            "--by",
+            nargs="+",
+            default=[],
+            choices=RUN_FIELDS,
+            help="Run fields to group the runs by.",
+            )
+    parser.add_argument(
+            "--where",
+            nargs="+",
+            default=[],
+            type=parse_filter,
+            help="Run field filters, e.g. strategy=next_fit kind=latency.",
+            )
+    parser.add_argument(
+            "--sql",
+            type=str,
+            help="Run this SQL statement against the store and print the result instead.",
+            )
+    parser.add_argument(
+            "--list_metrics",
+            action="store_true",
+            help="If set, list the summaries available in the store.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    with closing(connect(args.db)) as connection:
+        if args.ingest:
+            read, dropped = ingest(connection, args.results_dir, args.cache_dir, not args.no_cache)
+            print(f"Ingested {read} runs, dropped {dropped}, {connection.execute('SELECT COUNT(*) FROM runs').fetchone()[0]} runs in {args.db}")
+        if args.list_metrics:
+            for (metric,) in connection.execute("SELECT DISTINCT metric FROM summaries ORDER BY metric"):
+                print(metric)
+        if args.sql:
+            cursor = connection.execute(args.sql)
+            print_rows(cursor.fetchall(), [column[0] for column in cursor.description or ()])
+        if args.metric:
+            rows = query(connection, args.metric, args.by, **dict(args.where))
+            columns = list(rows[0]) if rows else [*args.by, "runs", args.metric]
+            print_rows([list(row.values()) for row in rows], columns)
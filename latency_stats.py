@@ -0,0 +1,294 @@
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+
+from log_parser import LATENCY_COLUMNS, VIRT_COLUMNS, VIRT_MISSING
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+from runs import discover_runs, parse_run_name
+
+# Summary statistics of the instruction count per alloc / free, built from log-bucketed (HDR style) histograms so runs
+# of any length are reduced in one streaming pass and histograms of several runs can simply be added up.
+# Values below 2 * SUB_BUCKETS are counted exactly, above that every power of two is split into SUB_BUCKETS linear
+# buckets, i.e. a relative error below 1 / SUB_BUCKETS.
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+PERCENTILES = (50, 90, 99, 99.9)
+OPS = ("alloc", "free")
+# Every op falls in exactly one event class, the most expensive event it caused
+EVENTS = ("oom", "untyped_too_small", "slab_reset", "none")
+CHUNK_ROWS = 1 << 20
+# Virtual time (see VIRT_COLUMNS) is compared with the instruction count by percentile rank within a run: an op
+# ranking this much higher by virtual time than by instructions spent its time outside the counted instructions,
+# e.g. in kernel Untyped Retype work
+VIRT_RANK_GAP = 0.5
+
+
+def bucket_index(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.int64)
+    # frexp gives the bit length of the value, exact for instruction counts below 2^53
+    shift = np.maximum(np.frexp(values.astype(float))[1] - SUB_BUCKET_BITS - 1, 0)
+    return (shift * SUB_BUCKETS + (values >> shift)).astype(np.int64)
+
+
+def bucket_value(index: np.ndarray) -> np.ndarray:
+    # Highest value counted in each bucket, as HDR histograms report percentiles
+    index = np.asarray(index, dtype=np.int64)
+    shift = np.maximum(index // SUB_BUCKETS - 1, 0)
+    return ((index - shift * SUB_BUCKETS) << shift) + (1 << shift) - 1
+
+
+class LatencyHistogram:
+
+    def __init__(self):
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.max = 0
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def record(self, values: np.ndarray):
+        if len(values) == 0:
+            return
+        counts = np.bincount(bucket_index(values))
+        if len(counts) > len(self.counts):
+            self.counts = np.pad(self.counts, (0, len(counts) - len(self.counts)))
+        self.counts[:len(counts)] += counts
+        self.max = max(self.max, int(np.max(values)))
+
+    def merge(self, other: "LatencyHistogram"):
+        if len(other.counts) > len(self.counts):
+            self.counts = np.pad(self.counts, (0, len(other.counts) - len(self.counts)))
+        self.counts[:len(other.counts)] += other.counts
+        self.max = max(self.max, other.max)
+
+    def count_at_least(self, value: int) -> int:
+        return int(self.counts[min(int(bucket_index([value])[0]), len(self.counts)):].sum())
+
+    def percentiles(self, percentiles=PERCENTILES, counts: np.ndarray = None) -> np.ndarray:
+        # counts may be a (resamples, buckets) matrix, giving one row of percentiles per resample
+        counts = self.counts if counts is None else counts
+        cumulative = np.cumsum(counts, axis=-1)
+        total = cumulative[..., -1:]
+        ranks = np.ceil(np.asarray(percentiles) / 100 * total).clip(min=1)
+        index = np.stack([np.argmax(cumulative >= rank[..., None], axis=-1) for rank in np.moveaxis(ranks, -1, 0)], axis=-1)
+        return np.minimum(bucket_value(index), self.max)
+
+    def bootstrap(self, percentiles=PERCENTILES, resamples: int = 1000, confidence: float = 95, seed: int = 0):
+        # Resampling the ops of a run with replacement is a multinomial draw over the buckets
+        total = len(self)
+        rng = np.random.default_rng(seed)
+        samples = self.percentiles(percentiles, rng.multinomial(total, self.counts / total, size=resamples))
+        tail = (100 - confidence) / 2
+        return np.percentile(samples, tail, axis=0), np.percentile(samples, 100 - tail, axis=0)
+
+
+def event_classes(columns: dict, start: int, stop: int) -> np.ndarray:
+    # Index into EVENTS per op, from the cumulative counters of the op and of the op before it
+    classes = np.full(stop - start, EVENTS.index("none"))
+    for event, counter in (("slab_reset", "slab_resets"), ("untyped_too_small", "untyped_too_small"), ("oom", "oom")):
+        previous = columns[counter][start - 1] if start else 0
+        increased = np.diff(np.asarray(columns[counter][start:stop]), prepend=previous) > 0
+        classes[increased] = EVENTS.index(event)
+    return classes
+
+
+def run_histograms(columns: dict) -> dict:
+    # One histogram per (op, event class), filled chunk by chunk so memory-mapped columns are never loaded whole
+    histograms = {(op, event): LatencyHistogram() for op in OPS for event in EVENTS + ("virt_delta",)}
+    for start in range(0, len(columns["instruction_count"]), CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, len(columns["instruction_count"]))
+        instruction_count = np.asarray(columns["instruction_count"][start:stop])
+        allocation = np.asarray(columns["allocation"][start:stop])
+        classes = event_classes(columns, start, stop)
+        for op, mask in (("alloc", allocation), ("free", ~allocation)):
+            for i, event in enumerate(EVENTS):
+                histograms[(op, event)].record(instruction_count[mask & (classes == i)])
+            if "virt_delta" in columns:
+                virt_delta = np.asarray(columns["virt_delta"][start:stop])
+                histograms[(op, "virt_delta")].record(virt_delta[mask & (virt_delta != VIRT_MISSING)])
+    return histograms
+
+
+def percentile_ranks(values: np.ndarray) -> np.ndarray:
+    # Mid-ranks in [0, 1], ties share their average rank
+    ordered = np.sort(values)
+    return (np.searchsorted(ordered, values, "left") + np.searchsorted(ordered, values, "right")) / (2 * len(values))
+
+
+def virt_outliers(columns: dict, rank_gap: float = VIRT_RANK_GAP):
+    # Ops whose virtual time ranks far above their instruction count, ranked separately for allocs and frees
+    instruction_count = np.asarray(columns["instruction_count"])
+    virt_delta = np.asarray(columns["virt_delta"])
+    allocation = np.asarray(columns["allocation"])
+    classes = event_classes(columns, 0, len(instruction_count))
+    outliers = []
+    for op, mask in (("alloc", allocation), ("free", ~allocation)):
+        rows = np.flatnonzero(mask & (virt_delta != VIRT_MISSING))
+        if len(rows) == 0:
+            continue
+        gap = percentile_ranks(virt_delta[rows]) - percentile_ranks(instruction_count[rows])
+        for i in np.flatnonzero(gap >= rank_gap):
+            row = int(rows[i])
+            outliers.append({
+                "op": op,
+                "row": row,
+                "instruction_count": int(instruction_count[row]),
+                "virt_delta": int(virt_delta[row]),
+                "event": EVENTS[classes[row]],
+                "rank_gap": float(gap[i]),
+            })
+    return outliers
+
+
+def group_key(run: dict) -> tuple:
+    # Runs differing only in seed or count are pooled
+    return run["strategy"], run["workload"], run.get("dealloc_chance", run.get("app_name", run.get("sequence")))
+
+
+def summarize(histograms: dict, outliers: list, args: argparse.Namespace) -> dict:
+    summary = {}
+    for op in OPS:
+        total = LatencyHistogram()
+        for event in EVENTS:
+            total.merge(histograms[(op, event)])
+        if len(total) == 0:
+            continue
+        low, high = total.bootstrap(PERCENTILES, args.resamples, args.confidence, args.seed)
+        stats = {"count": len(total), "max": total.max}
+        for p, value, lo, hi in zip(PERCENTILES, total.percentiles(), low, high):
+            stats[f"p{p:g}"] = {"value": int(value), "ci": [float(lo), float(hi)]}
+        # which events the ops at or above the tail percentile caused
+        threshold = int(total.percentiles((args.tail_percentile,))[0])
+        tail = {event: histograms[(op, event)].count_at_least(threshold) for event in EVENTS}
+        stats["tail"] = {"percentile": args.tail_percentile, "threshold": threshold, "events": tail}
+        stats["events"] = {
+            event: {"count": len(histograms[(op, event)]), "p50": int(histograms[(op, event)].percentiles((50,))[0]), "max": histograms[(op, event)].max}
+            for event in EVENTS if len(histograms[(op, event)])
+        }
+        virt = histograms[(op, "virt_delta")]
+        if len(virt):
+            # virtual time in microseconds, at the 100us resolution of the "[virt:" lines
+            stats["virt_delta"] = {**{f"p{p:g}": int(value) for p, value in zip(PERCENTILES, virt.percentiles())}, "max": virt.max}
+            flagged = [outlier for outlier in outliers if outlier["op"] == op]
+            stats["virt_outliers"] = {
+                "rank_gap": args.virt_rank_gap,
+                "count": len(flagged),
+                "events": {event: sum(outlier["event"] == event for outlier in flagged) for event in EVENTS},
+            }
+        summary[op] = stats
+    return summary
+
+
+def print_summary(key: tuple, runs: int, summary: dict, outliers: list, show_outliers: int):
+    strategy, workload, group = key
+    print(f"{strategy} {workload} {group} ({runs} runs)")
+    for op, stats in summary.items():
+        cells = "  ".join(f"{name} {stats[name]['value']} [{stats[name]['ci'][0]:.0f}, {stats[name]['ci'][1]:.0f}]" for name in stats if name.startswith("p"))
+        print(f"  {op:<6}n {stats['count']:<8}{cells}  max {stats['max']}")
+        tail = stats["tail"]
+        in_tail = sum(tail["events"].values())
+        shares = ", ".join(f"{event} {100 * count / in_tail:.1f}%" for event, count in tail["events"].items() if count)
+        print(f"  {'':<6}>= p{tail['percentile']:g} ({tail['threshold']}): {in_tail} ops, {shares}")
+        if "virt_delta" in stats:
+            virt = "  ".join(f"{name} {value}" for name, value in stats["virt_delta"].items())
+            flagged = stats["virt_outliers"]
+            events = ", ".join(f"{event} {count}" for event, count in flagged["events"].items() if count)
+            print(f"  {'':<6}virt us  {virt}  ({flagged['count']} ops with far more virtual time than instructions{': ' + events if events else ''})")
+    for outlier in sorted(outliers, key=lambda outlier: -outlier["rank_gap"])[:show_outliers]:
+        print(f"    {outlier['op']} {Path(outlier['path']).name}:{outlier['row']} {outlier['instruction_count']} instructions, "
+              f"{outlier['virt_delta']} us virtual, {outlier['event']}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Compute instruction count percentiles per alloc / free from latency logs, with bootstrap confidence intervals and a breakdown of the tail."
+            )
+
+    parser.add_argument(
+            "--results_dir",
+            type=str,
+            default=".",
+            help="Path pointing to the dir holding the best_fit/ and next_fit/ result trees, all latency logs in it are summarized.",
+            )
+    parser.add_argument(
+            "--log_files",
+            nargs="+",
+            help="Latency log files to summarize instead of discovering them in --results_dir.",
+            )
+    parser.add_argument(
+            "--resamples",
+            type=int,
+            default=1000,
+            help="Number of bootstrap resamples behind the confidence intervals.",
+            )
+    parser.add_argument(
+            "--confidence",
+            type=float,
+            default=95,
+            help="Confidence level of the intervals, in percent.",
+            )
+    parser.add_argument(
+            "--tail_percentile",
+            type=float,
+            default=99,
+            help="Ops at or above this percentile are broken down by the slab reset / untyped_too_small / oom events they caused.",
+            )
+    parser.add_argument(
+            "--virt_rank_gap",
+            type=float,
+            default=VIRT_RANK_GAP,
+            help="Flag ops whose percentile rank by virtual time exceeds their rank by instruction count by this much.",
+            )
+    parser.add_argument(
+            "--show_outliers",
+            type=int,
+            default=5,
+            help="Number of flagged ops listed per group.",
+            )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the bootstrap resampling.")
+    parser.add_argument(
+            "--output_json",
+            type=str,
+            help="If set, also write the statistics to this JSON file.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.log_files:
+        runs = [parse_run_name(path) or {"path": path, "strategy": "", "workload": "", "params": path} for path in args.log_files]
+    else:
+        runs = [run for run in discover_runs(args.results_dir) if run["kind"] == "latency"]
+
+    groups = {}
+    for run in runs:
+        columns = load_columns(run["path"], {**LATENCY_COLUMNS, **VIRT_COLUMNS}, args.cache_dir, not args.no_cache).columns
+        histograms, outliers, count = groups.get(group_key(run), ({}, [], 0))
+        for name, histogram in run_histograms(columns).items():
+            histograms.setdefault(name, LatencyHistogram()).merge(histogram)
+        outliers += [{"path": run["path"], **outlier} for outlier in virt_outliers(columns, args.virt_rank_gap)]
+        groups[group_key(run)] = (histograms, outliers, count + 1)
+
+    report = []
+    for key, (histograms, outliers, count) in sorted(groups.items(), key=lambda item: tuple(str(part) for part in item[0])):
+        summary = summarize(histograms, outliers, args)
+        print_summary(key, count, summary, outliers, args.show_outliers)
+        report.append({"strategy": key[0], "workload": key[1], "group": key[2], "runs": count, **summary, "virt_outlier_ops": outliers})
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import os
+import time
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+from log_parser import PROFILE_COLUMNS, WORKLOAD_MARKERS, END_MARKER, is_virt_line, decode_record
+from latency_stats import LatencyHistogram, PERCENTILES, bucket_value
+from downsample import lod_indices, step_rows, DEFAULT_MAX_POINTS
+
+# Follows a uart5 log while Renode is still writing it: only the bytes appended since the last read are decoded, into
+# running aggregates that are summarized (and optionally plotted) at a fixed rate, so bad runs show up while they run.
+READ_SIZE = 1 << 20
+# Record keys shared by profile and latency logs, fragmentation is only in profile logs
+SERIES = {name: PROFILE_COLUMNS[name] for name in ("bytes_requested", "bytes_in_use", "lhs_fragmentation", "in_between_fragmentation", "slab_resets", "oom")}
+# Leading bytes of the log compared on every read, a log rewritten in place past the read offset is told apart by them
+HEAD_SIZE = 4096
+RESTART = None
+
+
+async def follow_lines(file_path: str, poll_interval: float):
+    # Yields complete lines as they are appended, waiting for the file to appear. When the log is truncated, replaced
+    # by a new file or rewritten with another beginning, RESTART is yielded and the new contents follow from the start.
+    while True:
+        while not os.path.exists(file_path):
+            await asyncio.sleep(poll_interval)
+        offset, partial, head = 0, b"", b""
+        with open(file_path, "rb") as file:
+            while True:
+                if restarted(file, file_path, offset, head):
+                    yield RESTART
+                    break
+                data = file.read(READ_SIZE)
+                if not data:
+                    await asyncio.sleep(poll_interval)
+                    continue
+                if len(head) < HEAD_SIZE:
+                    head = (head + data)[:HEAD_SIZE]
+                offset += len(data)
+                lines = (partial + data).split(b"\n")
+                partial = lines.pop()
+                for line in lines:
+                    yield line.decode(errors="replace")
+                # let the summaries run while a long backlog is being caught up on
+                await asyncio.sleep(0)
+
+
+def restarted(file, file_path: str, offset: int, head: bytes) -> bool:
+    # The open file is shorter than what was read, no longer the one at file_path, or starts differently
+    try:
+        rotated = os.stat(file_path).st_ino != os.fstat(file.fileno()).st_ino
+    except FileNotFoundError:
+        rotated = True
+    return rotated or os.fstat(file.fileno()).st_size < offset or (head and os.pread(file.fileno(), len(head), 0) != head)
+
+
+class LiveRun:
+
+    def __init__(self):
+        self.workload = None
+        self.done = False
+        self.records = 0
+        self.snapshots = 0
+        self.last = {}
+        self.peak = {}
+        self.series = {name: array("q") for name in SERIES}
+        self.latency = {"alloc": LatencyHistogram(), "free": LatencyHistogram()}
+        # instruction counts are collected per line and binned once per refresh
+        self.pending = {"alloc": array("q"), "free": array("q")}
+        self.started = time.monotonic()
+
+    def feed(self, line: str):
+        if self.done or is_virt_line(line):
+            return
+        if self.workload is None:
+            for marker, workload in WORKLOAD_MARKERS:
+                if marker in line:
+                    self.workload = workload
+            return
+        if END_MARKER in line:
+            self.done = True
+            return
+        record = decode_record(line)
+        if record is None:
+            return
+        if "idx" in record:
+            # per-slab snapshot of a memory stats run, only the global counters are followed
+            self.snapshots += 1
+            record = {key: record[key] for key in ("slab_resets", "untyped_too_small", "oom")}
+        self.records += 1
+        for key, value in record.items():
+            if isinstance(value, bool):
+                continue
+            self.last[key] = value
+            self.peak[key] = max(self.peak.get(key, value), value)
+        for name, key in SERIES.items():
+            if key in record:
+                self.series[name].append(record[key])
+        if "instruction count" in record:
+            self.pending["alloc" if record["allocation"] else "free"].append(record["instruction count"])
+
+    def flush_latency(self):
+        for op, values in self.pending.items():
+            self.latency[op].record(np.array(values, dtype=np.int64))
+            del values[:]
+
+    def summary(self) -> str:
+        self.flush_latency()
+        if self.workload is None:
+            return "waiting for the workload to start.."
+        parts = [f"{time.monotonic() - self.started:7.1f}s", self.workload, f"{self.records} records"]
+        for key, label in (("bytes in-use", "in-use"), ("lhs fragmentation", "lhs frag"), ("in-between fragmentation", "in-between frag")):
+            if key in self.last:
+                parts.append(f"{label} {self.last[key]} (peak {self.peak[key]})")
+        for key in ("slab resets", "slab_resets", "untyped_too_small", "oom"):
+            if key in self.last:
+                parts.append(f"{key.replace('_', ' ')} {self.last[key]}")
+        for op, histogram in self.latency.items():
+            if len(histogram):
+                values = "/".join(str(int(value)) for value in histogram.percentiles())
+                parts.append(f"{op} p{'/'.join(f'{p:g}' for p in PERCENTILES)} {values} max {histogram.max}")
+        if self.last.get("oom"):
+            parts.append("OUT OF MEMORY")
+        if self.done:
+            parts.append("done")
+        return " | ".join(parts)
+
+
+def save_plot(run: LiveRun, plot_file: str, max_points: int):
+    import matplotlib.pyplot as plt
+    from plot_style import configure
+
+    configure(draft=True, font_scale=1)
+    series = {name: np.array(values, dtype=np.int64) for name, values in run.series.items() if len(values)}
+    latency = any(len(histogram) for histogram in run.latency.values())
+    fig, axs = plt.subplots(1 + latency, 1, figsize=(12, 4.5 * (1 + latency)), squeeze=False)
+    axs = axs[:, 0]
+    if "bytes_in_use" in series:
+        oom = np.diff(series["oom"], prepend=0) > 0 if "oom" in series else np.zeros(len(series["bytes_in_use"]), dtype=bool)
+        resets = step_rows(series["slab_resets"]) if "slab_resets" in series else None
+        keep = oom if resets is None else oom | resets
+        rows = lod_indices([values for name, values in series.items() if name != "bytes_requested"], max_points, keep)
+        for name in ("bytes_in_use", "lhs_fragmentation", "in_between_fragmentation"):
+            if name in series:
+                axs[0].plot(rows, series[name][rows], label=name.replace("_", " "), linewidth=2)
+        if oom.any():
+            axs[0].scatter(np.flatnonzero(oom), series["bytes_in_use"][oom], marker="x", s=100, color="tab:red", label="Out of Memory")
+        axs[0].set_xlabel("Record")
+        axs[0].set_ylabel("Bytes")
+        axs[0].legend()
+    if latency:
+        for op, histogram in run.latency.items():
+            if len(histogram) == 0:
+                continue
+            # bucket edges in instructions, starting from 1 for the log axis
+            edges = bucket_value(np.arange(len(histogram.counts))) + 1
+            axs[-1].stairs(histogram.counts[1:], edges, label=op, linewidth=2)
+        axs[-1].set_xscale("log")
+        axs[-1].set_yscale("log")
+        axs[-1].set_xlabel("Instruction count")
+        axs[-1].set_ylabel("Ops")
+        axs[-1].legend()
+    plt.tight_layout()
+    # written next to the target and swapped in, so viewers never load half a file
+    tmp_path = Path(plot_file).with_name(".tmp_" + Path(plot_file).name)
+    plt.savefig(tmp_path)
+    plt.close(fig)
+    os.replace(tmp_path, plot_file)
+
+
+async def tail(args: argparse.Namespace):
+    run = LiveRun()
+
+    async def read():
+        nonlocal run
+        async for line in follow_lines(args.log_file, args.poll_interval):
+            if line is RESTART:
+                # a new run in the same file, nothing of the old one is kept
+                run = LiveRun()
+                print("Log truncated or replaced, starting over", flush=True)
+                if args.plot_file and os.path.exists(args.plot_file):
+                    os.remove(args.plot_file)
+                continue
+            run.feed(line)
+            if run.done:
+                return
+
+    reader = asyncio.create_task(read())
+    while not reader.done():
+        await asyncio.wait([reader], timeout=args.refresh)
+        print(run.summary(), flush=True)
+        # memory stats runs only carry per-slab snapshots, there is nothing to draw
+        if args.plot_file and run.series["bytes_in_use"]:
+            save_plot(run, args.plot_file, args.max_points)
+    await reader
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Follow a log file while the robot script is still running the workload, printing running aggregates."
+            )
+
+    parser.add_argument(
+            "--log_file",
+            type=str,
+            required=True,
+            help="Path to the log file being written by the robot script.",
+            )
+    parser.add_argument(
+            "--refresh",
+            type=float,
+            default=2.0,
+            help="Seconds between two summaries (and plot refreshes).",
+            )
+    parser.add_argument(
+            "--poll_interval",
+            type=float,
+            default=0.2,
+            help="Seconds to wait for new bytes when the end of the log is reached.",
+            )
+    parser.add_argument(
+            "--plot_file",
+            type=str,
+            help="If set, also redraw this PNG on every refresh.",
+            )
+    parser.add_argument(
+            "--max_points",
+            type=int,
+            default=DEFAULT_MAX_POINTS,
+            help="Most records drawn in the live plot, longer runs keep the min/max of each bucket plus all OOM and slab reset rows.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        asyncio.run(tail(args))
+    except KeyboardInterrupt:
+        pass
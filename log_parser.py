@@ -0,0 +1,472 @@
+import gzip
+import io
+import json
+import mmap
+import os
+import re
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bump whenever the extracted values change, so cached parses (see parse_cache.py) are rebuilt
+PARSER_VERSION = 2
+
+# Columns extracted from each kind of record, mapped to the key the memory manager prints for them.
+# Only records containing every key of the selected set are kept.
+PROFILE_COLUMNS = {
+    "bytes_in_use": "bytes in-use",
+    "slab_resets": "slab resets",
+    "untyped_too_small": "untyped_too_small",
+    "oom": "oom",
+    "bytes_free": "bytes free",
+    "bytes_requested": "bytes requested",
+    "lhs_fragmentation": "lhs fragmentation",
+    "in_between_fragmentation": "in-between fragmentation",
+    "objs_in_use": "objs in-use",
+}
+
+LATENCY_COLUMNS = {
+    "bytes_requested": "bytes requested",
+    "slab_resets": "slab resets",
+    "untyped_too_small": "untyped_too_small",
+    "oom": "oom",
+    "bytes_in_use": "bytes in-use",
+    "instruction_count": "instruction count",
+    "allocation": "allocation",
+    "objs_in_use": "obj-in-use",
+}
+
+STATS_COLUMNS = {
+    "idx": "idx",
+    "slab_resets": "slab_resets",
+    "untyped_too_small": "untyped_too_small",
+    "oom": "oom",
+    "lhs_fragmentation_per_slab": "lhs_fragmentation_per_slab",
+    "in_between_fragmentation_per_slab": "in_between_fragmentation_per_slab",
+    "occupied_memory_per_slab": "occupied_memory_per_slab",
+    "available_space_per_slab": "available_space_per_slab",
+}
+
+# Emulated time taken from the "[virt:" twin of each record, in microseconds: the virtual timestamp of the record and
+# the virtual time elapsed since the previous record, which includes any kernel prints in between
+VIRT_COLUMNS = {
+    "virt_time": "virt time",
+    "virt_delta": "virt delta",
+}
+# Virtual time of a record whose "[virt:" twin is missing, the record itself is kept
+VIRT_MISSING = -1
+
+KIND_COLUMNS = {"profile": PROFILE_COLUMNS, "latency": LATENCY_COLUMNS, "stats": STATS_COLUMNS}
+
+# Logs can also be read gzip or zstd compressed, decompressed on the fly, or as column archives written by
+# convert_logs.py. Suffixes are listed from the cheapest to load to the most expensive.
+ARCHIVE_SUFFIX = ".npz"
+LOG_SUFFIXES = (ARCHIVE_SUFFIX, ".log", ".log.zst", ".log.gz")
+
+# Record layouts as printed by the memory manager for each kind of run, used to write logs the parsers accept
+RECORD_FORMATS = {
+    "profile": "{{'bytes in-use': {bytes_in_use}, 'slab resets': {slab_resets},'untyped_too_small': {untyped_too_small}, "
+               "'oom': {oom}, 'bytes free': {bytes_free}, 'bytes requested': {bytes_requested}, "
+               "'lhs fragmentation': {lhs_fragmentation}, 'in-between fragmentation': {in_between_fragmentation}, "
+               "'objs in-use': {objs_in_use}}}",
+    "latency": "cantrip_memory_manager::memory_manager::{{'bytes requested': {bytes_requested}, "
+               "'slab resets': {slab_resets},'untyped_too_small': {untyped_too_small}, 'oom': {oom}, "
+               "'bytes in-use': {bytes_in_use}, 'obj-in-use': {objs_in_use}, 'instruction count': {instruction_count}, "
+               "'allocation': {allocation}}}",
+    "stats": "{{'idx': {idx}, 'slab_resets': {slab_resets}, 'untyped_too_small': {untyped_too_small}, 'oom': {oom}, "
+             "'lhs_fragmentation_per_slab': {lhs_fragmentation_per_slab}, "
+             "'in_between_fragmentation_per_slab': {in_between_fragmentation_per_slab}, "
+             "'occupied_memory_per_slab': {occupied_memory_per_slab}, 'available_space_per_slab': {available_space_per_slab}}}",
+}
+LOG_LINE = "{time} [INFO] uart5: [output] {text}\n"
+
+# Marker printed at the start of each kind of workload, the first line containing one of them begins the run.
+WORKLOAD_MARKERS = (
+    ("Begin synthetic workload!", "synthetic"),
+    ("replay_seq_app", "replay_seq_app"),
+    ("replay_concurr_app", "replay_concurr_app"),
+    ("replay_app", "replay_app"),
+)
+END_MARKER = "Done :)"
+
+# Every line is printed twice by Renode, once as "[output]" and once as "[virt: ...]". The tag sits right after the
+# timestamp and uart name, so only the start of the line needs to be checked to drop the duplicate.
+VIRT_TAG = "[virt:"
+OUTPUT_TAG = "[output]"
+TAG_SEARCH_END = 64
+# e.g. "[virt:  17.2s (+0.7ms)]", the timestamp and the time since the previous line
+VIRT_TIME = re.compile(r"\[virt:\s*([\d.]+)s \(\+([\d.]+)(s|ms|us|µs)\)\] ")
+VIRT_UNITS = {"s": 1e6, "ms": 1e3, "us": 1, "µs": 1}
+
+# Error events printed between records, which the record parsers skip: the seL4 kernel refusing an Untyped Retype
+# of the memory manager, with the exact size asked for and what the untyped had left, e.g.
+# <<seL4(CPU 0) [decodeUntypedInvocation/209 T0x801bf700 "" @160fe]: Untyped Retype: Insufficient memory (9 * 4096 bytes needed, 8928 bytes available).>>
+# and the memory manager giving up on an allocation
+RETYPE_FAILURE = re.compile(r"Untyped Retype: Insufficient memory \((\d+) \* (\d+) bytes needed, (\d+) bytes available\)")
+ALLOC_FAILED = "malloc failed: AllocFailed"
+EVENT_KINDS = ("retype_failure", "alloc_failed")
+# Each event is linked to the record of every kind printed last before it, -1 for events before the first one
+EVENT_COLUMNS = ("event", "objects", "object_size", "bytes_available", *(f"{kind}_record" for kind in KIND_COLUMNS))
+
+# Logs smaller than this are parsed serially, below it the process start-up outweighs the parallel decode
+PARALLEL_MIN_SIZE = 8 << 20
+PARALLEL_CHUNK_SIZE = 32 << 20
+
+ParsedLog = namedtuple("ParsedLog", ["workload", "columns"])
+
+
+def is_virt_line(line: str) -> bool:
+    return line.find(VIRT_TAG, 0, TAG_SEARCH_END) != -1
+
+
+def format_value(value) -> str:
+    if isinstance(value, (bool, np.bool_)):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return "[" + ", ".join(str(int(item)) for item in value) + "]"
+    return str(int(value))
+
+
+def format_record(kind: str, values: dict) -> str:
+    return RECORD_FORMATS[kind].format(**{name: format_value(value) for name, value in values.items()})
+
+
+def format_log_line(text: str, seconds: float = 0.0) -> str:
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return LOG_LINE.format(time=f"{hours % 24:02d}:{minutes:02d}:{seconds:07.4f}", text=text)
+
+
+def log_stem(file_path) -> str:
+    # File name without the log / archive suffix, used to name the plots of a run
+    name = Path(file_path).name
+    for suffix in LOG_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name.split('.')[-2]
+
+
+def open_log(file_path: str):
+    # Text stream over a plain or compressed log
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "rt")
+    if file_path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError(f"Reading {file_path} needs the zstandard package")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(file_path, "rb"), closefd=True))
+    return open(file_path, "r")
+
+
+def find_workload_start(lines, file_path: str = "") -> str:
+    # Consumes lines up to and including the start marker, returns the detected workload kind
+    for line in lines:
+        if is_virt_line(line):
+            continue
+        for marker, workload in WORKLOAD_MARKERS:
+            if marker in line:
+                return workload
+    raise ValueError(f"No workload start marker found in {file_path}")
+
+
+def decode_record(line: str):
+    start = line.find("{")
+    if start == -1:
+        return None
+    try:
+        # Correcting for single-quote JSON-like format
+        return json.loads(line[start:line.rindex("}") + 1].replace("'", '"'))
+    except ValueError:
+        return None  # Skip lines that do not contain valid JSON data (memory failures, kernel prints, ...)
+
+
+def iter_records(lines, virt: bool = False):
+    # Yields the records following the workload start, stopping at the end marker. With virt, each record is held
+    # back until its "[virt:" twin is seen, which adds the VIRT_COLUMNS keys to it.
+    pending, text, elapsed = None, None, None
+    for line in lines:
+        if is_virt_line(line):
+            match = VIRT_TIME.search(line, 0, TAG_SEARCH_END + 32) if virt else None
+            # time before the first record belongs to the workload start, not to an op
+            if match is not None and elapsed is not None:
+                elapsed += float(match[2]) * VIRT_UNITS[match[3]]
+                if pending is not None and line[match.end():] == text:
+                    pending["virt time"] = round(float(match[1]) * VIRT_UNITS["s"])
+                    pending["virt delta"] = round(elapsed)
+                    yield pending
+                    pending, elapsed = None, 0.0
+            continue
+        if END_MARKER in line:
+            break
+        record = decode_record(line)
+        if record is None:
+            continue
+        if not virt:
+            yield record
+            continue
+        if pending is not None:
+            # no twin, yielded with VIRT_MISSING virtual time
+            yield {**pending, **dict.fromkeys(VIRT_COLUMNS.values(), VIRT_MISSING)}
+        pending, text = record, line[line.find(OUTPUT_TAG) + len(OUTPUT_TAG) + 1:]
+        elapsed = elapsed or 0.0
+    if pending is not None:
+        yield {**pending, **dict.fromkeys(VIRT_COLUMNS.values(), VIRT_MISSING)}
+
+
+def scan_event(line: str, record_keys: dict, counts: dict):
+    # The error event on a line as a dict of EVENT_COLUMNS or None, counting the records of every kind passed so far.
+    # Records are only told apart by their keys here, a full decode of every line is not needed to count them.
+    if is_virt_line(line):
+        return None
+    if "{" in line:
+        for kind, keys in record_keys.items():
+            if all(key in line for key in keys):
+                counts[kind] += 1
+        return None
+    match = RETYPE_FAILURE.search(line)
+    if match is not None:
+        event = {"event": 0, "objects": int(match[1]), "object_size": int(match[2]), "bytes_available": int(match[3])}
+    elif ALLOC_FAILED in line:
+        event = {"event": 1, "objects": 0, "object_size": 0, "bytes_available": 0}
+    else:
+        return None
+    return {**event, **{f"{kind}_record": count - 1 for kind, count in counts.items()}}
+
+
+def event_keys() -> dict:
+    return {kind: [f"'{key}'" for key in columns.values()] for kind, columns in KIND_COLUMNS.items()}
+
+
+def iter_events(lines):
+    # Yields the error events following the workload start as dicts of EVENT_COLUMNS, stopping at the end marker
+    record_keys, counts = event_keys(), dict.fromkeys(KIND_COLUMNS, 0)
+    for line in lines:
+        if END_MARKER in line and not is_virt_line(line):
+            break
+        event = scan_event(line, record_keys, counts)
+        if event is not None:
+            yield event
+
+
+def collect_events(lines, buffers: dict):
+    # Passes the lines through, appending the error events among them to buffers, so records and events are read in
+    # one pass (iter_records stops pulling lines at the end marker)
+    record_keys, counts = event_keys(), dict.fromkeys(KIND_COLUMNS, 0)
+    for line in lines:
+        if END_MARKER not in line or is_virt_line(line):
+            event = scan_event(line, record_keys, counts)
+            if event is not None:
+                for name, value in event.items():
+                    buffers[name].append(value)
+        yield line
+
+
+def load_events(file_path: str) -> dict:
+    # Error events of a log as int64 columns, see EVENT_COLUMNS
+    if file_path.endswith(ARCHIVE_SUFFIX):
+        with np.load(file_path) as archive:
+            if "events.event" not in archive.files:
+                raise ValueError(f"{file_path} was written without error events, convert the log again")
+            return {name: archive[f"events.{name}"] for name in EVENT_COLUMNS}
+    buffers = {name: array("q") for name in EVENT_COLUMNS}
+    with open_log(file_path) as file:
+        find_workload_start(file, file_path)
+        for event in iter_events(file):
+            for name, value in event.items():
+                buffers[name].append(value)
+    return {name: np.array(buffer, dtype=np.int64) for name, buffer in buffers.items()}
+
+
+def columns_from_records(records, columns: dict) -> dict:
+    return columns_by_set(records, {None: columns})[None]
+
+
+def columns_by_set(records, column_sets: dict) -> dict:
+    # columns_from_records for several column sets in one pass over the records. Values are accumulated in typed
+    # buffers, so memory grows with the number of records rather than the log size
+    keys = {label: list(columns.values()) for label, columns in column_sets.items()}
+    buffers = {label: {name: array("q") for name in columns} for label, columns in column_sets.items()}
+    widths = {label: {} for label in column_sets}
+    for record in records:
+        for label, columns in column_sets.items():
+            if not all(key in record for key in keys[label]):
+                continue
+            for name, key in columns.items():
+                value = record[key]
+                if isinstance(value, list):
+                    widths[label][name] = len(value)
+                    buffers[label][name].extend(value)
+                else:
+                    if isinstance(value, bool):
+                        widths[label][name] = bool
+                    buffers[label][name].append(value)
+
+    data = {label: {} for label in column_sets}
+    for label, label_buffers in buffers.items():
+        for name, buffer in label_buffers.items():
+            values = np.frombuffer(buffer, dtype=np.int64) if len(buffer) else np.zeros(0, dtype=np.int64)
+            width = widths[label].get(name)
+            if width is bool:
+                values = values.astype(bool)
+            elif width is not None:
+                # per-slab vectors become a (record x slab) array
+                values = values.reshape(-1, width)
+            data[label][name] = values
+    return data
+
+
+def record_pattern(record: dict, columns: dict) -> str:
+    # Records of one run always print the same keys in the same order, e.g.
+    # cantrip_memory_manager::memory_manager::{'bytes requested': 16384, 'slab resets': 0,'untyped_too_small': 0, ...}
+    # so the layout of the first record gives one regex that decodes a whole byte range at once, capturing only the
+    # selected columns. Anchoring on the "[output]" tag skips the "[virt:" duplicates and lets re scan for the literal.
+    selected = set(columns.values())
+    fields = []
+    for key in record:
+        value = r"\[[^\]]*\]" if isinstance(record[key], list) else r"true|false|-?\d+"
+        value = f"({value})" if key in selected else f"(?:{value})"
+        fields.append(f"'{re.escape(key)}':\\s*{value}")
+    return re.escape(OUTPUT_TAG) + r"[^\n{]*\{" + r",\s*".join(fields) + r"\}"
+
+
+def decode_block(text: str, pattern: str, columns: dict, template: dict) -> dict:
+    matches = re.findall(pattern, text)
+    selected = [key for key in template if key in columns.values()]
+    if len(selected) == 1:
+        matches = [(match,) for match in matches]
+    fields = dict(zip(selected, zip(*matches))) if matches else {key: () for key in selected}
+
+    data = {}
+    for name, key in columns.items():
+        values = fields[key]
+        if isinstance(template[key], bool):
+            data[name] = np.asarray(values, dtype=str) == "true"
+        elif isinstance(template[key], list):
+            items = ",".join(value[1:-1] for value in values)
+            data[name] = (np.array(items.split(",")).astype(np.int64) if items else np.zeros(0, dtype=np.int64)).reshape(-1, len(template[key]))
+        else:
+            data[name] = np.array(values).astype(np.int64) if values else np.zeros(0, dtype=np.int64)
+    return data
+
+
+def find_line(data, marker: bytes, start: int = 0):
+    # (line start, line end) of the first non-duplicate line at or after start containing marker
+    position = data.find(marker, start)
+    while position != -1:
+        line_start = data.rfind(b"\n", 0, position) + 1
+        line_end = data.find(b"\n", position)
+        line_end = len(data) if line_end == -1 else line_end
+        if data.find(VIRT_TAG.encode(), line_start, min(line_start + TAG_SEARCH_END, line_end)) == -1:
+            return line_start, line_end
+        position = data.find(marker, line_end)
+    return None
+
+
+def split_ranges(data, start: int, stop: int, count: int):
+    # Byte ranges covering [start, stop), each ending on a newline so no line is split between workers
+    bounds = [start]
+    for i in range(1, count):
+        position = data.find(b"\n", start + (stop - start) * i // count, stop)
+        if position != -1 and position + 1 > bounds[-1]:
+            bounds.append(position + 1)
+    bounds.append(stop)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+
+def parse_range(file_path: str, start: int, stop: int, pattern: str, columns: dict, template: dict) -> dict:
+    with open(file_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        text = data[start:stop].decode("utf-8", "replace")
+    return decode_block(text, pattern, columns, template)
+
+
+def load_columns_parallel(file_path: str, columns: dict, jobs: int) -> ParsedLog:
+    with open(file_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        found = []
+        for marker, workload in WORKLOAD_MARKERS:
+            line = find_line(data, marker.encode())
+            if line is not None:
+                found.append((line, workload))
+        if not found:
+            raise ValueError(f"No workload start marker found in {file_path}")
+        (_, begin), workload = min(found)
+        end = find_line(data, END_MARKER.encode(), begin)
+        stop = end[0] if end is not None else len(data)
+
+        # The first complete record fixes the layout for the whole run
+        template = None
+        position = begin + 1
+        while template is None and position < stop:
+            line_end = data.find(b"\n", position, stop)
+            line_end = stop if line_end == -1 else line_end
+            line = data[position:line_end].decode("utf-8", "replace")
+            record = None if is_virt_line(line) else decode_record(line)
+            if record is not None and all(key in record for key in columns.values()):
+                template = record
+            position = line_end + 1
+        if template is None:
+            return ParsedLog(workload=workload, columns=columns_from_records((), columns))
+
+        count = max(jobs * 4, (stop - begin) // PARALLEL_CHUNK_SIZE + 1)
+        ranges = split_ranges(data, begin + 1, stop, count)
+
+    pattern = record_pattern(template, columns)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        # map yields the ranges back in op order
+        parts = list(pool.map(parse_range, *zip(*[(file_path, start, end, pattern, columns, template) for start, end in ranges])))
+    return ParsedLog(workload=workload, columns={name: np.concatenate([part[name] for part in parts]) for name in columns})
+
+
+def write_archive(file_path: str, source: str):
+    # Every kind of record in the log becomes a set of "<kind>.<column>" arrays in one compressed .npz, all kinds and
+    # the error events read in a single pass over the log. Archives keep the virtual time, which only the serial
+    # parser reads.
+    events = {name: array("q") for name in EVENT_COLUMNS}
+    with open_log(source) as file:
+        workload = find_workload_start(file, source)
+        kinds = columns_by_set(iter_records(collect_events(file, events), virt=True), {kind: {**columns, **VIRT_COLUMNS} for kind, columns in KIND_COLUMNS.items()})
+    arrays = {f"{kind}.{name}": values for kind, columns in kinds.items() for name, values in columns.items()}
+    for name, buffer in events.items():
+        arrays[f"events.{name}"] = np.array(buffer, dtype=np.int64)
+    meta = {"workload": workload, "parser_version": PARSER_VERSION, "source": Path(source).name}
+    # np.savez appends .npz to names not ending in it, so the scratch name keeps the suffix
+    tmp_path = Path(file_path).with_name(".tmp_" + Path(file_path).name)
+    np.savez_compressed(tmp_path, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(tmp_path, file_path)
+
+
+def load_archive(file_path: str, columns: dict) -> ParsedLog:
+    # Columns are matched on the printed record keys, so any column set a log could be parsed with is served
+    with np.load(file_path) as archive:
+        meta = json.loads(str(archive["meta"]))
+        if meta.get("parser_version") != PARSER_VERSION:
+            raise ValueError(f"{file_path} was written by parser version {meta.get('parser_version')}, not {PARSER_VERSION}: convert its log again with convert_logs.py")
+        matches = []
+        for kind, kind_columns in KIND_COLUMNS.items():
+            names = {key: name for name, key in {**kind_columns, **VIRT_COLUMNS}.items() if f"{kind}.{name}" in archive.files}
+            if all(key in names for key in columns.values()):
+                matches.append({name: archive[f"{kind}.{names[key]}"] for name, key in columns.items()})
+    # keys shared by several kinds are served from the kind this log actually holds
+    data = max(matches, key=lambda data: len(next(iter(data.values()))), default=None)
+    if data is None:
+        data = columns_from_records((), columns)
+    return ParsedLog(workload=meta["workload"], columns=data)
+
+
+def load_columns(file_path: str, columns: dict, jobs: int = 1) -> ParsedLog:
+    if file_path.endswith(ARCHIVE_SUFFIX):
+        return load_archive(file_path, columns)
+    # virtual time needs the "[virt:" twins, which the parallel decoder skips
+    virt = any(key in VIRT_COLUMNS.values() for key in columns.values())
+    if jobs > 1 and not virt and not file_path.endswith((".gz", ".zst")) and os.path.getsize(file_path) >= PARALLEL_MIN_SIZE:
+        return load_columns_parallel(file_path, columns, jobs)
+    with open_log(file_path) as file:
+        workload = find_workload_start(file, file_path)
+        data = columns_from_records(iter_records(file, virt), columns)
+    return ParsedLog(workload=workload, columns=data)
@@ -0,0 +1,231 @@
+import argparse
+import json
+from os import makedirs
+from pathlib import Path
+
+import numpy as np
+
+from log_parser import KIND_COLUMNS
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+from runs import discover_runs, parse_run_name, STRATEGIES
+from latency_stats import group_key
+from slab_sim import trace_from_columns
+
+# Object-level profile of a workload rebuilt from its op stream: the bytes in-use / objs in-use diffs give the size
+# of every allocated object (see slab_sim.trace_from_columns), frees are matched to the oldest live objects of their
+# size, so lifetimes (in ops) are approximate whenever objects of one size are not freed in allocation order.
+# Objects still live at the end of a run are censored: counted in the size classes, left out of the lifetimes.
+LIFETIME_PERCENTILES = (50, 90, 99)
+# Share of all allocations the smallest set of size classes a fast path would have to cover
+FAST_PATH_SHARE = 0.9
+
+
+def object_table(columns: dict) -> dict:
+    # One entry per object: size, allocating op and freeing op (-1 while live at the end of the run)
+    trace = trace_from_columns(columns)
+    objects = int(trace["obj"].max()) + 1 if len(trace) else 0
+    allocated = trace[trace["allocation"] == 1]
+    freed = trace[trace["allocation"] == 0]
+    table = {
+        "size": np.zeros(objects, dtype=np.int64),
+        "alloc_op": np.zeros(objects, dtype=np.int64),
+        "free_op": np.full(objects, -1, dtype=np.int64),
+    }
+    table["size"][allocated["obj"]] = allocated["size"]
+    table["alloc_op"][allocated["obj"]] = allocated["op"]
+    table["free_op"][freed["obj"]] = freed["op"]
+    return table
+
+
+def live_bytes(table: dict, ops: int, classes: np.ndarray) -> np.ndarray:
+    # (op x size class) bytes held by live objects after every op
+    matrix = np.zeros((ops, len(classes)), dtype=np.int64)
+    column = np.searchsorted(classes, table["size"])
+    np.add.at(matrix, (table["alloc_op"], column), table["size"])
+    freed = table["free_op"] >= 0
+    np.add.at(matrix, (table["free_op"][freed], column[freed]), -table["size"][freed])
+    return np.cumsum(matrix, axis=0)
+
+
+def profile(tables: list, ops: list) -> dict:
+    # Size classes and lifetimes pooled over the runs of a group, live set averaged over the ops all runs cover
+    sizes = np.concatenate([table["size"] for table in tables])
+    lifetimes = np.concatenate([np.where(table["free_op"] >= 0, table["free_op"] - table["alloc_op"], -1) for table in tables])
+    classes, objects = np.unique(sizes, return_counts=True)
+    freed = lifetimes >= 0
+    stats = {}
+    for size, count in zip(classes.tolist(), objects.tolist()):
+        mine = sizes == size
+        lived = lifetimes[mine & freed]
+        stats[size] = {
+            "objects": count,
+            "bytes": size * count,
+            "freed": float(np.mean(freed[mine])),
+            **({f"lifetime_p{p:g}": float(value) for p, value in zip(LIFETIME_PERCENTILES, np.percentile(lived, LIFETIME_PERCENTILES))} if len(lived) else {}),
+        }
+    # most frequent classes first, until they cover FAST_PATH_SHARE of the allocations
+    order = np.argsort(-objects, kind="stable")
+    covered = np.cumsum(objects[order]) / max(objects.sum(), 1)
+    fast_path = classes[order[:int(np.searchsorted(covered, FAST_PATH_SHARE)) + 1]] if len(classes) else classes
+    length = min(ops)
+    live = np.mean([live_bytes(table, run_ops, classes)[:length] for table, run_ops in zip(tables, ops)], axis=0) if length else np.zeros((0, len(classes)))
+    return {
+        "classes": classes,
+        "objects": objects,
+        "sizes": sizes,
+        "lifetimes": lifetimes,
+        "live": live,
+        "summary": {
+            "runs": len(tables),
+            "objects": int(objects.sum()),
+            "freed": float(np.mean(freed)) if len(freed) else 0.0,
+            "size_classes": stats,
+            "fast_path": {"share": FAST_PATH_SHARE, "classes": sorted(int(size) for size in fast_path)},
+            "peak_live_bytes": int(live.sum(axis=1).max(initial=0)),
+        },
+    }
+
+
+def print_profile(key: tuple, summary: dict):
+    print(f"{' '.join(str(part) for part in key)} ({summary['runs']} runs, {summary['objects']} objects, {100 * summary['freed']:.1f}% freed)")
+    print(f"  {'size':>8}{'objects':>9}{'bytes':>12}{'freed':>8}" + "".join(f"{f'life p{p:g}':>12}" for p in LIFETIME_PERCENTILES))
+    for size, stats in summary["size_classes"].items():
+        lifetimes = "".join(f"{stats[f'lifetime_p{p:g}']:>12.0f}" if f"lifetime_p{p:g}" in stats else f"{'-':>12}" for p in LIFETIME_PERCENTILES)
+        print(f"  {size:>8}{stats['objects']:>9}{stats['bytes']:>12}{100 * stats['freed']:>7.1f}%{lifetimes}")
+    fast_path = summary["fast_path"]
+    print(f"  {100 * fast_path['share']:.0f}% of the allocations fall in {len(fast_path['classes'])} size classes: {', '.join(map(str, fast_path['classes']))}")
+
+
+def plot_profile(key: tuple, result: dict, args: argparse.Namespace):
+    import matplotlib.pyplot as plt
+    from plot_style import configure
+
+    configure(args.draft, font_scale=1.5)
+    classes = result["classes"]
+    fig, axs = plt.subplots(3, figsize=(20, 21))
+    positions = np.arange(len(classes))
+    objects = axs[0].bar(positions - 0.2, result["objects"], width=0.4, label="Objects")
+    bytes_ax = axs[0].twinx()
+    total_bytes = bytes_ax.bar(positions + 0.2, result["objects"] * classes, width=0.4, color="tab:orange", label="Bytes")
+    axs[0].set_xticks(positions, [str(size) for size in classes])
+    axs[0].set_title("Size classes")
+    axs[0].set_xlabel("Object size (bytes)")
+    axs[0].set_ylabel("Objects")
+    bytes_ax.set_ylabel("Bytes")
+    axs[0].legend(handles=[objects, total_bytes], loc="upper left")
+
+    freed = result["lifetimes"] >= 0
+    for size in classes:
+        lived = np.sort(result["lifetimes"][(result["sizes"] == size) & freed])
+        if len(lived):
+            axs[1].step(np.maximum(lived, 1), np.arange(1, len(lived) + 1) / len(lived), where="post", linewidth=2, label=f"{size} B")
+    axs[1].set_xscale("log")
+    axs[1].set_title("Lifetime of the freed objects")
+    axs[1].set_xlabel("Ops between allocation and free")
+    axs[1].set_ylabel("Share of objects")
+    axs[1].legend(loc="lower right", ncols=2)
+
+    live = result["live"]
+    axs[2].stackplot(np.arange(len(live)), live.T, labels=[f"{size} B" for size in classes], step="post")
+    axs[2].set_title("Live set")
+    axs[2].set_xlabel("Op")
+    axs[2].set_ylabel("Bytes")
+    axs[2].legend(loc="upper left", ncols=2)
+    plt.tight_layout()
+    makedirs(args.output_dir, exist_ok=True)
+    name = "LIFETIMES_" + "_".join(str(part) for part in key)
+    plt.savefig(Path(args.output_dir) / f"{name}.png")
+    plt.savefig(Path(args.output_dir) / f"{name}.pdf", bbox_inches="tight")
+    plt.close(fig)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Rebuild object sizes and lifetimes from the op stream of result logs, with size class histograms, lifetime distributions and live set curves per workload."
+            )
+
+    parser.add_argument(
+            "--results_dir",
+            type=str,
+            default=".",
+            help="Path pointing to the dir holding the best_fit/ and next_fit/ result trees.",
+            )
+    parser.add_argument(
+            "--log_files",
+            nargs="+",
+            help="Log files to profile instead of discovering them in --results_dir, each profiled on its own.",
+            )
+    parser.add_argument(
+            "--strategies",
+            nargs="+",
+            default=list(STRATEGIES),
+            choices=STRATEGIES,
+            help="Strategies whose runs are profiled; failed allocations differ between strategies, so they are kept apart.",
+            )
+    parser.add_argument(
+            "--kind",
+            type=str,
+            default="profile",
+            choices=("profile", "latency"),
+            help="Which logs of the runs the op stream is read from.",
+            )
+    parser.add_argument(
+            "--output_dir",
+            type=str,
+            default="./plots/object_lifetimes",
+            help="Path pointing to dir in which the resulting plots will be saved.",
+            )
+    parser.add_argument(
+            "--output_json",
+            type=str,
+            help="If set, also write the per-workload summaries to this JSON file.",
+            )
+    parser.add_argument(
+            "--no_plot",
+            action="store_true",
+            help="If set, only print the summaries.",
+            )
+    parser.add_argument(
+            "--draft",
+            action="store_true",
+            help="If set, render quickly through Agg with mathtext instead of pgf/pdflatex, for iterating on plots.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.log_files:
+        runs = [{**(parse_run_name(path) or {}), "path": path, "key": (Path(path).stem,)} for path in args.log_files]
+    else:
+        runs = [{**run, "key": group_key(run)} for run in discover_runs(args.results_dir, args.strategies) if run["kind"] == args.kind]
+
+    groups = {}
+    for run in runs:
+        columns = load_columns(run["path"], KIND_COLUMNS[args.kind], args.cache_dir, not args.no_cache).columns
+        tables, ops = groups.setdefault(run["key"], ([], []))
+        tables.append(object_table(columns))
+        ops.append(len(columns["bytes_in_use"]))
+
+    report = []
+    for key, (tables, ops) in sorted(groups.items(), key=lambda item: tuple(str(part) for part in item[0])):
+        result = profile(tables, ops)
+        print_profile(key, result["summary"])
+        report.append({"group": [str(part) for part in key], **result["summary"]})
+        if not args.no_plot:
+            plot_profile(key, result, args)
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump(report, file, indent=2)
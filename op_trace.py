@@ -0,0 +1,78 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+# Binary op traces: an 8 byte magic, a little-endian uint32 length and a JSON metadata block padded to 8 bytes, then
+# fixed-width rows until the end of the file. One row per object, objects allocated in one op share the op index and
+# a free row names the object it releases.
+MAGIC = b"CTRACE\x00\x01"
+TRACE_DTYPE = np.dtype([("op", "<u8"), ("obj", "<u8"), ("size", "<u4"), ("allocation", "u1")])
+
+
+class TraceWriter:
+    # Appends rows as they are generated, so a trace of any length is written with bounded memory
+
+    def __init__(self, file_path: str, meta: dict):
+        self.file = open(file_path, "wb")
+        header = json.dumps(meta).encode()
+        header += b" " * (-(len(MAGIC) + 4 + len(header)) % 8)
+        self.file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self.rows = 0
+
+    def write(self, rows: np.ndarray):
+        self.file.write(np.ascontiguousarray(rows, dtype=TRACE_DTYPE).tobytes())
+        self.rows += len(rows)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_trace(file_path: str):
+    # Returns the metadata and a read-only memory map over the rows
+    with open(file_path, "rb") as file:
+        magic = file.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError(f"{file_path} is not an op trace")
+        (length,) = struct.unpack("<I", file.read(4))
+        meta = json.loads(file.read(length))
+    offset = len(MAGIC) + 4 + length
+    if os.path.getsize(file_path) == offset:
+        return meta, np.zeros(0, dtype=TRACE_DTYPE)
+    return meta, np.memmap(file_path, dtype=TRACE_DTYPE, mode="r", offset=offset)
+
+
+def count_ops(trace: np.ndarray) -> int:
+    ops, last = 0, None
+    for chunk in iter_chunks(trace):
+        op = chunk["op"].astype(np.int64)
+        ops += int(np.count_nonzero(np.diff(op))) + int(op[0] != last)
+        last = op[-1]
+    return ops
+
+
+def iter_ops(trace: np.ndarray):
+    # Yields (allocation, [(obj, size), ...]) per op, reading the trace chunk by chunk so memory-mapped traces are
+    # never loaded whole
+    current, allocation, rows = None, False, []
+    for chunk in iter_chunks(trace):
+        for op, obj, size, alloc in zip(*(chunk[field].tolist() for field in ("op", "obj", "size", "allocation"))):
+            if op != current:
+                if rows:
+                    yield bool(allocation), rows
+                current, allocation, rows = op, alloc, []
+            rows.append((obj, size))
+    if rows:
+        yield bool(allocation), rows
+
+
+def iter_chunks(trace: np.ndarray, chunk_rows: int = 1 << 20):
+    for start in range(0, len(trace), chunk_rows):
+        yield trace[start:start + chunk_rows]
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+import log_parser
+from log_parser import ParsedLog
+
+# Parsed runs are stored as one .npy file per column plus a meta.json, so later runs can memory-map them.
+# An entry is reused while the log keeps its size and mtime; if only the mtime moved (copy, checkout, touch) the
+# content hash decides, anything else re-parses the log.
+DEFAULT_CACHE_DIR = ".parse_cache"
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def entry_dir(cache_dir: str, file_path: str, columns: dict) -> Path:
+    key = json.dumps([str(Path(file_path).resolve()), columns], sort_keys=True)
+    return Path(cache_dir) / hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def read_meta(entry: Path):
+    try:
+        with open(entry / "meta.json", "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_meta(entry: Path, meta: dict):
+    tmp_path = entry / "meta.json.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(meta, file)
+    os.replace(tmp_path, entry / "meta.json")
+
+
+def load_entry(entry: Path, meta: dict) -> ParsedLog:
+    data = {name: np.load(entry / f"{name}.npy", mmap_mode="r") for name in meta["columns"]}
+    return ParsedLog(workload=meta["workload"], columns=data)
+
+
+def store_entry(entry: Path, parsed: ParsedLog, meta: dict):
+    # Written to a scratch directory first and swapped in, so a concurrent reader never sees half an entry
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    scratch = Path(tempfile.mkdtemp(dir=entry.parent, prefix=entry.name + "."))
+    for name, values in parsed.columns.items():
+        np.save(scratch / f"{name}.npy", np.ascontiguousarray(values))
+    write_meta(scratch, meta)
+    shutil.rmtree(entry, ignore_errors=True)
+    try:
+        os.replace(scratch, entry)
+    except OSError:
+        # another process stored the same entry first
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def load_columns(file_path: str, columns: dict, cache_dir: str = DEFAULT_CACHE_DIR, use_cache: bool = True, jobs: int = 1) -> ParsedLog:
+    if not use_cache:
+        return log_parser.load_columns(file_path, columns, jobs)
+
+    stat = os.stat(file_path)
+    entry = entry_dir(cache_dir, file_path, columns)
+    meta = read_meta(entry)
+    content_hash = None
+    if meta is not None and meta["parser_version"] == log_parser.PARSER_VERSION and meta["columns"] == columns:
+        if meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns:
+            return load_entry(entry, meta)
+        if meta["size"] == stat.st_size:
+            content_hash = file_hash(file_path)
+            if content_hash == meta["content_hash"]:
+                meta["mtime_ns"] = stat.st_mtime_ns
+                write_meta(entry, meta)
+                return load_entry(entry, meta)
+
+    parsed = log_parser.load_columns(file_path, columns, jobs)
+    store_entry(entry, parsed, {
+        "path": str(Path(file_path).resolve()),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "content_hash": content_hash or file_hash(file_path),
+        "parser_version": log_parser.PARSER_VERSION,
+        "columns": columns,
+        "workload": parsed.workload,
+    })
+    return parsed
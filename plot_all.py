@@ -0,0 +1,270 @@
+import argparse
+import ast
+import hashlib
+import importlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import log_parser
+from log_parser import PROFILE_COLUMNS, LATENCY_COLUMNS, STATS_COLUMNS
+from parse_cache import load_columns, file_hash, DEFAULT_CACHE_DIR
+from runs import discover_pairs
+from downsample import DEFAULT_MAX_POINTS
+
+# Renders every best_fit/next_fit pair found under the results dir in one process pool, replacing one python3
+# start (and one matplotlib/seaborn/pgf import) per pair in the plot_*.sh scripts.
+# A manifest in the output root records what every output was built from (input log contents, parser version, plot
+# options and plot script along with every module of this repo it imports, directly or not), so a rerun only renders
+# the pairs where one of those changed or an output is missing.
+PLOTS = {
+    "memory_profiles": {"module": "plot_memory_profiles", "kinds": ("profile",), "columns": PROFILE_COLUMNS, "output_dir": "memory_profiles", "options": ("separate_axis", "max_points", "rasterize", "draft")},
+    "allocation_latency": {"module": "plot_allocation_latency", "kinds": ("latency",), "columns": LATENCY_COLUMNS, "output_dir": "memory_profiles", "options": ("separate_axis", "max_points", "rasterize", "draft")},
+    "memory_stats_per_slab": {"module": "plot_memory_stats_per_slab", "kinds": ("stats",), "columns": STATS_COLUMNS, "output_dir": "memory_stats", "options": ("snapshots", "draft")},
+}
+WORKLOAD_OUTPUT_DIRS = {
+    "random_uniform": "random_uniform",
+    "apps_standalone": "applications_standalone",
+    "apps_sequential": "applications_sequential",
+}
+MANIFEST_NAME = ".plot_manifest.json"
+
+
+def init_worker():
+    # Pay for the heavy imports once per worker instead of once per pair
+    for plot in PLOTS.values():
+        importlib.import_module(plot["module"])
+
+
+def output_dir_for(plot_name: str, workload: str, output_root: str) -> str:
+    output_dir = Path(output_root) / PLOTS[plot_name]["output_dir"]
+    # per-slab stats plots have always been written flat into plots/memory_stats
+    if plot_name != "memory_stats_per_slab":
+        output_dir = output_dir / WORKLOAD_OUTPUT_DIRS[workload]
+    return str(output_dir)
+
+
+def collect_tasks(args: argparse.Namespace):
+    tasks = []
+    for best_run, next_run in discover_pairs(args.results_dir):
+        for plot_name in args.plots:
+            if best_run["kind"] not in PLOTS[plot_name]["kinds"]:
+                continue
+            tasks.append(argparse.Namespace(
+                plot=plot_name,
+                best_fit_log_file=best_run["path"],
+                next_fit_log_file=next_run["path"],
+                output_dir=output_dir_for(plot_name, best_run["workload"], args.output_root),
+                separate_axis=args.separate_axis,
+                cache_dir=args.cache_dir,
+                no_cache=args.no_cache,
+                max_points=args.max_points,
+                rasterize=args.rasterize,
+                snapshots=args.snapshots,
+                draft=args.draft,
+            ))
+    return tasks
+
+
+def task_outputs(task: argparse.Namespace):
+    # Files written by plot_metrics for a task, named after the best fit log
+    stem = log_parser.log_stem(task.best_fit_log_file)
+    if task.plot != "memory_stats_per_slab" and task.separate_axis:
+        return [str(Path(task.output_dir) / f"SEP_{stem}.png")]
+    return [str(Path(task.output_dir) / f"{stem}.png"), str(Path(task.output_dir) / f"{stem}.pdf")]
+
+
+def local_modules(module: str) -> list:
+    # Sorted paths of the module and of the modules of this repo it imports, following their imports in turn
+    root = Path(__file__).resolve().parent
+    seen, pending = {}, [module]
+    while pending:
+        name = pending.pop()
+        path = root / f"{name}.py"
+        if name in seen or not path.exists():
+            continue
+        seen[name] = str(path)
+        for node in ast.walk(ast.parse(path.read_text())):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                pending.append(node.module)
+    return sorted(seen.values())
+
+
+def script_hash(module: str) -> str:
+    digest = hashlib.sha256()
+    for path in local_modules(module):
+        digest.update(f"{Path(path).name}:{file_hash(path)}\n".encode())
+    return digest.hexdigest()
+
+
+def read_manifest(manifest_path: Path) -> dict:
+    try:
+        with open(manifest_path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(manifest_path: Path, manifest: dict):
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def input_state(file_path: str, previous: dict) -> dict:
+    # Same rule as the parse cache: the recorded content hash is trusted while size and mtime are unchanged
+    stat = os.stat(file_path)
+    if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+        return previous
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "content_hash": file_hash(file_path)}
+
+
+def build_entry(task: argparse.Namespace, previous: dict, script_hashes: dict) -> dict:
+    inputs = previous.get("inputs", {})
+    return {
+        "inputs": {path: input_state(path, inputs.get(path)) for path in (task.best_fit_log_file, task.next_fit_log_file)},
+        "parser_version": log_parser.PARSER_VERSION,
+        "config": {"plot": task.plot, "script": script_hashes[task.plot], **{name: getattr(task, name) for name in PLOTS[task.plot]["options"]}},
+    }
+
+
+def is_up_to_date(task: argparse.Namespace, entry: dict, previous: dict) -> bool:
+    if not previous or not all(Path(output).exists() for output in task_outputs(task)):
+        return False
+    same_inputs = {path: state["content_hash"] for path, state in entry["inputs"].items()} == {
+        path: state["content_hash"] for path, state in previous["inputs"].items()
+    }
+    return same_inputs and entry["parser_version"] == previous["parser_version"] and entry["config"] == previous["config"]
+
+
+def render_pair(task: argparse.Namespace) -> str:
+    module = importlib.import_module(PLOTS[task.plot]["module"])
+    if task.plot == "memory_stats_per_slab":
+        best_data = module.load_snapshots(task.best_fit_log_file, task.cache_dir, not task.no_cache)
+        next_data = module.load_snapshots(task.next_fit_log_file, task.cache_dir, not task.no_cache)
+    else:
+        columns = PLOTS[task.plot]["columns"]
+        best_data = load_columns(task.best_fit_log_file, columns, task.cache_dir, not task.no_cache).columns
+        next_data = load_columns(task.next_fit_log_file, columns, task.cache_dir, not task.no_cache).columns
+    module.plot_metrics(best_data=best_data, next_data=next_data, args=task)
+    return task.best_fit_log_file
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Discover all best_fit/next_fit result pairs and render their plots in parallel."
+            )
+
+    parser.add_argument(
+            "--results_dir",
+            type=str,
+            default=".",
+            help="Path pointing to the dir holding the best_fit/ and next_fit/ result trees.",
+            )
+    parser.add_argument(
+            "--output_root",
+            type=str,
+            default="./plots",
+            help="Path pointing to dir under which the plots are saved, in the same layout as the plot_*.sh scripts.",
+            )
+    parser.add_argument(
+            "--plots",
+            nargs="+",
+            choices=list(PLOTS),
+            default=list(PLOTS),
+            help="Which plots to render, all of them by default.",
+            )
+    parser.add_argument(
+            "--jobs",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes, defaults to the core count.",
+            )
+    parser.add_argument(
+            "--separate_axis",
+            action="store_true",
+            help="If set, will plot LHS and in-between fragmentation on separate axis, to see both Best fit and Next fit patterns if scale is too large.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    parser.add_argument(
+            "--max_points",
+            type=int,
+            default=DEFAULT_MAX_POINTS,
+            help="Most rows plotted per run, longer runs keep the min/max of each bucket plus all OOM and slab reset rows. 0 plots every row.",
+            )
+    parser.add_argument(
+            "--rasterize",
+            action="store_true",
+            help="If set, draw the line layers as an embedded image in the PDF, axes and text stay vector.",
+            )
+    parser.add_argument(
+            "--snapshots",
+            type=int,
+            default=4,
+            help="Number of snapshots plotted as bars per memory stats pair, spread evenly over the run.",
+            )
+    parser.add_argument(
+            "--draft",
+            action="store_true",
+            help="If set, render quickly through Agg with mathtext instead of pgf/pdflatex, for iterating on plots.",
+            )
+    parser.add_argument(
+            "--force",
+            action="store_true",
+            help="If set, re-render every plot, even those the manifest reports as up to date.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    manifest_path = Path(args.output_root) / MANIFEST_NAME
+    manifest = read_manifest(manifest_path)
+    script_hashes = {name: script_hash(plot["module"]) for name, plot in PLOTS.items()}
+
+    tasks, entries = [], {}
+    all_tasks = collect_tasks(args)
+    for task in all_tasks:
+        key = task_outputs(task)[0]
+        entries[key] = build_entry(task, manifest.get(key, {}), script_hashes)
+        if args.force or not is_up_to_date(task, entries[key], manifest.get(key)):
+            tasks.append(task)
+        else:
+            # refresh recorded mtimes, so the logs are not hashed again next time
+            manifest[key] = entries[key]
+    print(f"Plotting {len(tasks)} best_fit/next_fit pairs on {args.jobs} workers, {len(all_tasks) - len(tasks)} up to date..")
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker) as pool:
+        futures = {pool.submit(render_pair, task): task for task in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                future.result()
+                manifest[task_outputs(task)[0]] = entries[task_outputs(task)[0]]
+                print(f"Done: {task.plot} {Path(task.best_fit_log_file).name}")
+            except Exception as e:
+                failed += 1
+                manifest.pop(task_outputs(task)[0], None)
+                print(f"Failed: {task.plot} {Path(task.best_fit_log_file).name}: {e}", file=sys.stderr)
+    write_manifest(manifest_path, manifest)
+
+    print("Done :)" if failed == 0 else f"{failed} plots failed")
+    sys.exit(1 if failed else 0)
@@ -1,105 +1,55 @@
-import json
 import matplotlib.pyplot as plt
-import matplotlib
 import argparse
 from pathlib import Path
 from os import makedirs
-import seaborn as sns
 import numpy as np
-
-def process_lines_from_file(file_path):
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-
-    # TODO: this is dirty, print statements at the start of a run need to be unified!
-    try:
-        begin_line_index = next(i for i, line in enumerate(lines) if "Begin synthetic workload!" in line)
-    except StopIteration:
-        try:
-            print("Not a synthetic workload, checking if a standalone application workload")
-            begin_line_index = next(i for i, line in enumerate(lines) if "replay_app" in line)
-        except StopIteration:
-            print("Not a standalone application workload, chekcing if sequential application workload")
-            begin_line_index = next(i for i, line in enumerate(lines) if "replay_seq_app" in line)
-        except StopIteration:
-            print("Not a sequential application workload, checking if concurrent sequential application workload")
-            begin_line_index = next(i for i, line in enumerate(lines) if "replay_concurr_app" in line)
-    
-    # Process lines after the synthetic workload begins, ignoring all duplicate lines containing "[virt:", and memory failures
-    data = []
-    for line in lines[begin_line_index + 1:]:
-        if "[virt:" in line or "malloc failed: AllocFailed" in line or "Untyped Retype: Insufficient memory" in line:
-            continue
-        if "Done :)" in line:
-            break  # Stop processing after this line
-        try:
-            json_str = line[line.index('{'):line.rindex('}')+1]
-            json_str_corrected = json_str.replace("'", '"')  # Correcting for single-quote JSON-like format
-            json_data = json.loads(json_str_corrected)
-
-            if all(key in json_data for key in ["bytes in-use", "slab resets", "untyped_too_small", "oom", "bytes free", "bytes requested", "lhs fragmentation", "in-between fragmentation"]):
-                data.append({
-                    "bytes_in_use": json_data["bytes in-use"],
-                    "slab_resets":  json_data["slab resets"],
-                    "untyped_too_small":  json_data["untyped_too_small"],
-                    "oom":  json_data["oom"],
-                    "bytes_free": json_data["bytes free"],
-                    "bytes_requested": json_data["bytes requested"],
-                    "lhs_fragmentation": json_data["lhs fragmentation"],
-                    "in_between_fragmentation": json_data["in-between fragmentation"],
-                })
-        except Exception as e:
-            continue  # Skip lines that do not contain valid JSON data or have other issues
-
-    return data
+from log_parser import PROFILE_COLUMNS, log_stem
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+from plot_style import configure
+from downsample import lod_indices, step_rows, rasterize_lines, DEFAULT_MAX_POINTS
+from derived_metrics import derive
 
 def plot_metrics(best_data, next_data, args: argparse.Namespace):
-    # Configure for PGF plots
-    matplotlib.rcParams.update(
-        {
-            "pgf.texsystem": "pdflatex",
-            "font.family": "serif",
-            "text.usetex": True,
-        }
-    )
-    matplotlib.use("pgf")
     # NOTE: Changing font scale can drastically change plot size!
-    sns.set(style="whitegrid", font_scale=2)
-    plt.rcParams.update(
-    {
-        "text.color": "black",
-        "axes.edgecolor": "black",
-        "axes.labelcolor": "black",
-        "xtick.color": "black",
-        "ytick.color": "black",
-        "axes.linewidth": 1.5,
-        "xtick.major.size": 5,
-        "xtick.minor.size": 3,
-        "ytick.major.size": 5,
-        "ytick.minor.size": 3,
-    }
-    )
+    configure(args.draft, font_scale=2)
     # Extracting data for plotting
-    best_bytes_requested = np.array([entry["bytes_requested"] for entry in best_data])
-    best_slab_resets = np.array([entry["slab_resets"] for entry in best_data])
-    best_oom = [entry["oom"] for entry in best_data]
+    best_bytes_requested = best_data["bytes_requested"]
+    best_slab_resets = best_data["slab_resets"]
+    best_oom = best_data["oom"]
     # process oom: mask of True where oom actually ocurred
     best_oom = np.diff(best_oom, prepend=0) > 0 # prepend a 0 to match dimension (if there was oom on first call, will also catch that)
-    best_bytes_in_use = np.array([entry["bytes_in_use"] for entry in best_data])
-    best_lhs_fragmentation = np.array([entry["lhs_fragmentation"] for entry in best_data])
-    best_in_between_fragmentation = np.array([entry["in_between_fragmentation"] for entry in best_data])
-
-    next_bytes_requested = np.array([entry["bytes_requested"] for entry in next_data])
-    next_slab_resets = np.array([entry["slab_resets"] for entry in next_data])
-    next_oom = [entry["oom"] for entry in next_data]
+    best_bytes_in_use = best_data["bytes_in_use"]
+    best_lhs_fragmentation = best_data["lhs_fragmentation"]
+    best_in_between_fragmentation = best_data["in_between_fragmentation"]
+    # bytes in-use over committed memory and lhs fragmentation over bytes free, see derived_metrics.py
+    best_derived = derive(best_data)
+    best_utilization = best_derived["utilization"]
+    best_external_fragmentation = best_derived["external_fragmentation"]
+
+    next_bytes_requested = next_data["bytes_requested"]
+    next_slab_resets = next_data["slab_resets"]
+    next_oom = next_data["oom"]
     # process oom: mask of True where oom actually ocurred
     next_oom = np.diff(next_oom, prepend=0) > 0 # prepend a 0 to match dimension (if there was oom on first call, will also catch that)
-    next_bytes_in_use = np.array([entry["bytes_in_use"] for entry in next_data])
-    next_lhs_fragmentation = np.array([entry["lhs_fragmentation"] for entry in next_data])
-    next_in_between_fragmentation = np.array([entry["in_between_fragmentation"] for entry in next_data])
+    next_bytes_in_use = next_data["bytes_in_use"]
+    next_lhs_fragmentation = next_data["lhs_fragmentation"]
+    next_in_between_fragmentation = next_data["in_between_fragmentation"]
+    next_derived = derive(next_data)
+    next_utilization = next_derived["utilization"]
+    next_external_fragmentation = next_derived["external_fragmentation"]
+
+    # Thin out long runs to at most max_points rows each, never dropping OOM markers or slab reset steps
+    best_rows = lod_indices([best_bytes_in_use, best_slab_resets, best_lhs_fragmentation, best_in_between_fragmentation, best_utilization, best_external_fragmentation], args.max_points, best_oom | step_rows(best_slab_resets))
+    best_bytes_requested, best_slab_resets, best_oom, best_bytes_in_use, best_lhs_fragmentation, best_in_between_fragmentation, best_utilization, best_external_fragmentation = (
+        values[best_rows] for values in (best_bytes_requested, best_slab_resets, best_oom, best_bytes_in_use, best_lhs_fragmentation, best_in_between_fragmentation, best_utilization, best_external_fragmentation)
+    )
+    next_rows = lod_indices([next_bytes_in_use, next_slab_resets, next_lhs_fragmentation, next_in_between_fragmentation, next_utilization, next_external_fragmentation], args.max_points, next_oom | step_rows(next_slab_resets))
+    next_bytes_requested, next_slab_resets, next_oom, next_bytes_in_use, next_lhs_fragmentation, next_in_between_fragmentation, next_utilization, next_external_fragmentation = (
+        values[next_rows] for values in (next_bytes_requested, next_slab_resets, next_oom, next_bytes_in_use, next_lhs_fragmentation, next_in_between_fragmentation, next_utilization, next_external_fragmentation)
+    )
 
     # Creating separate plots for each metric
-    fig, axs = plt.subplots(3, 1, figsize=(14, 21))
+    fig, axs = plt.subplots(4, 1, figsize=(14, 28))
 
     # Plot for Bytes in Use
     axs[0].plot(best_bytes_requested, best_bytes_in_use, label="Best Fit - Bytes in Use", marker=',', color='blue', linewidth=3)
@@ -153,14 +103,26 @@ def plot_metrics(best_data, next_data, args: argparse.Namespace):
     axs[2].set_title('Alignment Cons. Fragmentation vs. Bytes Requested')
     axs[2].grid(True)
 
+    # Plot for Utilization and External Fragmentation, both are shares of committed memory, so they share the y axis
+    axs[3].plot(best_bytes_requested, best_utilization, label="Best Fit - Utilization", marker=',', color='tab:purple', linewidth=3)
+    axs[3].plot(next_bytes_requested, next_utilization, label="Next Fit - Utilization", marker=',', color='tab:purple', linestyle="dotted", linewidth=3)
+    axs[3].plot(best_bytes_requested, best_external_fragmentation, label="Best Fit - External Fragmentation", marker=',', color='tab:cyan', linewidth=3)
+    axs[3].plot(next_bytes_requested, next_external_fragmentation, label="Next Fit - External Fragmentation", marker=',', color='tab:cyan', linestyle="dotted", linewidth=3)
+    axs[3].set_ylabel('Share')
+    axs[3].set_ylim(0, 1.05)
+    axs[3].set_xlabel('Bytes Requested')
+    axs[3].set_title('Utilization and External Fragmentation vs. Bytes Requested')
+    axs[3].grid(True)
+
     # Merge all legends
     handles0, labels0 = axs[0].get_legend_handles_labels()
     handles02, labels02 = ax02.get_legend_handles_labels()
     handles1, labels1 = axs[1].get_legend_handles_labels()
     handles2, labels2 = axs[2].get_legend_handles_labels()
-    axs[2].legend(
-        handles0 + handles02 + handles1 + handles2,
-        labels0 + labels02 + labels1 + labels2,
+    handles3, labels3 = axs[3].get_legend_handles_labels()
+    axs[3].legend(
+        handles0 + handles02 + handles1 + handles2 + handles3,
+        labels0 + labels02 + labels1 + labels2 + labels3,
         loc="upper center",
         # to avoid cutting into the text
         borderpad=1,
@@ -174,14 +136,16 @@ def plot_metrics(best_data, next_data, args: argparse.Namespace):
     #axs[1].legend()
     #axs[2].legend()
 
+    rasterize_lines(fig, args.rasterize)
     plt.tight_layout()
     makedirs(args.output_dir, exist_ok=True)
     if args.separate_axis:
-        plt.savefig(Path(args.output_dir) / Path(f"SEP_{Path(args.best_fit_log_file).name.split('.')[-2]}.png"))
+        plt.savefig(Path(args.output_dir) / Path(f"SEP_{log_stem(args.best_fit_log_file)}.png"))
     else:
-        plt.savefig(Path(args.output_dir) / Path(f"{Path(args.best_fit_log_file).name.split('.')[-2]}.png"))
-        plt.savefig(Path(args.output_dir) / Path(f"{Path(args.best_fit_log_file).name.split('.')[-2]}.pdf"), bbox_inches="tight")
+        plt.savefig(Path(args.output_dir) / Path(f"{log_stem(args.best_fit_log_file)}.png"))
+        plt.savefig(Path(args.output_dir) / Path(f"{log_stem(args.best_fit_log_file)}.pdf"), bbox_inches="tight")
     plt.show()
+    plt.close(fig)
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -213,6 +177,39 @@ def parse_args() -> argparse.Namespace:
             help="If set, will plot LHS and in-between fragmentation on separate axis, to see both Best fit and Next fit patterns if scale is too large.",
             )
 
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    parser.add_argument(
+            "--draft",
+            action="store_true",
+            help="If set, render quickly through Agg with mathtext instead of pgf/pdflatex, for iterating on plots.",
+            )
+    parser.add_argument(
+            "--parse_jobs",
+            type=int,
+            default=1,
+            help="Number of worker processes used to parse each large log file, split into byte ranges.",
+            )
+    parser.add_argument(
+            "--max_points",
+            type=int,
+            default=DEFAULT_MAX_POINTS,
+            help="Most rows plotted per run, longer runs keep the min/max of each bucket plus all OOM and slab reset rows. 0 plots every row.",
+            )
+    parser.add_argument(
+            "--rasterize",
+            action="store_true",
+            help="If set, draw the line layers as an embedded image in the PDF, axes and text stay vector.",
+            )
     args = parser.parse_args()
 
     return args
@@ -220,8 +217,8 @@ def parse_args() -> argparse.Namespace:
 if __name__ == "__main__":
     args = parse_args()
 
-    best_data = process_lines_from_file(args.best_fit_log_file)
-    next_data = process_lines_from_file(args.next_fit_log_file)
+    best_data = load_columns(args.best_fit_log_file, PROFILE_COLUMNS, args.cache_dir, not args.no_cache, args.parse_jobs).columns
+    next_data = load_columns(args.next_fit_log_file, PROFILE_COLUMNS, args.cache_dir, not args.no_cache, args.parse_jobs).columns
     print("plotting..")
     plot_metrics(best_data=best_data, next_data=next_data, args=args)
 
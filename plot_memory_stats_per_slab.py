@@ -1,134 +1,101 @@
 import matplotlib.pyplot as plt
-import matplotlib
 import numpy as np
-import json
 import argparse
 from pathlib import Path
 from os import makedirs
-import seaborn as sns
-
-def process_lines_from_file(file_path: str):
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-    begin_line_index = next(i for i, line in enumerate(lines) if "Begin synthetic workload!" in line)
-    
-    # Process lines after the synthetic workload begins, ignoring all duplicate lines containing "[virt:", and memory failures
-    data = []
-    for line in lines[begin_line_index + 1:]:
-        if "[virt:" in line or "malloc failed: AllocFailed" in line or "Untyped Retype: Insufficient memory" in line:
-            continue
-        if "Done :)" in line:
-            break  # Stop processing after this line
-        try:
-            json_str = line[line.index('{'):line.rindex('}')+1]
-            json_str_corrected = json_str.replace("'", '"')  # Correcting for single-quote JSON-like format
-            json_data = json.loads(json_str_corrected)
-
-            if all(key in json_data for key in ["idx", "slab_resets", "untyped_too_small", "oom", "lhs_fragmentation_per_slab", "in_between_fragmentation_per_slab", "occupied_memory_per_slab", "available_space_per_slab"]):
-                print(json_data["idx"])
-                if json_data['idx'] == 0:
-                    # skip state for idx 0 - not interesting
-                    continue
-                data.append({
-                    "idx": json_data["idx"],
-                    "slab_resets": json_data["slab_resets"],
-                    "untyped_too_small": json_data["untyped_too_small"],
-                    "oom": json_data["oom"],
-                    "lhs_fragmentation_per_slab": json_data["lhs_fragmentation_per_slab"],
-                    "in_between_fragmentation_per_slab": json_data["in_between_fragmentation_per_slab"],
-                    "occupied_memory_per_slab": json_data["occupied_memory_per_slab"],
-                    "available_space_per_slab": json_data["available_space_per_slab"],
-                })
-        except Exception as e:
-            continue  # Skip lines that do not contain valid JSON data or have other issues
-
-    return data
+from log_parser import log_stem
+from parse_cache import DEFAULT_CACHE_DIR
+from plot_style import configure
+from derived_metrics import derive
+from slab_state import load_slab_state, pick_snapshots, drawn_peaks, auto_zoom, pool_snapshots, used_slabs
 
-def plot_metrics(best_data, next_data, args: argparse.Namespace):
-    # Configure for PGF plots
-    matplotlib.rcParams.update(
-        {
-            "pgf.texsystem": "pdflatex",
-            "font.family": "serif",
-            "text.usetex": True,
-        }
-    )
-    matplotlib.use("pgf")
-    sns.set(style="whitegrid", font_scale=1.0)
-    plt.rcParams.update(
-    {
-        "text.color": "black",
-        "axes.edgecolor": "black",
-        "axes.labelcolor": "black",
-        "xtick.color": "black",
-        "ytick.color": "black",
-        "axes.linewidth": 1.5,
-        "xtick.major.size": 5,
-        "xtick.minor.size": 3,
-        "ytick.major.size": 5,
-        "ytick.minor.size": 3,
-    }
+BAR_WIDTH = 0.4
+PATTERNS = ['', 'XX']
+NEXT_FIT_ALPHA = 0.8
+METRICS = ["available_space_per_slab", "occupied_memory_per_slab", "in_between_fragmentation_per_slab", "lhs_fragmentation_per_slab"]
+COLORS = ["tab:brown", "tab:blue", "tab:orange", "tab:red"]
+PLOT_TITLES = ["Available space", "Used memory", "Alignment cons. fragmentation", "Watermarking cons. fragmentation"]
+HEATMAP_METRICS = [
+    ("occupied_memory_per_slab", "Used memory"),
+    ("lhs_fragmentation_per_slab", "Watermarking cons. fragmentation"),
+    ("in_between_fragmentation_per_slab", "Alignment cons. fragmentation"),
+    # derived, bytes in-use of the slab over its size (see derived_metrics.py)
+    ("slab_utilization", "Utilization"),
+]
+# Heatmap columns beyond this are max-pooled, more than a figure can show anyway
+HEATMAP_MAX_SNAPSHOTS = 2000
+
+def load_snapshots(file_path: str, cache_dir: str = DEFAULT_CACHE_DIR, use_cache: bool = True):
+    return load_slab_state(file_path, cache_dir, use_cache)
+
+def draw_bars(ax, index, rows, slabs=slice(None)):
+    # One group of bars per slab, one bar per run side by side; in-between fragmentation stacked on lhs fragmentation
+    containers = []
+    for offset, (row, name, pattern, alpha) in zip((-BAR_WIDTH/2, BAR_WIDTH/2), rows):
+        for metric_idx, metric in enumerate(METRICS):
+            bottom = row["lhs_fragmentation_per_slab"][slabs] if metric == "in_between_fragmentation_per_slab" else None
+            bars = ax.bar(index[slabs]+offset, row[metric][slabs], bottom=bottom, linewidth=0, width=BAR_WIDTH, label=f"{name} - {PLOT_TITLES[metric_idx]}", color=COLORS[metric_idx], hatch=pattern, alpha=alpha)
+            containers.append((bars, len(containers) // len(METRICS), metric))
+    return containers
+
+def update_bars(containers, rows, slabs=slice(None)):
+    for bars, run, metric in containers:
+        row = rows[run]
+        bottom = row["lhs_fragmentation_per_slab"][slabs] if metric == "in_between_fragmentation_per_slab" else np.zeros(len(bars))
+        for bar, height, y in zip(bars, row[metric][slabs], bottom):
+            bar.set_height(height)
+            bar.set_y(y)
+
+def add_zoom(ax, index, rows, zoom):
+    # Inset over the slabs too small to read at full scale, see slab_state.auto_zoom
+    zoom_start_idx, zoom_end_idx, zoom_end_y = zoom
+    axins = ax.inset_axes(
+        [0.5, 0.4, 0.47, 0.47], # x, y, width, height as fractions of parent's bbox
+        xlim=(zoom_start_idx-0.5, zoom_end_idx+0.5),
+        ylim=(0, zoom_end_y),
     )
+    slabs = slice(zoom_start_idx, zoom_end_idx+1)
+    containers = draw_bars(axins, index, rows, slabs)
+    axins.set_xticks(index[slabs])
+    axins.set_xticklabels(index[slabs]+1)
+    axins.set_yticks(np.linspace(0, zoom_end_y, num=5))
+    axins.set_yticklabels(np.linspace(0, zoom_end_y, num=5, dtype=int))
+    ax.indicate_inset_zoom(axins, edgecolor="black")
+    return containers, slabs
+
+def plot_metrics(best_data, next_data, args: argparse.Namespace):
+    configure(args.draft, font_scale=1.0)
+    # Snapshots spread evenly over the run, however many the run emitted
+    best_rows = pick_snapshots(best_data["idx"], args.snapshots)
+    next_rows = pick_snapshots(next_data["idx"], args.snapshots)
+    count = min(len(best_rows), len(next_rows))
     # Plotting
-    fig, axs = plt.subplots(4, figsize=(10, 15))
-
-    bar_width = 0.4
-    patterns = ['', 'XX']
-    next_fit_alpha = 0.8
-    metrics = ["available_space_per_slab", "occupied_memory_per_slab", "in_between_fragmentation_per_slab", "lhs_fragmentation_per_slab"]
-    colors = ["tab:brown", "tab:blue", "tab:orange", "tab:red"]
-    plot_titles = ["Available space", "Used memory", "Alignment cons. fragmentation", "Watermarking cons. fragmentation"]
-
-    index = np.arange(len(best_data[0]["lhs_fragmentation_per_slab"]))
-
-    for i in range(4):
-        row_best, row_next = best_data[i], next_data[i]
-        for metric_idx, metric in enumerate(metrics):
-            if metric == 'in_between_fragmentation_per_slab':
-                axs[i].bar(index-bar_width/2, row_best[metric], bottom=row_best["lhs_fragmentation_per_slab"] , linewidth=0, width=bar_width, label=f"Best Fit - {plot_titles[metric_idx]}", color=colors[metric_idx], hatch=patterns[0])
-                axs[i].bar(index+bar_width/2, row_next[metric], bottom=row_next["lhs_fragmentation_per_slab"], linewidth=0, width=bar_width, label=f"Next Fit - {plot_titles[metric_idx]}", color=colors[metric_idx], hatch=patterns[1], alpha=next_fit_alpha)
-            else:
-                axs[i].bar(index-bar_width/2, row_best[metric], linewidth=0, width=bar_width, label=f"Best Fit - {plot_titles[metric_idx]}", color=colors[metric_idx], hatch=patterns[0])
-                axs[i].bar(index+bar_width/2, row_next[metric], linewidth=0, width=bar_width, label=f"Next Fit - {plot_titles[metric_idx]}", color=colors[metric_idx], hatch=patterns[1], alpha=next_fit_alpha)
-        axs[i].set_title(f"Memory slab status after {best_data[i]['idx']} alloc/dealloc operations")
+    fig, axs = plt.subplots(count, figsize=(10, 3.75 * count), squeeze=False)
+    axs = axs[:, 0]
+
+    index = np.arange(best_data["lhs_fragmentation_per_slab"].shape[1])
+    zoom = auto_zoom(np.maximum(drawn_peaks(best_data, best_rows), drawn_peaks(next_data, next_rows)))
+
+    for i in range(count):
+        row_best = {name: column[best_rows[i]] for name, column in best_data.items()}
+        row_next = {name: column[next_rows[i]] for name, column in next_data.items()}
+        rows = [(row_best, "Best Fit", PATTERNS[0], 1), (row_next, "Next Fit", PATTERNS[1], NEXT_FIT_ALPHA)]
+        draw_bars(axs[i], index, rows)
+        axs[i].set_title(f"Memory slab status after {row_best['idx']} alloc/dealloc operations")
         axs[i].set_xlabel("Slab")
         axs[i].set_ylabel("Memory")
 
         #axs[i].set_yscale('log', base=2)
         axs[i].set_xticks(index)
-        axs[i].set_xticklabels(range(1, len(row_best[metrics[0]])+1))
+        axs[i].set_xticklabels(range(1, len(row_best[METRICS[0]])+1))
 
         # Add zoomed-in inset
-        zoom_start_idx = 14
-        zoom_end_idx = 21
-        zoom_start_y = 0
-        zoom_end_y = 17500#35000
-        zoom_indices = index[zoom_start_idx:]
-        axins = axs[i].inset_axes(
-            [0.5, 0.4, 0.47, 0.47], # x, y, width, height as fractions of parent's bbox
-            #65536
-            xlim=(zoom_start_idx+0.5, zoom_end_idx + 0.5),
-            ylim=(zoom_start_y,zoom_end_y),
-            xticklabels=[],
-            yticklabels=[],
-        )  
-        for metric_idx, metric in enumerate(metrics):
-            if metric == 'in_between_fragmentation_per_slab':
-                axins.bar(zoom_indices-bar_width/2, row_best[metric][zoom_start_idx:], bottom=row_best["lhs_fragmentation_per_slab"][zoom_start_idx:] , linewidth=0, width=bar_width, label=f"Best Fit - {plot_titles[metric_idx]}", color=colors[metric_idx], hatch=patterns[0])
-                axins.bar(zoom_indices+bar_width/2, row_next[metric][zoom_start_idx:], bottom=row_next["lhs_fragmentation_per_slab"][zoom_start_idx:], linewidth=0, width=bar_width, label=f"Next Fit - {plot_titles[metric_idx]}", color=colors[metric_idx], hatch=patterns[1], alpha=next_fit_alpha)
-            else:
-                axins.bar(zoom_indices-bar_width/2, row_best[metric][zoom_start_idx:], linewidth=0, width=bar_width, label=f"Best Fit - {plot_titles[metric_idx]}", color=colors[metric_idx], hatch=patterns[0])
-                axins.bar(zoom_indices+bar_width/2, row_next[metric][zoom_start_idx:], linewidth=0, width=bar_width, label=f"Next Fit - {plot_titles[metric_idx]}", color=colors[metric_idx], hatch=patterns[1], alpha=next_fit_alpha)
-        #axins.set_xticks(range(zoom_start_idx, zoom_end_idx+1))
-        axins.set_xticklabels(range(zoom_start_idx+1, zoom_end_idx+2))
-        axins.set_yticks(np.linspace(0, zoom_end_y, num=5))
-        axins.set_yticklabels(np.linspace(0, zoom_end_y, num=5, dtype=int))
-
-        axs[i].indicate_inset_zoom(axins, edgecolor="black")
-
-        print(f"Best fit: Slab resets: {best_data[i]['slab_resets']} No. failed UntypedRetype invocations: {best_data[i]['untyped_too_small']}, Out of Memory thrown: {best_data[i]['oom']}")
-        print(f"Next fit: Slab resets: {next_data[i]['slab_resets']} No. failed UntypedRetype invocations: {next_data[i]['untyped_too_small']}, Out of Memory thrown: {next_data[i]['oom']}")
-    axs[3].legend(loc="upper center",
+        if zoom is not None:
+            add_zoom(axs[i], index, rows, zoom)
+
+        print(f"Best fit: Slab resets: {row_best['slab_resets']} No. failed UntypedRetype invocations: {row_best['untyped_too_small']}, Out of Memory thrown: {row_best['oom']}")
+        print(f"Next fit: Slab resets: {row_next['slab_resets']} No. failed UntypedRetype invocations: {row_next['untyped_too_small']}, Out of Memory thrown: {row_next['oom']}")
+    axs[-1].legend(loc="upper center",
         # to avoid cutting into the text
         borderpad=1,
         bbox_to_anchor=(0.5, -0.160),
@@ -139,13 +106,86 @@ def plot_metrics(best_data, next_data, args: argparse.Namespace):
         )
     plt.tight_layout()
     makedirs(args.output_dir, exist_ok=True)
-    plt.savefig(Path(args.output_dir) / Path(f"{Path(args.best_fit_log_file).name.split('.')[-2]}.png"))
-    plt.savefig(Path(args.output_dir) / Path(f"{Path(args.best_fit_log_file).name.split('.')[-2]}.pdf"), bbox_inches="tight")
+    plt.savefig(Path(args.output_dir) / Path(f"{log_stem(args.best_fit_log_file)}.png"))
+    plt.savefig(Path(args.output_dir) / Path(f"{log_stem(args.best_fit_log_file)}.pdf"), bbox_inches="tight")
     plt.show()
+    plt.close(fig)
+
+def plot_heatmaps(best_data, next_data, args: argparse.Namespace):
+    # Every snapshot of both runs as (slab x snapshot) images, each metric as a share of the slab size so that a 512 B
+    # slab and a 512 KiB slab read on the same colour scale
+    configure(args.draft, font_scale=1.0)
+    slabs = used_slabs(best_data, next_data)
+    runs = [(best_data, "Best Fit"), (next_data, "Next Fit")]
+    fig, axs = plt.subplots(len(HEATMAP_METRICS), len(runs), figsize=(8 * len(runs), 4 * len(HEATMAP_METRICS)), squeeze=False, layout="constrained")
+    derived = [derive(data) for data, _ in runs]
+    for metric_idx, (metric, title) in enumerate(HEATMAP_METRICS):
+        shares = [
+            pool_snapshots(extra[metric][:, slabs] if metric in extra else data[metric][:, slabs] / np.maximum(data["available_space_per_slab"][:, slabs], 1), data["idx"], HEATMAP_MAX_SNAPSHOTS)
+            for (data, _), extra in zip(runs, derived)
+        ]
+        # shared colour range per metric, from the data, so both runs compare directly
+        vmax = max([share.max(initial=0) for share, _ in shares] + [1e-9])
+        for run_idx, ((data, name), (share, idx)) in enumerate(zip(runs, shares)):
+            ax = axs[metric_idx][run_idx]
+            # one column per (pooled) snapshot, stretched up to the next one
+            edges = np.append(idx, data["idx"][-1] + 1)
+            image = ax.pcolormesh(edges, np.arange(len(slabs) + 1), share.T, shading="flat", cmap="viridis", vmin=0, vmax=vmax, rasterized=True)
+            ax.set_title(f"{name} - {title}")
+            ax.set_xlabel("Alloc/dealloc operations")
+            ax.set_ylabel("Slab")
+            ax.set_yticks(np.arange(len(slabs)) + 0.5)
+            ax.set_yticklabels(slabs + 1)
+            ax.grid(False)
+        fig.colorbar(image, ax=axs[metric_idx].tolist(), label="Share of slab")
+    makedirs(args.output_dir, exist_ok=True)
+    plt.savefig(Path(args.output_dir) / Path(f"HEATMAP_{log_stem(args.best_fit_log_file)}.png"))
+    plt.savefig(Path(args.output_dir) / Path(f"HEATMAP_{log_stem(args.best_fit_log_file)}.pdf"), bbox_inches="tight")
+    plt.close(fig)
+
+def save_animation(best_data, next_data, args: argparse.Namespace):
+    # The per-slab bar plot as one frame per snapshot (at most --max_frames, spread over the run), redrawn by updating
+    # the bar heights in place; axis and zoom ranges are fixed over the whole run so frames compare directly
+    configure(True, font_scale=1.0)
+    from matplotlib.animation import FuncAnimation
+
+    count = min(len(best_data["idx"]), len(next_data["idx"]))
+    frames = pick_snapshots(best_data["idx"][:count], min(count, args.max_frames))
+    index = np.arange(best_data["lhs_fragmentation_per_slab"].shape[1])
+    peaks = np.maximum(drawn_peaks(best_data), drawn_peaks(next_data))
+    zoom = auto_zoom(peaks)
+
+    def frame_rows(frame):
+        row_best = {name: column[frame] for name, column in best_data.items()}
+        row_next = {name: column[frame] for name, column in next_data.items()}
+        # no hatching, it triples the time to draw a frame; next fit stays the lighter, right hand bar
+        return [(row_best, "Best Fit", PATTERNS[0], 1), (row_next, "Next Fit", PATTERNS[0], NEXT_FIT_ALPHA)]
+
+    fig, ax = plt.subplots(figsize=(10, 5))
+    rows = frame_rows(frames[0])
+    containers = draw_bars(ax, index, rows)
+    ax.set_ylim(0, peaks.max(initial=0) * 1.05)
+    ax.set_xlabel("Slab")
+    ax.set_ylabel("Memory")
+    ax.set_xticks(index)
+    ax.set_xticklabels(index+1)
+    zoom_containers, zoom_slabs = add_zoom(ax, index, rows, zoom) if zoom is not None else ([], None)
+    title = ax.set_title("")
+
+    def update(frame):
+        rows = frame_rows(frame)
+        update_bars(containers, [row for row, *_ in rows])
+        update_bars(zoom_containers, [row for row, *_ in rows], zoom_slabs)
+        title.set_text(f"Memory slab status after {best_data['idx'][frame]} / {next_data['idx'][frame]} alloc/dealloc operations (left: Best Fit, right: Next Fit)")
+
+    animation = FuncAnimation(fig, update, frames=frames, interval=1000 / args.fps)
+    makedirs(Path(args.animation).parent, exist_ok=True)
+    animation.save(args.animation, writer="pillow" if args.animation.endswith(".gif") else None, fps=args.fps)
+    plt.close(fig)
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
-            description="Process results for memory stats at 25th,50th,75th,100th percentiles for an eval run."
+            description="Process results for memory stats at 25th,50th,75th,100th percentiles (or any --snapshots) for an eval run."
             )
 
     parser.add_argument(
@@ -167,6 +207,50 @@ def parse_args() -> argparse.Namespace:
             default="./plots/memory_stats",
             help="Path pointing to dir in which the resulting plot will be saved.",
             )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    parser.add_argument(
+            "--snapshots",
+            type=int,
+            default=4,
+            help="Number of snapshots plotted as bars, spread evenly over the run (the 25/50/75/100%% points by default).",
+            )
+    parser.add_argument(
+            "--heatmap",
+            action="store_true",
+            help="If set, also plot every snapshot of both runs as per-slab heatmaps (HEATMAP_ prefix).",
+            )
+    parser.add_argument(
+            "--animation",
+            type=str,
+            help="If set, also write the per-slab bars as an animation over the run to this file (.gif, or .mp4 with ffmpeg).",
+            )
+    parser.add_argument(
+            "--max_frames",
+            type=int,
+            default=200,
+            help="Most snapshots in the animation, longer runs are sampled evenly.",
+            )
+    parser.add_argument(
+            "--fps",
+            type=int,
+            default=10,
+            help="Frames per second of the animation.",
+            )
+    parser.add_argument(
+            "--draft",
+            action="store_true",
+            help="If set, render quickly through Agg with mathtext instead of pgf/pdflatex, for iterating on plots.",
+            )
     args = parser.parse_args()
 
     return args
@@ -177,8 +261,12 @@ if __name__ == "__main__":
     file_path_next_fit = args.next_fit_log_file
 
     # TODO: also plot for next fit, next to best fit
-    best_data = process_lines_from_file(file_path_best_fit)
-    next_data = process_lines_from_file(file_path_next_fit)
+    best_data = load_snapshots(file_path_best_fit, args.cache_dir, not args.no_cache)
+    next_data = load_snapshots(file_path_next_fit, args.cache_dir, not args.no_cache)
     print("plotting...")
     plot_metrics(best_data=best_data, next_data=next_data, args=args)
+    if args.heatmap:
+        plot_heatmaps(best_data=best_data, next_data=next_data, args=args)
+    if args.animation:
+        save_animation(best_data=best_data, next_data=next_data, args=args)
 
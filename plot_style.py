@@ -0,0 +1,42 @@
+import matplotlib
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+# Figure setup shared by the plot scripts. Final plots go through the pgf backend, with pdflatex typesetting every
+# text element; draft plots go through Agg with matplotlib's own mathtext, which is much faster and needs no TeX.
+
+
+def configure(draft: bool = False, font_scale: float = 2):
+    if draft:
+        matplotlib.rcParams.update(
+            {
+                "font.family": "serif",
+                "text.usetex": False,
+            }
+        )
+        matplotlib.use("Agg")
+    else:
+        # Configure for PGF plots
+        matplotlib.rcParams.update(
+            {
+                "pgf.texsystem": "pdflatex",
+                "font.family": "serif",
+                "text.usetex": True,
+            }
+        )
+        matplotlib.use("pgf")
+    sns.set(style="whitegrid", font_scale=font_scale)
+    plt.rcParams.update(
+    {
+        "text.color": "black",
+        "axes.edgecolor": "black",
+        "axes.labelcolor": "black",
+        "xtick.color": "black",
+        "ytick.color": "black",
+        "axes.linewidth": 1.5,
+        "xtick.major.size": 5,
+        "xtick.minor.size": 3,
+        "ytick.major.size": 5,
+        "ytick.minor.size": 3,
+    }
+    )
@@ -0,0 +1,324 @@
+import argparse
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+
+from log_parser import KIND_COLUMNS
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+from runs import discover_runs, parse_run_name
+from latency_stats import LatencyHistogram, OPS, EVENTS, run_histograms
+
+# Gates new result logs against the reference logs of the same runs (same strategy, kind, workload and parameters),
+# so memory manager changes that make latency or fragmentation worse fail before they are deployed.
+# Instruction counts are compared as whole distributions, with a one-sided Mann-Whitney U test computed on the
+# latency histograms (ties within a bucket) and bootstrap confidence intervals of the tail percentile; a check only
+# fails when the change is both significant and larger than its threshold. Memory metrics are deterministic for a
+# given workload, so they are compared against thresholds directly, averaged over the runs of each side.
+VERDICTS = ("pass", "fail")
+TAIL_PERCENTILE = 99
+
+
+def relative_change(baseline: float, new: float):
+    # None for a zero baseline, where only the absolute delta means anything
+    if baseline == 0:
+        return None
+    return new / baseline - 1
+
+
+def exceeds(baseline: float, new: float, change, threshold: float) -> bool:
+    # Relative changes against their threshold; from a zero baseline any increase is a regression
+    return new > baseline if change is None else change > threshold
+
+
+def mann_whitney(baseline: np.ndarray, new: np.ndarray):
+    # One-sided test of new being stochastically greater than baseline, from two count vectors over the same buckets.
+    # Returns the p-value (normal approximation with tie and continuity correction) and P(new > baseline).
+    length = max(len(baseline), len(new))
+    baseline, new = np.pad(baseline, (0, length - len(baseline))), np.pad(new, (0, length - len(new)))
+    n1, n2 = int(new.sum()), int(baseline.sum())
+    if n1 == 0 or n2 == 0:
+        return 1.0, 0.5
+    below = np.cumsum(baseline) - baseline
+    u = float(np.sum(new * (below + baseline / 2)))
+    ties = (baseline + new).astype(float)
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - np.sum(ties ** 3 - ties) / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0, u / (n1 * n2)
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2)), u / (n1 * n2)
+
+
+def op_histograms(runs: list) -> dict:
+    # Instruction counts of every run of one side, pooled per op over all event classes
+    totals = {op: LatencyHistogram() for op in OPS}
+    for columns in runs:
+        histograms = run_histograms(columns)
+        for op in OPS:
+            for event in EVENTS:
+                totals[op].merge(histograms[(op, event)])
+    return totals
+
+
+def latency_checks(baseline_runs: list, new_runs: list, args: argparse.Namespace) -> list:
+    checks = []
+    baseline, new = op_histograms(baseline_runs), op_histograms(new_runs)
+    for op in OPS:
+        if len(baseline[op]) == 0 or len(new[op]) == 0:
+            continue
+        p_value, superiority = mann_whitney(baseline[op].counts, new[op].counts)
+        medians = [int(baseline[op].percentiles((50,))[0]), int(new[op].percentiles((50,))[0])]
+        change = relative_change(*medians)
+        checks.append({
+            "metric": f"{op}_instructions_median",
+            "baseline": medians[0],
+            "new": medians[1],
+            "change": change,
+            "delta": medians[1] - medians[0],
+            "threshold": args.median_threshold,
+            "p_value": p_value,
+            "prob_new_greater": superiority,
+            "status": VERDICTS[p_value < args.alpha and exceeds(*medians, change, args.median_threshold)],
+        })
+        # the tail only regresses when the intervals of both sides no longer overlap
+        tails, intervals = [], []
+        for side in (baseline[op], new[op]):
+            low, high = side.bootstrap((TAIL_PERCENTILE,), args.resamples, args.confidence, args.seed)
+            tails.append(int(side.percentiles((TAIL_PERCENTILE,))[0]))
+            intervals.append([float(low[0]), float(high[0])])
+        change = relative_change(*tails)
+        checks.append({
+            "metric": f"{op}_instructions_p{TAIL_PERCENTILE}",
+            "baseline": tails[0],
+            "new": tails[1],
+            "change": change,
+            "delta": tails[1] - tails[0],
+            "threshold": args.tail_threshold,
+            "ci": intervals,
+            "status": VERDICTS[intervals[1][0] > intervals[0][1] and exceeds(*tails, change, args.tail_threshold)],
+        })
+    return checks
+
+
+def run_metrics(columns: dict) -> dict:
+    metrics = {
+        "peak_bytes_in_use": float(np.max(columns["bytes_in_use"], initial=0)),
+        "slab_resets": float(columns["slab_resets"][-1]) if len(columns["slab_resets"]) else 0.0,
+        "oom": float(columns["oom"][-1]) if len(columns["oom"]) else 0.0,
+    }
+    if "lhs_fragmentation" in columns:
+        fragmentation = np.asarray(columns["lhs_fragmentation"]) + np.asarray(columns["in_between_fragmentation"])
+        metrics["final_fragmentation"] = float(fragmentation[-1]) if len(fragmentation) else 0.0
+        metrics["peak_fragmentation"] = float(np.max(fragmentation, initial=0))
+    return metrics
+
+
+def memory_checks(baseline_runs: list, new_runs: list, args: argparse.Namespace) -> list:
+    thresholds = {
+        "peak_bytes_in_use": ("relative", args.peak_threshold),
+        "final_fragmentation": ("relative", args.fragmentation_threshold),
+        "peak_fragmentation": ("relative", args.fragmentation_threshold),
+        "slab_resets": ("absolute", args.reset_threshold),
+        "oom": ("absolute", args.oom_threshold),
+    }
+    baseline = [run_metrics(columns) for columns in baseline_runs]
+    new = [run_metrics(columns) for columns in new_runs]
+    checks = []
+    for metric, (mode, threshold) in thresholds.items():
+        if metric not in baseline[0]:
+            continue
+        values = [float(np.mean([metrics[metric] for metrics in side])) for side in (baseline, new)]
+        delta = values[1] - values[0]
+        change = relative_change(*values) if mode == "relative" else delta
+        checks.append({
+            "metric": metric,
+            "baseline": values[0],
+            "new": values[1],
+            "change": change,
+            "delta": delta,
+            "threshold": threshold,
+            "status": VERDICTS[exceeds(*values, change, threshold)],
+        })
+    return checks
+
+
+def run_key(run: dict) -> tuple:
+    return run["strategy"], run["kind"], run["workload"], run["params"]
+
+
+def collect_new_runs(paths) -> list:
+    runs = []
+    for path in paths:
+        if Path(path).is_dir():
+            runs += discover_runs(path)
+            continue
+        run = parse_run_name(path)
+        if run is None:
+            raise ValueError(f"{path} does not follow the result log naming, the baseline can not be matched")
+        runs.append(run)
+    return runs
+
+
+def gate(args: argparse.Namespace) -> dict:
+    baselines = {}
+    for run in discover_runs(args.baseline_dir):
+        baselines.setdefault(run_key(run), []).append(run["path"])
+    groups = {}
+    skipped = []
+    # stats logs only hold the per-slab snapshots, none of the per-op records the checks compare, so they are skipped
+    for run in collect_new_runs(args.new):
+        if run["kind"] == "stats":
+            skipped.append(run["path"])
+            continue
+        groups.setdefault(run_key(run), []).append(run["path"])
+
+    comparisons = []
+    for key, new_paths in sorted(groups.items()):
+        strategy, kind, workload, params = key
+        comparison = {"strategy": strategy, "kind": kind, "workload": workload, "params": params, "new": new_paths, "baseline": baselines.get(key, [])}
+        if not comparison["baseline"]:
+            comparison["status"] = "no_baseline"
+            comparisons.append(comparison)
+            continue
+        baseline_runs, new_runs = [
+            [load_columns(path, KIND_COLUMNS[kind], args.cache_dir, not args.no_cache).columns for path in paths]
+            for paths in (comparison["baseline"], new_paths)
+        ]
+        checks = memory_checks(baseline_runs, new_runs, args)
+        if kind == "latency":
+            checks = latency_checks(baseline_runs, new_runs, args) + checks
+        comparison["checks"] = checks
+        comparison["status"] = VERDICTS[any(check["status"] == "fail" for check in checks)]
+        comparisons.append(comparison)
+
+    statuses = [comparison["status"] for comparison in comparisons]
+    # no_baseline when nothing was compared: no new runs, only stats logs, or no run with a baseline
+    verdict = "fail" if "fail" in statuses else ("pass" if "pass" in statuses else "no_baseline")
+    thresholds = {name: getattr(args, name) for name in ("alpha", "median_threshold", "tail_threshold", "peak_threshold", "fragmentation_threshold", "reset_threshold", "oom_threshold")}
+    return {"verdict": verdict, "thresholds": thresholds, "comparisons": comparisons, "skipped": skipped}
+
+
+def print_report(report: dict):
+    for comparison in report["comparisons"]:
+        print(f"{comparison['status'].upper():<12}{comparison['strategy']} {comparison['kind']} {comparison['workload']} {comparison['params']}")
+        for check in comparison.get("checks", []):
+            test = f"  p={check['p_value']:.2g}" if "p_value" in check else ""
+            if "ci" in check:
+                test = f"  ci {check['ci'][0][0]:.0f}-{check['ci'][0][1]:.0f} -> {check['ci'][1][0]:.0f}-{check['ci'][1][1]:.0f}"
+            print(f"  {check['status']:<6}{check['metric']:<28}{check['baseline']:>14.0f} -> {check['new']:<14.0f}"
+                  f"{'change ' + format(check['change'], '+.3f') if check['change'] is not None else 'delta ' + format(check['delta'], '+g') + ' from 0'} (threshold {check['threshold']:g}){test}")
+    for path in report["skipped"]:
+        print(f"{'SKIPPED':<12}{path} (stats log, per-slab snapshots only)")
+    print(f"Verdict: {report['verdict']}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Compare new result logs against the reference logs of the same runs, failing on latency or memory regressions."
+            )
+
+    parser.add_argument(
+            "new",
+            nargs="+",
+            help="New log files, or result dirs laid out like the baseline (<strategy>/<workload>/<log>).",
+            )
+    parser.add_argument(
+            "--baseline_dir",
+            type=str,
+            default=".",
+            help="Path pointing to the dir holding the reference best_fit/ and next_fit/ result trees.",
+            )
+    parser.add_argument(
+            "--alpha",
+            type=float,
+            default=0.01,
+            help="Significance level of the Mann-Whitney test on the instruction counts.",
+            )
+    parser.add_argument(
+            "--median_threshold",
+            type=float,
+            default=0.05,
+            help="Largest relative increase of the median instruction count per op that passes.",
+            )
+    parser.add_argument(
+            "--tail_threshold",
+            type=float,
+            default=0.10,
+            help=f"Largest relative increase of the p{TAIL_PERCENTILE} instruction count per op that passes.",
+            )
+    parser.add_argument(
+            "--peak_threshold",
+            type=float,
+            default=0.02,
+            help="Largest relative increase of the peak bytes in-use that passes.",
+            )
+    parser.add_argument(
+            "--fragmentation_threshold",
+            type=float,
+            default=0.05,
+            help="Largest relative increase of the final and peak fragmentation that passes.",
+            )
+    parser.add_argument(
+            "--reset_threshold",
+            type=float,
+            default=0,
+            help="Most additional slab resets that pass.",
+            )
+    parser.add_argument(
+            "--oom_threshold",
+            type=float,
+            default=0,
+            help="Most additional OOMs that pass.",
+            )
+    parser.add_argument(
+            "--resamples",
+            type=int,
+            default=1000,
+            help="Number of bootstrap resamples behind the tail confidence intervals.",
+            )
+    parser.add_argument(
+            "--confidence",
+            type=float,
+            default=99,
+            help="Confidence level of the tail intervals, in percent.",
+            )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the bootstrap resampling.")
+    parser.add_argument(
+            "--allow_missing_baseline",
+            action="store_true",
+            help="If set, exit 0 when no new run could be compared against a baseline, instead of failing.",
+            )
+    parser.add_argument(
+            "--output_json",
+            type=str,
+            help="If set, also write the verdict and every check to this JSON file.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = gate(args)
+    print_report(report)
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump(report, file, indent=2, allow_nan=False)
+    # non-zero exit so CI jobs stop on a regression, or when nothing was gated at all
+    if report["verdict"] == "fail":
+        raise SystemExit(1)
+    if report["verdict"] == "no_baseline" and not args.allow_missing_baseline:
+        raise SystemExit("No new run was compared against a baseline, pass --allow_missing_baseline to accept that")
@@ -0,0 +1,226 @@
+import argparse
+import csv
+import json
+
+import numpy as np
+
+from log_parser import KIND_COLUMNS, EVENT_KINDS, load_events
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+from runs import discover_runs, parse_run_name
+from latency_stats import group_key
+
+# Root-cause table of the memory pressure events: every "Untyped Retype: Insufficient memory" and "malloc failed"
+# line of a run, linked to the allocator record printed last before it, and whether a slab reset or an OOM follows
+# within a few ops.
+SHORTFALL_PERCENTILES = (50, 90, 99)
+# Record columns copied onto each event, per kind of the record it is linked to
+LINKED_COLUMNS = {
+    "profile": ("bytes_requested", "bytes_in_use", "lhs_fragmentation", "in_between_fragmentation", "slab_resets", "untyped_too_small", "oom"),
+    "latency": ("bytes_requested", "bytes_in_use", "objs_in_use", "allocation", "slab_resets", "untyped_too_small", "oom"),
+}
+EVENT_TABLE_FIELDS = ("path", "event", "op", "objects", "object_size", "bytes_needed", "bytes_available", "shortfall",
+                      *LINKED_COLUMNS["profile"], "objs_in_use", "allocation", "snapshot", "reset_follows", "oom_follows")
+
+
+def record_kind(run: dict) -> str:
+    # Kind of the per-op records events are linked to. Stats logs hold only the per-slab snapshots, no per-op
+    # records, so they can not be linked and are rejected.
+    if run["kind"] == "stats":
+        raise ValueError(f"{run['path']} is a stats log, it holds only per-slab snapshots: pass the profile or latency log of the run")
+    return run["kind"]
+
+
+def build_table(events: dict, columns: dict, kind: str, window: int) -> dict:
+    # Event columns plus the linked record values; op is the index of the linked record, -1 before the first one
+    ops = events[f"{kind}_record"]
+    table = {
+        "event": events["event"],
+        "op": ops,
+        "objects": events["objects"],
+        "object_size": events["object_size"],
+        "bytes_needed": events["objects"] * events["object_size"],
+        "bytes_available": events["bytes_available"],
+        "snapshot": events["stats_record"],
+    }
+    table["shortfall"] = table["bytes_needed"] - table["bytes_available"]
+    rows = len(next(iter(columns.values())))
+    linked = np.clip(ops, 0, None)
+    for name in LINKED_COLUMNS[kind]:
+        values = np.asarray(columns[name], dtype=np.int64)
+        table[name] = np.where(ops >= 0, values[linked], 0) if rows else np.zeros(len(ops), dtype=np.int64)
+    # counters over the next window ops, compared to the linked record (all zero before the first one)
+    for counter, flag in (("slab_resets", "reset_follows"), ("oom", "oom_follows")):
+        values = np.asarray(columns[counter], dtype=np.int64)
+        if rows == 0:
+            table[flag] = np.zeros(len(ops), dtype=bool)
+            continue
+        after = values[np.clip(ops + window, 0, rows - 1)]
+        table[flag] = after > table[counter]
+    return table
+
+
+def counter_steps(columns: dict, counter: str) -> np.ndarray:
+    # Ops at which a cumulative counter went up
+    values = np.asarray(columns[counter], dtype=np.int64)
+    return np.flatnonzero(np.diff(values, prepend=0) > 0)
+
+
+def preceded_share(steps: np.ndarray, failure_ops: np.ndarray, window: int):
+    # Share of the counter steps with a retype failure in the window ops before them
+    if len(steps) == 0:
+        return None
+    if len(failure_ops) == 0:
+        return 0.0
+    failure_ops = np.unique(failure_ops)
+    # last failure linked to a record before each step
+    position = np.searchsorted(failure_ops, steps, side="left") - 1
+    last = np.where(position >= 0, failure_ops[np.clip(position, 0, None)], -window - 2)
+    return float(np.mean(steps - last <= window))
+
+
+def summarize(tables: list, steps: dict, window: int) -> dict:
+    table = {name: np.concatenate([table[name] for table in tables]) for name in tables[0]}
+    retype = table["event"] == EVENT_KINDS.index("retype_failure")
+    summary = {name: int(np.sum(table["event"] == index)) for index, name in enumerate(EVENT_KINDS)}
+    summary["ops_with_retype_failures"] = int(sum(len(np.unique(part["op"][part["event"] == EVENT_KINDS.index("retype_failure")])) for part in tables))
+    if retype.any():
+        shortfall = table["shortfall"][retype]
+        summary["shortfall"] = {
+            **{f"p{p:g}": int(value) for p, value in zip(SHORTFALL_PERCENTILES, np.percentile(shortfall, SHORTFALL_PERCENTILES))},
+            "max": int(shortfall.max()),
+            "untyped_exhausted": float(np.mean(table["bytes_available"][retype] == 0)),
+        }
+        sizes, counts = np.unique(table["object_size"][retype], return_counts=True)
+        summary["by_object_size"] = {
+            int(size): {"count": int(count), "median_shortfall": int(np.median(shortfall[table["object_size"][retype] == size]))}
+            for size, count in zip(sizes, counts)
+        }
+        summary["followed_by"] = {
+            "window": window,
+            "slab_reset": float(np.mean(table["reset_follows"][retype])),
+            "oom": float(np.mean(table["oom_follows"][retype])),
+            "either": float(np.mean(table["reset_follows"][retype] | table["oom_follows"][retype])),
+        }
+    summary["preceded_by_retype_failure"] = {
+        counter: {"count": count, "share": None if share is None else round(share, 4)}
+        for counter, (count, share) in steps.items()
+    }
+    return summary
+
+
+def print_summary(key: tuple, runs: int, summary: dict):
+    kind, strategy, workload, group = key
+    print(f"{strategy} {workload} {group} {kind} logs ({runs} runs)")
+    print(f"  {summary['retype_failure']} retype failures over {summary['ops_with_retype_failures']} ops, {summary['alloc_failed']} failed mallocs")
+    if "shortfall" in summary:
+        shortfall = summary["shortfall"]
+        cells = "  ".join(f"{name} {value}" for name, value in shortfall.items() if name != "untyped_exhausted")
+        print(f"  shortfall bytes  {cells}  ({100 * shortfall['untyped_exhausted']:.1f}% with nothing left in the untyped)")
+        sizes = ", ".join(f"{size} B x{stats['count']}" for size, stats in summary["by_object_size"].items())
+        print(f"  retyped object sizes  {sizes}")
+        followed = summary["followed_by"]
+        print(f"  followed within {followed['window']} ops by a slab reset {100 * followed['slab_reset']:.1f}%, "
+              f"an OOM {100 * followed['oom']:.1f}%, either {100 * followed['either']:.1f}%")
+    for counter, stats in summary["preceded_by_retype_failure"].items():
+        if stats["count"]:
+            print(f"  {stats['count']} {counter.replace('_', ' ')} steps, {100 * stats['share']:.1f}% right after a retype failure")
+
+
+def write_event_table(file_path: str, tables: list):
+    with open(file_path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=EVENT_TABLE_FIELDS, restval="")
+        writer.writeheader()
+        for path, table in tables:
+            for row in range(len(table["op"])):
+                values = {name: column[row] for name, column in table.items()}
+                values["event"] = EVENT_KINDS[values["event"]]
+                writer.writerow({"path": path, **{name: value.item() if hasattr(value, "item") else value for name, value in values.items()}})
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Extract the Untyped Retype failures and failed mallocs of result logs, linked to the allocator records around them."
+            )
+
+    parser.add_argument(
+            "--results_dir",
+            type=str,
+            default=".",
+            help="Path pointing to the dir holding the best_fit/ and next_fit/ result trees, all profile and latency logs in it are read.",
+            )
+    parser.add_argument(
+            "--log_files",
+            nargs="+",
+            help="Log files to read instead of discovering them in --results_dir.",
+            )
+    parser.add_argument(
+            "--window",
+            type=int,
+            default=1,
+            help="Ops after a retype failure in which a slab reset or OOM counts as following it.",
+            )
+    parser.add_argument(
+            "--events_csv",
+            type=str,
+            help="If set, write every event with its linked record to this CSV file.",
+            )
+    parser.add_argument(
+            "--output_json",
+            type=str,
+            help="If set, also write the summaries to this JSON file.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.log_files:
+        runs = [parse_run_name(path) or {"path": path, "kind": "profile", "strategy": "", "workload": "", "params": path} for path in args.log_files]
+    else:
+        # stats logs hold only per-slab snapshots, no per-op records to link the events to
+        runs = [run for run in discover_runs(args.results_dir) if run["kind"] != "stats"]
+
+    try:
+        kinds = [record_kind(run) for run in runs]
+    except ValueError as e:
+        raise SystemExit(str(e))
+    groups, event_tables = {}, []
+    for run, kind in zip(runs, kinds):
+        columns = load_columns(run["path"], KIND_COLUMNS[kind], args.cache_dir, not args.no_cache).columns
+        table = build_table(load_events(run["path"]), columns, kind, args.window)
+        event_tables.append((run["path"], table))
+        failure_ops = table["op"][table["event"] == EVENT_KINDS.index("retype_failure")]
+        # profile and latency logs of the same runs hold the same events, kept apart
+        key = (run["kind"], *group_key(run))
+        tables, steps, count = groups.get(key, ([], {}, 0))
+        tables.append(table)
+        for counter in ("slab_resets", "oom"):
+            run_steps = counter_steps(columns, counter)
+            share = preceded_share(run_steps, failure_ops, args.window)
+            total, preceded = steps.get(counter, (0, 0.0))
+            steps[counter] = (total + len(run_steps), preceded + (share or 0) * len(run_steps))
+        groups[key] = (tables, steps, count + 1)
+
+    report = []
+    for key, (tables, steps, count) in sorted(groups.items(), key=lambda item: tuple(str(part) for part in item[0])):
+        shares = {counter: (total, preceded / total if total else None) for counter, (total, preceded) in steps.items()}
+        summary = summarize(tables, shares, args.window)
+        print_summary(key, count, summary)
+        report.append({"kind": key[0], "strategy": key[1], "workload": key[2], "group": key[3], "runs": count, **summary})
+    if args.events_csv:
+        write_event_table(args.events_csv, event_tables)
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,61 @@
+import re
+from pathlib import Path
+
+from log_parser import LOG_SUFFIXES
+
+# Result logs are stored as <strategy>/<workload>/<kind prefix><workload>_<strategy>_<params>.log, e.g.
+# best_fit/random_uniform/latency_random_uniform_best_fit_seed_42_count_1000_dealloc_chance_64.log
+# A run may also be stored compressed (.log.gz, .log.zst) or as a column archive (.npz).
+STRATEGIES = ("best_fit", "next_fit")
+WORKLOADS = ("random_uniform", "apps_standalone", "apps_sequential")
+LOG_KINDS = {"": "profile", "latency_": "latency", "memory_stats_": "stats"}
+
+RUN_NAME = re.compile(
+    r"^(?P<prefix>latency_|memory_stats_)?(?P<workload>" + "|".join(WORKLOADS) + r")_"
+    r"(?P<strategy>[a-z]+_fit)_(?P<params>.+?)(?P<suffix>" + "|".join(re.escape(suffix) for suffix in LOG_SUFFIXES) + r")$"
+)
+RUN_PARAM = re.compile(r"(seed|count|dealloc_chance|app_name|sequence)_([A-Za-z0-9]+)")
+INT_PARAMS = ("seed", "count", "dealloc_chance", "sequence")
+
+
+def parse_run_name(path) -> dict:
+    # Returns the run metadata encoded in the file name, or None for files not following the naming scheme
+    match = RUN_NAME.match(Path(path).name)
+    if match is None:
+        return None
+    run = {
+        "path": str(path),
+        "kind": LOG_KINDS[match["prefix"] or ""],
+        "workload": match["workload"],
+        "strategy": match["strategy"],
+        "params": match["params"],
+        "suffix": match["suffix"],
+    }
+    for name, value in RUN_PARAM.findall(match["params"]):
+        run[name] = int(value) if name in INT_PARAMS else value
+    return run
+
+
+def discover_runs(results_dir: str = ".", strategies=STRATEGIES):
+    # A run stored in several formats is only returned once, in the format cheapest to load
+    runs = {}
+    for strategy in strategies:
+        for path in sorted(Path(results_dir).glob(f"{strategy}/*/*")):
+            run = parse_run_name(path)
+            if run is None or run["strategy"] != strategy:
+                continue
+            key = (run["strategy"], run["kind"], run["workload"], run["params"])
+            if key not in runs or LOG_SUFFIXES.index(run["suffix"]) < LOG_SUFFIXES.index(runs[key]["suffix"]):
+                runs[key] = run
+    return list(runs.values())
+
+
+def discover_pairs(results_dir: str = "."):
+    # Pairs every best_fit run with the next_fit run of the same kind, workload and parameters
+    next_runs = {(run["kind"], run["workload"], run["params"]): run for run in discover_runs(results_dir, ("next_fit",))}
+    pairs = []
+    for best_run in discover_runs(results_dir, ("best_fit",)):
+        next_run = next_runs.get((best_run["kind"], best_run["workload"], best_run["params"]))
+        if next_run is not None:
+            pairs.append((best_run, next_run))
+    return pairs
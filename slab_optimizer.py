@@ -0,0 +1,336 @@
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+from os import makedirs, cpu_count
+from pathlib import Path
+
+import numpy as np
+
+from log_parser import PROFILE_COLUMNS
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+from runs import discover_runs, STRATEGIES
+from latency_stats import group_key
+from slab_sim import DEFAULT_SLAB_LAYOUT, simulate, trace_from_columns
+
+# Searches slab layouts and strategies for the recorded workloads by replaying their op sequences through the slab
+# model of slab_sim.py. Candidates are reached from the CantripOS layout by splitting a slab into two halves or
+# merging two equal slabs into one, so every layout keeps the memory of the default one and only its slicing changes.
+# Each candidate is scored on every trace and the non-dominated ones are reported, over:
+#   peak footprint: highest bytes retyped out of the slabs (in-use plus both fragmentations), the memory to provision
+#   fragmentation: lhs plus in-between fragmentation averaged over the ops
+#   instruction count: modelled instructions of all ops
+# Candidates that run out of memory on more ops than the default layout of their strategy are not eligible.
+SEARCHES = ("grid", "random", "evolve")
+OBJECTIVES = ("peak_footprint", "fragmentation", "instruction_count")
+MIN_SLAB = 512
+MAX_SLAB = max(DEFAULT_SLAB_LAYOUT)
+
+# traces of the worker processes, set once by the pool initializer
+traces = {}
+
+
+def load_traces(args: argparse.Namespace) -> dict:
+    # One trace per workload group, read from the logs of one strategy: the op stream does not depend on the strategy
+    # apart from the ops that ran out of memory
+    found = {}
+    if args.log_files:
+        for path in args.log_files:
+            found[Path(path).stem] = path
+    else:
+        for run in discover_runs(args.results_dir, (args.trace_strategy,)):
+            if run["kind"] == "profile" and (not args.workloads or run["workload"] in args.workloads):
+                found.setdefault(" ".join(str(part) for part in group_key(run)[1:]), run["path"])
+    return {
+        name: trace_from_columns(load_columns(path, PROFILE_COLUMNS, args.cache_dir, not args.no_cache).columns)
+        for name, path in sorted(found.items())
+    }
+
+
+def set_traces(loaded: dict):
+    traces.update(loaded)
+
+
+def neighbours(layout: tuple):
+    # Every layout one split or merge away, slabs kept sorted from the largest down
+    sizes, counts = np.unique(layout, return_counts=True)
+    for size, count in zip(sizes.tolist(), counts.tolist()):
+        rest = list(layout)
+        rest.remove(size)
+        if size // 2 >= MIN_SLAB:
+            yield tuple(sorted(rest + [size // 2, size // 2], reverse=True))
+        if count >= 2 and size * 2 <= MAX_SLAB:
+            rest.remove(size)
+            yield tuple(sorted(rest + [size * 2], reverse=True))
+
+
+def random_walk(layout: tuple, steps: int, rng: np.random.Generator) -> tuple:
+    for _ in range(steps):
+        options = list(neighbours(layout))
+        layout = options[rng.integers(len(options))]
+    return layout
+
+
+def evaluate(candidate: tuple) -> dict:
+    strategy, layout = candidate
+    scores = {"peak_footprint": 0, "fragmentation": 0.0, "instruction_count": 0, "oom": 0, "slab_resets": 0, "untyped_too_small": 0}
+    per_trace = {}
+    for name, trace in traces.items():
+        out = simulate(trace, layout, strategy)[0]
+        fragmentation = out["lhs_fragmentation"] + out["in_between_fragmentation"]
+        result = {
+            "peak_footprint": int(np.max(out["bytes_in_use"] + fragmentation, initial=0)),
+            "fragmentation": float(np.mean(fragmentation)) if len(fragmentation) else 0.0,
+            "instruction_count": int(out["instruction_count"].sum()),
+            **{counter: int(out[counter][-1]) if len(out[counter]) else 0 for counter in ("oom", "slab_resets", "untyped_too_small")},
+        }
+        per_trace[name] = result
+        # the footprint to provision is the largest any workload needs, the rest add up over the workloads
+        scores["peak_footprint"] = max(scores["peak_footprint"], result["peak_footprint"])
+        for metric in ("fragmentation", "instruction_count", "oom", "slab_resets", "untyped_too_small"):
+            scores[metric] += result[metric]
+    scores["fragmentation"] /= max(len(traces), 1)
+    return {"strategy": strategy, "layout": list(layout), **scores, "traces": per_trace}
+
+
+def pareto_front(results: list) -> list:
+    values = np.array([[result[objective] for objective in OBJECTIVES] for result in results], dtype=float)
+    front = []
+    for i, row in enumerate(values):
+        dominated = np.any(np.all(values <= row, axis=1) & np.any(values < row, axis=1))
+        if not dominated:
+            front.append(results[i])
+    return front
+
+
+class Search:
+    # Evaluates candidates on the pool, each (strategy, layout) only once
+
+    def __init__(self, pool: ProcessPoolExecutor, strategies):
+        self.pool = pool
+        self.results = {}
+        self.oom_limit = {}
+        self.evaluate([(strategy, DEFAULT_SLAB_LAYOUT) for strategy in strategies])
+        for strategy in strategies:
+            self.oom_limit[strategy] = self.results[(strategy, DEFAULT_SLAB_LAYOUT)]["oom"]
+
+    def evaluate(self, candidates):
+        new = list(dict.fromkeys(candidate for candidate in candidates if candidate not in self.results))
+        for candidate, result in zip(new, self.pool.map(evaluate, new)):
+            self.results[candidate] = result
+        return [self.results[candidate] for candidate in candidates]
+
+    def eligible(self) -> list:
+        return [result for result in self.results.values() if result["oom"] <= self.oom_limit[result["strategy"]]]
+
+    def front(self) -> list:
+        return pareto_front(self.eligible())
+
+
+def grid_search(search: Search, strategies, args: argparse.Namespace):
+    # Every layout within --depth splits / merges of the default one
+    layouts = {DEFAULT_SLAB_LAYOUT}
+    frontier = {DEFAULT_SLAB_LAYOUT}
+    for _ in range(args.depth):
+        frontier = {layout for parent in frontier for layout in neighbours(parent)} - layouts
+        layouts |= frontier
+    search.evaluate([(strategy, layout) for layout in sorted(layouts) for strategy in strategies])
+
+
+def random_search(search: Search, strategies, args: argparse.Namespace, rng: np.random.Generator):
+    candidates = []
+    for _ in range(args.samples):
+        layout = random_walk(DEFAULT_SLAB_LAYOUT, int(rng.integers(1, args.depth + 1)), rng)
+        candidates.append((strategies[rng.integers(len(strategies))], layout))
+    search.evaluate(candidates)
+
+
+def evolve(search: Search, strategies, args: argparse.Namespace, rng: np.random.Generator):
+    # Children are a few moves away from a parent drawn from the current front, sometimes with the other strategy
+    population = [(strategy, random_walk(DEFAULT_SLAB_LAYOUT, int(rng.integers(1, args.depth + 1)), rng)) for strategy in strategies for _ in range(args.population // len(strategies))]
+    search.evaluate(population)
+    for generation in range(args.generations):
+        parents = [(result["strategy"], tuple(result["layout"])) for result in search.front()] or population
+        children = []
+        for _ in range(args.population):
+            strategy, layout = parents[rng.integers(len(parents))]
+            if len(strategies) > 1 and rng.random() < 0.1:
+                strategy = strategies[rng.integers(len(strategies))]
+            children.append((strategy, random_walk(layout, int(rng.integers(1, 3)), rng)))
+        search.evaluate(children)
+        print(f"generation {generation + 1}: {len(search.results)} candidates evaluated, {len(search.front())} on the front")
+
+
+def describe_layout(layout) -> str:
+    sizes, counts = np.unique(layout, return_counts=True)
+    return " ".join(f"{count}x{size // 1024 if size >= 1024 else size}{'K' if size >= 1024 else ''}" for size, count in sorted(zip(sizes.tolist(), counts.tolist()), reverse=True))
+
+
+def print_front(front: list, defaults: dict):
+    print(f"{'strategy':<10}{'peak footprint':>16}{'fragmentation':>15}{'instructions':>14}{'resets':>8}{'retype':>8}{'oom':>6}  layout")
+    # the defaults are listed even when dominated, as the reference
+    rows = front + [result for result in defaults.values() if not any(result is other for other in front)]
+    for result in sorted(rows, key=lambda result: result["instruction_count"]):
+        mark = " (default)" if tuple(result["layout"]) == DEFAULT_SLAB_LAYOUT else ""
+        print(f"{result['strategy']:<10}{result['peak_footprint']:>16}{result['fragmentation']:>15.0f}{result['instruction_count']:>14}"
+              f"{result['slab_resets']:>8}{result['untyped_too_small']:>8}{result['oom']:>6}  {len(result['layout'])} slabs: {describe_layout(result['layout'])}{mark}")
+
+
+def plot_front(results: list, front: list, defaults: dict, args: argparse.Namespace):
+    import matplotlib.pyplot as plt
+    from plot_style import configure
+
+    configure(args.draft, font_scale=1.5)
+    fig, ax = plt.subplots(figsize=(16, 12))
+    points = ax.scatter([result["peak_footprint"] for result in results], [result["fragmentation"] for result in results],
+                        c=[result["instruction_count"] for result in results], cmap="viridis", s=40, alpha=0.5)
+    ax.scatter([result["peak_footprint"] for result in front], [result["fragmentation"] for result in front],
+               c=[result["instruction_count"] for result in front], cmap="viridis", norm=points.norm, s=160, edgecolors="black", label="Pareto front")
+    for strategy, result in defaults.items():
+        ax.scatter(result["peak_footprint"], result["fragmentation"], marker="*", s=500, color="tab:red", edgecolors="black")
+        ax.annotate(f"default {strategy}", (result["peak_footprint"], result["fragmentation"]), textcoords="offset points", xytext=(-10, 10), ha="right")
+    fig.colorbar(points, ax=ax, label="Modelled instructions")
+    ax.set_xlabel("Peak footprint (bytes)")
+    ax.set_ylabel("Mean fragmentation (bytes)")
+    ax.set_title(f"Slab layouts ({len(results)} eligible candidates)")
+    ax.legend(loc="upper left")
+    plt.tight_layout()
+    makedirs(args.output_dir, exist_ok=True)
+    plt.savefig(Path(args.output_dir) / f"slab_layouts_{args.search}.png")
+    plt.savefig(Path(args.output_dir) / f"slab_layouts_{args.search}.pdf", bbox_inches="tight")
+    plt.close(fig)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Search slab layouts and strategies on the recorded workloads with the slab model, reporting the Pareto front of footprint, fragmentation and instruction cost."
+            )
+
+    parser.add_argument(
+            "--results_dir",
+            type=str,
+            default=".",
+            help="Path pointing to the dir holding the result trees whose profile logs give the traces.",
+            )
+    parser.add_argument(
+            "--log_files",
+            nargs="+",
+            help="Profile or latency logs to replay instead of discovering them in --results_dir.",
+            )
+    parser.add_argument(
+            "--workloads",
+            nargs="+",
+            help="Only replay runs of these workloads, e.g. random_uniform apps_sequential.",
+            )
+    parser.add_argument(
+            "--trace_strategy",
+            type=str,
+            choices=STRATEGIES,
+            default="best_fit",
+            help="Strategy whose logs the traces are read from.",
+            )
+    parser.add_argument(
+            "--strategies",
+            nargs="+",
+            choices=STRATEGIES,
+            default=list(STRATEGIES),
+            help="Placement strategies searched together with the layouts.",
+            )
+    parser.add_argument(
+            "--search",
+            type=str,
+            choices=SEARCHES,
+            default="evolve",
+            help="grid: every layout within --depth moves of the default, random: --samples random walks, evolve: --generations of mutating the front.",
+            )
+    parser.add_argument(
+            "--depth",
+            type=int,
+            default=2,
+            help="Most slab splits / merges away from the default layout for grid search and the random walks.",
+            )
+    parser.add_argument(
+            "--samples",
+            type=int,
+            default=64,
+            help="Number of candidates of the random search.",
+            )
+    parser.add_argument(
+            "--population",
+            type=int,
+            default=16,
+            help="Candidates per generation of the evolutionary search.",
+            )
+    parser.add_argument(
+            "--generations",
+            type=int,
+            default=8,
+            help="Generations of the evolutionary search.",
+            )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random and evolutionary searches.")
+    parser.add_argument(
+            "--jobs",
+            type=int,
+            default=cpu_count(),
+            help="Worker processes evaluating candidates.",
+            )
+    parser.add_argument(
+            "--output_dir",
+            type=str,
+            default="./plots/slab_optimizer",
+            help="Path pointing to dir in which the resulting plot will be saved.",
+            )
+    parser.add_argument(
+            "--output_json",
+            type=str,
+            help="If set, also write the defaults, the front and every eligible candidate to this JSON file.",
+            )
+    parser.add_argument(
+            "--no_plot",
+            action="store_true",
+            help="If set, only print the front.",
+            )
+    parser.add_argument(
+            "--draft",
+            action="store_true",
+            help="If set, render quickly through Agg with mathtext instead of pgf/pdflatex, for iterating on plots.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    loaded = load_traces(args)
+    if not loaded:
+        raise SystemExit("No logs to replay")
+    print(f"Replaying {len(loaded)} traces: {', '.join(loaded)}")
+    rng = np.random.default_rng(args.seed)
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=set_traces, initargs=(loaded,)) as pool:
+        search = Search(pool, args.strategies)
+        if args.search == "grid":
+            grid_search(search, args.strategies, args)
+        elif args.search == "random":
+            random_search(search, args.strategies, args, rng)
+        else:
+            evolve(search, args.strategies, args, rng)
+
+    defaults = {strategy: search.results[(strategy, DEFAULT_SLAB_LAYOUT)] for strategy in args.strategies}
+    front = search.front()
+    print(f"{len(search.results)} candidates evaluated, {len(search.eligible())} without additional OOMs, {len(front)} on the Pareto front")
+    print_front(front, defaults)
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump({"objectives": OBJECTIVES, "defaults": defaults, "front": front, "candidates": search.eligible()}, file, indent=2)
+    if not args.no_plot:
+        plot_front(search.eligible(), front, defaults, args)
@@ -0,0 +1,415 @@
+import argparse
+import warnings
+from bisect import bisect_left, insort
+from collections import defaultdict, deque
+
+import numpy as np
+
+from log_parser import PROFILE_COLUMNS, LATENCY_COLUMNS, RECORD_FORMATS, format_record, format_log_line
+from op_trace import TRACE_DTYPE, read_trace, count_ops, iter_ops
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+
+# Offline model of the CantripOS memory manager: every slab is a watermark (bump) allocator over one Untyped, objects
+# are retyped at the watermark aligned to their size, frees only drop the slab's counters, and a slab whose last
+# object is freed is reset to an empty watermark. Memory between the slab start and the watermark that is neither
+# allocated nor alignment padding is "lhs" (watermark) fragmentation, the padding is "in-between" fragmentation.
+
+# Slab sizes as reported in every available_space_per_slab record
+DEFAULT_SLAB_LAYOUT = (
+    524288, 524288, 262144, 262144, 262144, 131072, 131072, 131072, 131072, 65536, 65536,
+    65536, 65536, 32768, 32768, 16384, 8192, 4096, 4096, 2048, 1024, 512,
+)
+# The manager keeps one more 256 byte slab for itself, it is counted in "bytes free" but never used by the workload
+RESERVED_BYTES = 256
+MIN_OBJECT_SIZE = 16
+STRATEGIES = ("best_fit", "next_fit")
+
+# Instruction cost model fitted to the latency_random_uniform logs: best fit scans every slab, next fit pays for a
+# failed Untyped Retype on every slab it tries before the one that fits (counted in untyped_too_small).
+ALLOC_BASE_COST = 1600
+SLAB_SCAN_COST = 150
+OBJECT_COST = 1400
+FAILED_RETYPE_COST = 24000
+FREE_BASE_COST = 1550
+
+
+def is_power_of_two(value: int) -> bool:
+    return value > 0 and value & (value - 1) == 0
+
+
+def split_bundle(total: int, count: int):
+    # The logs only give the bytes and object count of each op, which are split back into (size, count) groups of
+    # power-of-two objects: equal sizes when they divide evenly, else the binary decomposition of the total with the
+    # largest parts halved until there are count objects.
+    if total <= 0 or count <= 0:
+        return []
+    if total % count == 0 and is_power_of_two(total // count):
+        return [(total // count, count)]
+    parts = defaultdict(int)
+    for bit in range(total.bit_length()):
+        if total >> bit & 1:
+            parts[1 << bit] += 1
+    objects = sum(parts.values())
+    while objects < count:
+        largest = max(size for size, n in parts.items() if n)
+        if largest <= MIN_OBJECT_SIZE:
+            break
+        parts[largest] -= 1
+        parts[largest // 2] += 2
+        objects += 1
+    return sorted(((size, n) for size, n in parts.items() if n), reverse=True)
+
+
+def live_subset(live: dict, total: int, count: int):
+    # (size, count) groups of live objects adding up to count objects and total bytes: the split_bundle guess when
+    # that many objects of its sizes are live, else a search over the live sizes, largest first, pruned by the fewest
+    # and most bytes the remaining sizes can make up. None when no set of live objects adds up.
+    guess = split_bundle(total, count)
+    if guess and all(len(live[size]) >= n for size, n in guess):
+        return guess
+    sizes = sorted((size for size, queue in live.items() if queue), reverse=True)
+    available = [len(live[size]) for size in sizes]
+
+    def reachable(i: int, objects: int, left: int) -> bool:
+        most = least = 0
+        remaining = objects
+        for size, n in zip(sizes[i:], available[i:]):
+            most += size * min(n, remaining)
+            remaining -= min(n, remaining)
+        if remaining:
+            return False
+        remaining = objects
+        for size, n in zip(reversed(sizes[i:]), reversed(available[i:])):
+            least += size * min(n, remaining)
+            remaining -= min(n, remaining)
+        return least <= left <= most
+
+    def search(i: int, objects: int, left: int):
+        if objects == 0:
+            return [] if left == 0 else None
+        if i == len(sizes) or not reachable(i, objects, left):
+            return None
+        for n in range(min(available[i], objects, left // sizes[i]), -1, -1):
+            rest = search(i + 1, objects - n, left - n * sizes[i])
+            if rest is not None:
+                return [(sizes[i], n)] + rest if n else rest
+        return None
+
+    return search(0, count, total)
+
+
+def trace_from_columns(columns: dict) -> np.ndarray:
+    # Rebuilds an op trace from a parsed profile or latency log. Frees only report how many bytes and objects were
+    # released, so they are matched to a set of live objects adding up to both (see live_subset), the oldest of each
+    # size. Failed (OOM) allocations do not report their size and are left out, the simulator decides on its own
+    # whether an op runs out of memory. Warns when the rebuilt live bytes drift from the recorded bytes in-use.
+    bytes_in_use = np.diff(columns["bytes_in_use"], prepend=0)
+    objs_in_use = np.diff(columns["objs_in_use"], prepend=0)
+    live = defaultdict(deque)
+    rows = []
+    next_obj = 0
+    live_bytes = 0
+    diverged = []
+    for op, (delta_bytes, delta_objs) in enumerate(zip(bytes_in_use.tolist(), objs_in_use.tolist())):
+        if delta_objs > 0:
+            for size, count in split_bundle(delta_bytes, delta_objs):
+                for _ in range(count):
+                    live[size].append(next_obj)
+                    rows.append((op, next_obj, size, True))
+                    live_bytes += size
+                    next_obj += 1
+        elif delta_objs < 0:
+            groups = live_subset(live, -delta_bytes, -delta_objs)
+            for size, count in groups if groups is not None else split_bundle(-delta_bytes, -delta_objs):
+                for _ in range(count):
+                    # nothing live adds up: fall back to the oldest object of any size, freed with its own size
+                    size = size if live[size] else next((other for other, queue in live.items() if queue), None)
+                    if size is None:
+                        break
+                    rows.append((op, live[size].popleft(), size, False))
+                    live_bytes -= size
+        if live_bytes != columns["bytes_in_use"][op]:
+            diverged.append(abs(live_bytes - int(columns["bytes_in_use"][op])))
+    if diverged:
+        warnings.warn(f"Rebuilt live set differs from the recorded bytes in-use on {len(diverged)} of {len(bytes_in_use)} ops, by up to {max(diverged)} bytes", stacklevel=2)
+    return np.array(rows, dtype=TRACE_DTYPE)
+
+
+class MaxTree:
+    # Segment tree over the free tail (capacity - watermark) of every slab, answering "first slab at or after i
+    # with at least n free bytes" in O(log slabs) for next fit
+
+    def __init__(self, values):
+        self.size = 1
+        while self.size < len(values):
+            self.size *= 2
+        self.tree = [-1] * (2 * self.size)
+        for i, value in enumerate(values):
+            self.tree[self.size + i] = value
+        for i in range(self.size - 1, 0, -1):
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+
+    def update(self, i: int, value: int):
+        i += self.size
+        self.tree[i] = value
+        i //= 2
+        while i:
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+            i //= 2
+
+    def first_at_least(self, start: int, value: int):
+        return self._first(1, 0, self.size, start, value)
+
+    def _first(self, node: int, lo: int, hi: int, start: int, value: int):
+        if hi <= start or self.tree[node] < value:
+            return None
+        if hi - lo == 1:
+            return lo
+        mid = (lo + hi) // 2
+        found = self._first(2 * node, lo, mid, start, value)
+        return found if found is not None else self._first(2 * node + 1, mid, hi, start, value)
+
+
+def simulate(trace: np.ndarray, layout=DEFAULT_SLAB_LAYOUT, strategy: str = "best_fit", snapshot_every: int = 0):
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {strategy}, expected one of {STRATEGIES}")
+    capacity = [int(size) for size in layout]
+    slabs = len(capacity)
+    watermark = [0] * slabs
+    allocated = [0] * slabs
+    objects = [0] * slabs
+    padding = [0] * slabs
+    tails = MaxTree(capacity)
+    # (free tail, slab) kept sorted for best fit, so candidates are visited from the tightest upwards
+    by_tail = sorted((size, i) for i, size in enumerate(capacity))
+    cursor = 0
+    placement = {}
+
+    def set_watermark(slab: int, value: int):
+        del by_tail[bisect_left(by_tail, (capacity[slab] - watermark[slab], slab))]
+        watermark[slab] = value
+        insort(by_tail, (capacity[slab] - value, slab))
+        tails.update(slab, capacity[slab] - value)
+
+    def fits(slab: int, size: int, count: int):
+        start = -(-watermark[slab] // size) * size
+        return start + size * count <= capacity[slab], start
+
+    def best_fit(size: int, count: int):
+        need = size * count
+        best, best_left = None, None
+        for tail, slab in by_tail[bisect_left(by_tail, (need, -1)):]:
+            # padding is below size, so no larger tail can leave less space than the best found so far
+            if best_left is not None and tail - need - (size - 1) > best_left:
+                break
+            ok, start = fits(slab, size, count)
+            if ok and (best_left is None or capacity[slab] - start - need < best_left):
+                best, best_left = slab, capacity[slab] - start - need
+        return best, 0
+
+    def next_fit(size: int, count: int):
+        need = size * count
+        start = cursor
+        for lo, hi in ((cursor, slabs), (0, cursor)):
+            slab = tails.first_at_least(lo, need)
+            while slab is not None and slab < hi:
+                if fits(slab, size, count)[0]:
+                    # every slab passed over on the way was tried and failed
+                    return slab, (slab - start) % slabs
+                slab = tails.first_at_least(slab + 1, need)
+        return None, slabs
+
+    place = best_fit if strategy == "best_fit" else next_fit
+
+    ops = count_ops(trace)
+    names = ("bytes_requested", "bytes_in_use", "bytes_free", "objs_in_use", "slab_resets", "untyped_too_small", "oom",
+             "lhs_fragmentation", "in_between_fragmentation", "instruction_count")
+    out = {name: np.zeros(ops, dtype=np.int64) for name in names}
+    out["allocation"] = np.zeros(ops, dtype=bool)
+    snapshots = defaultdict(list)
+    totals = {"requested": 0, "in_use": 0, "objs": 0, "watermark": 0, "padding": 0, "resets": 0, "retypes": 0, "oom": 0}
+    total_capacity = sum(capacity) + RESERVED_BYTES
+
+    for op, (allocation, rows) in enumerate(iter_ops(trace)):
+        cost = ALLOC_BASE_COST if allocation else FREE_BASE_COST
+        if allocation:
+            # objects of one size in an op are retyped together, so they must fit contiguously in one slab
+            groups = defaultdict(list)
+            for obj, size in rows:
+                groups[size].append(obj)
+            saved = {}
+            placed = []
+            for size, objs in sorted(groups.items(), reverse=True):
+                slab, failed = place(size, len(objs))
+                totals["retypes"] += failed if strategy == "next_fit" else 0
+                cost += FAILED_RETYPE_COST * failed + SLAB_SCAN_COST * (slabs if strategy == "best_fit" else failed + 1)
+                if slab is None:
+                    break
+                saved.setdefault(slab, (watermark[slab], allocated[slab], objects[slab], padding[slab]))
+                start = fits(slab, size, len(objs))[1]
+                padding[slab] += start - watermark[slab]
+                totals["padding"] += start - watermark[slab]
+                totals["watermark"] += start + size * len(objs) - watermark[slab]
+                set_watermark(slab, start + size * len(objs))
+                allocated[slab] += size * len(objs)
+                objects[slab] += len(objs)
+                placed.append((slab, size, objs))
+                cost += OBJECT_COST * len(objs)
+                if strategy == "next_fit":
+                    cursor = slab
+            if len(placed) < len(groups):
+                # out of memory, nothing of the op stays allocated
+                totals["oom"] += 1
+                cost += 0 if strategy == "next_fit" else FAILED_RETYPE_COST
+                for slab, (old_watermark, old_allocated, old_objects, old_padding) in saved.items():
+                    totals["padding"] += old_padding - padding[slab]
+                    totals["watermark"] += old_watermark - watermark[slab]
+                    set_watermark(slab, old_watermark)
+                    allocated[slab], objects[slab], padding[slab] = old_allocated, old_objects, old_padding
+            else:
+                for slab, size, objs in placed:
+                    for obj in objs:
+                        placement[obj] = (slab, size)
+                    totals["requested"] += size * len(objs)
+                    totals["in_use"] += size * len(objs)
+                    totals["objs"] += len(objs)
+        else:
+            for obj, _ in rows:
+                slab, size = placement.pop(obj, (None, 0))
+                if slab is None:
+                    continue
+                allocated[slab] -= size
+                objects[slab] -= 1
+                totals["in_use"] -= size
+                totals["objs"] -= 1
+                if objects[slab] == 0:
+                    totals["resets"] += 1
+                    totals["padding"] -= padding[slab]
+                    totals["watermark"] -= watermark[slab]
+                    padding[slab] = 0
+                    set_watermark(slab, 0)
+
+        out["bytes_requested"][op] = totals["requested"]
+        out["bytes_in_use"][op] = totals["in_use"]
+        out["bytes_free"][op] = total_capacity - totals["in_use"]
+        out["objs_in_use"][op] = totals["objs"]
+        out["slab_resets"][op] = totals["resets"]
+        out["untyped_too_small"][op] = totals["retypes"]
+        out["oom"][op] = totals["oom"]
+        out["lhs_fragmentation"][op] = totals["watermark"] - totals["in_use"] - totals["padding"]
+        out["in_between_fragmentation"][op] = totals["padding"]
+        out["instruction_count"][op] = cost
+        out["allocation"][op] = allocation
+
+        if snapshot_every and ((op + 1) % snapshot_every == 0 or op + 1 == ops):
+            snapshots["idx"].append(op + 1)
+            snapshots["slab_resets"].append(totals["resets"])
+            snapshots["untyped_too_small"].append(totals["retypes"])
+            snapshots["oom"].append(totals["oom"])
+            snapshots["lhs_fragmentation_per_slab"].append([w - a - p for w, a, p in zip(watermark, allocated, padding)])
+            snapshots["in_between_fragmentation_per_slab"].append(list(padding))
+            snapshots["occupied_memory_per_slab"].append(list(watermark))
+            snapshots["available_space_per_slab"].append(list(capacity))
+
+    return out, {name: np.array(values, dtype=np.int64) for name, values in snapshots.items()}
+
+
+def write_log(file_path: str, kind: str, columns: dict, header: str):
+    # Writes simulated records in the same format as the robot script logs, so every plot script can read them
+    fields = [field for field in columns if "{" + field + "}" in RECORD_FORMATS[kind]]
+    count = len(next(iter(columns.values()))) if columns else 0
+    with open(file_path, "w") as file:
+        file.write(format_log_line(f"CANTRIP> [s{header}"))
+        file.write(format_log_line("Begin synthetic workload!"))
+        for i in range(count):
+            file.write(format_log_line(format_record(kind, {field: columns[field][i] for field in fields})))
+        file.write(format_log_line("Done :)"))
+
+
+def compare_with_log(simulated: dict, recorded: dict = None):
+    print(f"{'metric':<26}{'recorded (final/peak)' if recorded else '':>26}{'simulated (final/peak)':>26}")
+    for name in ("bytes_in_use", "slab_resets", "untyped_too_small", "oom", "lhs_fragmentation", "in_between_fragmentation"):
+        sim = simulated[name]
+        if recorded is None:
+            print(f"{name:<26}{'':>26}{f'{sim[-1]}/{sim.max()}':>26}")
+        elif name in recorded:
+            rec = recorded[name]
+            print(f"{name:<26}{f'{rec[-1]}/{rec.max()}':>26}{f'{sim[-1]}/{sim.max()}':>26}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Replay the op sequence of a recorded run through the best fit / next fit slab model, without Renode."
+            )
+
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument(
+            "--log_file",
+            type=str,
+            help="Path to a profile or latency log produced by the robot script, whose op sequence is replayed.",
+            )
+    inputs.add_argument(
+            "--trace_file",
+            type=str,
+            help="Path to a binary op trace, e.g. written by workload_gen.py.",
+            )
+    parser.add_argument(
+            "--strategy",
+            type=str,
+            choices=STRATEGIES,
+            default="best_fit",
+            help="Allocation strategy to simulate.",
+            )
+    parser.add_argument(
+            "--slab_layout",
+            type=int,
+            nargs="+",
+            default=list(DEFAULT_SLAB_LAYOUT),
+            help="Slab sizes in bytes, defaults to the 22 slab layout of CantripOS.",
+            )
+    parser.add_argument(
+            "--output_log",
+            type=str,
+            help="If set, write the simulated records to this path in the log format of the robot script.",
+            )
+    parser.add_argument(
+            "--output_format",
+            type=str,
+            choices=list(RECORD_FORMATS),
+            default="profile",
+            help="Record format of the written log.",
+            )
+    parser.add_argument(
+            "--snapshot_every",
+            type=int,
+            default=250,
+            help="Ops between per-slab snapshots written with --output_format stats.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.log_file:
+        columns = LATENCY_COLUMNS if "latency" in args.log_file else PROFILE_COLUMNS
+        recorded = load_columns(args.log_file, columns, args.cache_dir).columns
+        trace = trace_from_columns(recorded)
+    else:
+        meta, trace = read_trace(args.trace_file)
+        recorded = None
+        print(f"Trace: {meta}")
+    simulated, snapshots = simulate(trace, args.slab_layout, args.strategy, args.snapshot_every)
+    print(f"Replayed {len(simulated['allocation'])} ops ({len(trace)} objects) with {args.strategy}")
+    if recorded is not None:
+        print(f"{int(np.count_nonzero(np.diff(recorded['oom'], prepend=0)))} failed allocations in the log carry no size and are not replayed")
+    compare_with_log(simulated, recorded)
+    if args.output_log:
+        records = snapshots if args.output_format == "stats" else simulated
+        write_log(args.output_log, args.output_format, records, f"simulate {args.strategy}")
@@ -0,0 +1,63 @@
+import numpy as np
+
+from log_parser import STATS_COLUMNS
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+
+# Per-slab memory state of a memory stats run as dense (snapshot x slab) int64 arrays, one per metric, at whatever
+# snapshot frequency the run emitted, plus the helpers the plots use to pick snapshots and zoom ranges from the data.
+SLAB_METRICS = ("occupied_memory_per_slab", "available_space_per_slab", "lhs_fragmentation_per_slab", "in_between_fragmentation_per_slab")
+# Slabs whose peak stays below 1/ZOOM_RATIO of the largest slab are unreadable at full scale and get a zoomed inset
+ZOOM_RATIO = 32
+ZOOM_MARGIN = 1.05
+
+
+def load_slab_state(file_path: str, cache_dir: str = DEFAULT_CACHE_DIR, use_cache: bool = True) -> dict:
+    data = load_columns(file_path, STATS_COLUMNS, cache_dir, use_cache).columns
+    # skip state for idx 0 - not interesting
+    keep = data["idx"] != 0
+    return {name: column[keep] for name, column in data.items()}
+
+
+def pick_snapshots(idx: np.ndarray, count: int) -> np.ndarray:
+    # Rows closest to the 1/count, 2/count, .. 100% points of the run, i.e. every row when the run emitted only count
+    if len(idx) == 0:
+        return np.zeros(0, dtype=int)
+    positions = np.ceil(len(idx) * np.arange(1, count + 1) / count).astype(int) - 1
+    return np.unique(np.clip(positions, 0, len(idx) - 1))
+
+
+def drawn_peaks(state: dict, rows=slice(None)) -> np.ndarray:
+    # Highest bar drawn per slab over the given rows: the slab size, used memory, or both fragmentations stacked
+    fragmentation = state["lhs_fragmentation_per_slab"][rows] + state["in_between_fragmentation_per_slab"][rows]
+    heights = np.maximum.reduce([state["available_space_per_slab"][rows], state["occupied_memory_per_slab"][rows], fragmentation])
+    return heights.max(axis=0, initial=0)
+
+
+def auto_zoom(peaks: np.ndarray, ratio: float = ZOOM_RATIO):
+    # Longest run of adjacent slabs too small to read next to the largest one, as (first slab, last slab, y limit),
+    # or None when every slab is readable (or none is)
+    small = peaks * ratio <= peaks.max(initial=0)
+    if not small.any() or small.all():
+        return None
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], small.astype(np.int8), [0]))))
+    starts, stops = edges[::2], edges[1::2]
+    longest = np.argmax(stops - starts)
+    first, last = starts[longest], stops[longest] - 1
+    return int(first), int(last), float(peaks[first:last + 1].max() * ZOOM_MARGIN)
+
+
+def pool_snapshots(matrix: np.ndarray, idx: np.ndarray, max_rows: int):
+    # Max over consecutive snapshots, so a heatmap of thousands of snapshots keeps every peak at screen resolution;
+    # returns the pooled matrix and the idx each pooled row starts at
+    if len(matrix) <= max_rows:
+        return matrix, idx
+    starts = np.linspace(0, len(matrix), max_rows, endpoint=False).astype(int)
+    return np.maximum.reduceat(matrix, starts, axis=0), idx[starts]
+
+
+def used_slabs(*states) -> np.ndarray:
+    # Slabs that held anything at some point in any of the runs, the others only add empty rows to the heatmaps
+    used = np.zeros(states[0]["occupied_memory_per_slab"].shape[1], dtype=bool)
+    for state in states:
+        used |= state["occupied_memory_per_slab"].any(axis=0)
+    return np.flatnonzero(used)
@@ -0,0 +1,166 @@
+import argparse
+from array import array
+
+import numpy as np
+
+from op_trace import TRACE_DTYPE, TraceWriter
+
+# Generates op traces shaped like the ssynthetic_random_alloc workload of CantripOS
+# (ssynthetic_random_alloc <seed> <count> <dealloc chance> <mode> <strategy>): at every step a random live bundle is
+# freed with probability dealloc_chance %, otherwise a new bundle is allocated, and whatever is still live is freed
+# at the end. Traces are streamed to disk chunk by chunk, the only state kept is the set of live bundles.
+
+# (object size, objects) bundles drawn by ssynthetic_random_alloc, weighted by how often they appear across the
+# random_uniform logs
+SYNTHETIC_BUNDLES = (
+    ((16, 1), 1202), ((32, 1), 747), ((64, 1), 96), ((128, 1), 145), ((256, 1), 294), ((512, 1), 796),
+    ((1024, 1), 276), ((2048, 1), 47), ((4096, 1), 720), ((4096, 2), 67), ((4096, 3), 44), ((4096, 4), 46),
+    ((4096, 5), 53), ((4096, 6), 79), ((4096, 7), 56), ((4096, 8), 53), ((4096, 9), 68), ((4096, 10), 32),
+    ((8192, 1), 53), ((16384, 1), 46),
+)
+SIZE_DISTRIBUTIONS = ("random_uniform", "power_law", "bimodal")
+LIFETIMES = ("random", "fifo", "leak")
+MIN_SIZE_BITS = 4
+MAX_SIZE_BITS = 16
+CHUNK_OPS = 1 << 16
+
+
+def sample_bundles(rng: np.random.Generator, n: int, args: argparse.Namespace):
+    # Returns (object size, objects) arrays for n allocations
+    if args.sizes == "random_uniform":
+        shapes = np.array([shape for shape, _ in SYNTHETIC_BUNDLES])
+        weights = np.array([weight for _, weight in SYNTHETIC_BUNDLES], dtype=float)
+        picked = shapes[rng.choice(len(shapes), size=n, p=weights / weights.sum())]
+        return picked[:, 0], picked[:, 1]
+    bits = np.arange(MIN_SIZE_BITS, MAX_SIZE_BITS + 1)
+    if args.sizes == "power_law":
+        # P(size = 2^bits) falls off as a power of the size rank, small objects dominate with a long tail
+        weights = (bits - MIN_SIZE_BITS + 1.0) ** -args.alpha
+        drawn = rng.choice(bits, size=n, p=weights / weights.sum())
+    else:
+        # small kernel objects (16-256 bytes) mixed with a fraction of large buffers (16-64 KiB)
+        small = rng.integers(MIN_SIZE_BITS, 9, size=n)
+        large = rng.integers(14, MAX_SIZE_BITS + 1, size=n)
+        drawn = np.where(rng.random(n) < args.large_fraction, large, small)
+    return np.left_shift(1, drawn), np.ones(n, dtype=np.int64)
+
+
+def iter_trace_chunks(args: argparse.Namespace):
+    rng = np.random.default_rng(args.seed)
+    # live bundles as (first object, object size, objects) in typed arrays, about 20 bytes per live bundle
+    live_obj, live_size, live_count = array("Q"), array("I"), array("I")
+    head = 0  # fifo lifetimes consume live bundles from the front
+    next_obj = 0
+    op = 0
+    rows = {field: array(code) for field, code in (("op", "Q"), ("obj", "Q"), ("size", "I"), ("allocation", "B"))}
+
+    def emit(allocation: int, obj: int, size: int, count: int):
+        for i in range(count):
+            rows["op"].append(op)
+            rows["obj"].append(obj + i)
+            rows["size"].append(size)
+            rows["allocation"].append(allocation)
+
+    def flush():
+        chunk = np.empty(len(rows["op"]), dtype=TRACE_DTYPE)
+        for field, values in rows.items():
+            chunk[field] = np.frombuffer(values, dtype=values.typecode)
+            del values[:]
+        return chunk
+
+    dealloc = args.dealloc_chance / 100
+    for start in range(0, args.count, CHUNK_OPS):
+        n = min(CHUNK_OPS, args.count - start)
+        decide, pick, leak = rng.random(n), rng.random(n), rng.random(n)
+        sizes, counts = sample_bundles(rng, n, args)
+        for i in range(n):
+            alive = len(live_obj) - head
+            if alive and decide[i] < dealloc:
+                if args.lifetime == "fifo":
+                    j = head
+                    head += 1
+                else:
+                    j = len(live_obj) - 1 - int(pick[i] * alive)
+                emit(0, live_obj[j], live_size[j], live_count[j])
+                if args.lifetime != "fifo":
+                    live_obj[j], live_size[j], live_count[j] = live_obj[-1], live_size[-1], live_count[-1]
+                    live_obj.pop(), live_size.pop(), live_count.pop()
+            else:
+                size, count = int(sizes[i]), int(counts[i])
+                emit(1, next_obj, size, count)
+                # leaked bundles are never freed, not even at the end of the run
+                if args.lifetime != "leak" or leak[i] >= args.leak_fraction:
+                    live_obj.append(next_obj), live_size.append(size), live_count.append(count)
+                next_obj += count
+            op += 1
+            if args.lifetime == "fifo" and head > CHUNK_OPS and head * 2 > len(live_obj):
+                del live_obj[:head], live_size[:head], live_count[:head]
+                head = 0
+        yield flush()
+
+    # free everything still live, one bundle per op like the end of ssynthetic_random_alloc
+    for j in range(head, len(live_obj)):
+        emit(0, live_obj[j], live_size[j], live_count[j])
+        op += 1
+        if len(rows["op"]) >= CHUNK_OPS:
+            yield flush()
+    yield flush()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Generate a synthetic alloc/free op trace shaped like ssynthetic_random_alloc, as a binary trace file."
+            )
+
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the random generator.")
+    parser.add_argument("--count", type=int, default=1000, help="Number of alloc/free steps, before the final frees.")
+    parser.add_argument(
+            "--dealloc_chance",
+            type=int,
+            default=16,
+            help="Chance in percent that a step frees a live bundle instead of allocating one.",
+            )
+    parser.add_argument(
+            "--sizes",
+            type=str,
+            choices=SIZE_DISTRIBUTIONS,
+            default="random_uniform",
+            help="Size distribution: the object mix of ssynthetic_random_alloc, power-law sizes, or small/large bimodal sizes.",
+            )
+    parser.add_argument(
+            "--lifetime",
+            type=str,
+            choices=LIFETIMES,
+            default="random",
+            help="Which bundle a free releases: a random live one, the oldest one (producer/consumer), or random with leaks.",
+            )
+    parser.add_argument("--alpha", type=float, default=1.5, help="Exponent of the power-law size distribution.")
+    parser.add_argument(
+            "--large_fraction",
+            type=float,
+            default=0.1,
+            help="Fraction of large objects in the bimodal size distribution.",
+            )
+    parser.add_argument(
+            "--leak_fraction",
+            type=float,
+            default=0.05,
+            help="Fraction of allocations that are never freed with --lifetime leak.",
+            )
+    parser.add_argument(
+            "--output_file",
+            type=str,
+            required=True,
+            help="Path of the binary trace to write.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    meta = {name: value for name, value in vars(args).items() if name != "output_file"}
+    with TraceWriter(args.output_file, meta) as writer:
+        for chunk in iter_trace_chunks(args):
+            writer.write(chunk)
+    print(f"Wrote {writer.rows} rows to {args.output_file}")
@@ -0,0 +1,370 @@
+import argparse
+import base64
+import json
+from os import makedirs
+from pathlib import Path
+
+import numpy as np
+
+from log_parser import KIND_COLUMNS, log_stem
+from parse_cache import load_columns, DEFAULT_CACHE_DIR
+from runs import discover_runs, parse_run_name, STRATEGIES, WORKLOADS
+from downsample import minmax_pyramid, DEFAULT_PYRAMID_FACTOR, DEFAULT_PYRAMID_BUCKETS
+
+# Self-contained HTML report for zooming through whole runs, opened straight from disk (no server, no external
+# scripts). Every series is stored with every row (level 0) plus the min/max levels of downsample.minmax_pyramid,
+# each level cut into base64 chunks of CHUNK_BUCKETS buckets. The page draws a panel on a canvas from the finest level
+# with at most two buckets per pixel column in the zoom window, decoding only the chunks the window covers (and
+# keeping them for later), so the cost of a redraw depends on the canvas width, not on the length of the run.
+# Coarse levels are drawn as a min/max envelope, so spikes stay visible at any zoom.
+# Panels share the op axis: scroll to zoom around the cursor, drag to pan, double click to see the whole run.
+# Runs of both strategies with the same workload and parameters form one group, the page switches between groups.
+CHUNK_BUCKETS = 1 << 14
+# (panel title, log kind, columns summed into the series)
+PANELS = (
+    ("Bytes in-use", "profile", ("bytes_in_use",)),
+    ("Fragmentation (lhs + in-between)", "profile", ("lhs_fragmentation", "in_between_fragmentation")),
+    ("Instruction count", "latency", ("instruction_count",)),
+)
+INT32_RANGE = (-(1 << 31), (1 << 31) - 1)
+
+
+def encode(values: np.ndarray) -> dict:
+    # Chunks of little-endian int32 (float64 when out of range) as base64
+    values = np.asarray(values)
+    small = len(values) == 0 or (values.min() >= INT32_RANGE[0] and values.max() <= INT32_RANGE[1])
+    values = values.astype("<i4" if small else "<f8")
+    return {
+        "dtype": "i4" if small else "f8",
+        "chunks": [base64.b64encode(values[start:start + CHUNK_BUCKETS].tobytes()).decode("ascii") for start in range(0, len(values), CHUNK_BUCKETS)],
+    }
+
+
+def series_levels(values: np.ndarray, args: argparse.Namespace) -> dict:
+    levels = [{"size": 1, "min": encode(values)}]
+    for k, (mins, maxs) in enumerate(minmax_pyramid(values, args.factor, args.min_buckets), start=1):
+        levels.append({"size": args.factor ** k, "min": encode(mins), "max": encode(maxs)})
+    return {"rows": len(values), "chunk": CHUNK_BUCKETS, "levels": levels}
+
+
+def group_data(name: str, runs: list, args: argparse.Namespace) -> dict:
+    panels = []
+    for title, kind, names in PANELS:
+        series = []
+        for run in runs:
+            if run["kind"] != kind:
+                continue
+            columns = load_columns(run["path"], KIND_COLUMNS[kind], args.cache_dir, not args.no_cache).columns
+            values = np.sum([np.asarray(columns[column], dtype=np.int64) for column in names], axis=0)
+            series.append({"name": run.get("strategy", log_stem(run["path"])), **series_levels(values, args)})
+        if series:
+            panels.append({"title": title, "series": series})
+    return {"name": name, "panels": panels}
+
+
+def find_groups(args: argparse.Namespace) -> dict:
+    groups = {}
+    if args.log_files:
+        for path in args.log_files:
+            run = parse_run_name(path) or {"path": path, "kind": args.kind}
+            groups.setdefault(log_stem(path), []).append(run)
+        return groups
+    for run in discover_runs(args.results_dir, args.strategies):
+        if run["kind"] in ("profile", "latency") and run["workload"] in args.workloads:
+            groups.setdefault(f"{run['workload']} {run['params']}", []).append(run)
+    return dict(sorted(groups.items()))
+
+
+def write_report(path: str, groups: list):
+    # </ is escaped so no series name can close the data script early
+    data = json.dumps(groups, separators=(",", ":")).replace("</", "<\\/")
+    makedirs(Path(path).parent, exist_ok=True)
+    with open(path, "w") as file:
+        file.write(REPORT_TEMPLATE.replace("__REPORT_DATA__", data))
+
+
+REPORT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Allocator runs</title>
+<style>
+  body { font-family: serif; margin: 16px; }
+  .panel { position: relative; margin-bottom: 12px; }
+  canvas { width: 100%; height: 260px; display: block; border: 1px solid black; cursor: crosshair; }
+  .readout { font-family: monospace; font-size: 13px; min-height: 1.2em; }
+  .hint { color: gray; font-size: 13px; }
+</style>
+</head>
+<body>
+<select id="group"></select>
+<span class="hint">scroll: zoom, drag: pan, double click: whole run</span>
+<div id="panels"></div>
+<script id="report-data" type="application/json">__REPORT_DATA__</script>
+<script>
+"use strict";
+const groups = JSON.parse(document.getElementById("report-data").textContent);
+const COLORS = ["#4c72b0", "#dd8452", "#55a868", "#c44e52", "#8172b3", "#937860"];
+const MARGIN = { left: 80, right: 10, top: 22, bottom: 24 };
+let group = null, view = null, hover = null, canvases = [];
+
+// chunks are decoded the first time a window needs them and kept on the level they belong to
+function chunk(encoded, i) {
+  encoded.decoded = encoded.decoded || [];
+  if (encoded.decoded[i] === undefined) {
+    const bytes = Uint8Array.from(atob(encoded.chunks[i]), c => c.charCodeAt(0));
+    encoded.decoded[i] = encoded.dtype === "i4" ? new Int32Array(bytes.buffer) : new Float64Array(bytes.buffer);
+  }
+  return encoded.decoded[i];
+}
+
+// finest level with at most two buckets per pixel over the window, and its [first, last] bucket
+function pick(series, width) {
+  const span = view[1] - view[0];
+  let level = series.levels[series.levels.length - 1];
+  for (const candidate of series.levels) {
+    if (span / candidate.size <= 2 * width) { level = candidate; break; }
+  }
+  const buckets = Math.ceil(series.rows / level.size);
+  const first = Math.max(0, Math.floor(view[0] / level.size) - 1);
+  const last = Math.min(buckets - 1, Math.ceil(view[1] / level.size) + 1);
+  return { level, first, last };
+}
+
+function bucket(series, level, i, which) {
+  const encoded = which === "max" && level.max ? level.max : level.min;
+  return chunk(encoded, Math.floor(i / series.chunk))[i % series.chunk];
+}
+
+function extent(panel, width) {
+  let low = Infinity, high = -Infinity;
+  for (const series of panel.series) {
+    const { level, first, last } = pick(series, width);
+    for (let i = first; i <= last; i++) {
+      low = Math.min(low, bucket(series, level, i, "min"));
+      high = Math.max(high, bucket(series, level, i, "max"));
+    }
+  }
+  if (!isFinite(low)) { low = 0; high = 1; }
+  if (low === high) { high = low + 1; }
+  const pad = 0.05 * (high - low);
+  return [low - pad, high + pad];
+}
+
+function ticks(low, high, count) {
+  const step = Math.pow(10, Math.floor(Math.log10((high - low) / count)));
+  const nice = [1, 2, 5, 10].map(f => f * step).find(s => (high - low) / s <= count);
+  const values = [];
+  for (let v = Math.ceil(low / nice) * nice; v <= high; v += nice) values.push(v);
+  return values;
+}
+
+function draw(index) {
+  const canvas = canvases[index], panel = group.panels[index];
+  const ratio = window.devicePixelRatio || 1;
+  canvas.width = canvas.clientWidth * ratio;
+  canvas.height = canvas.clientHeight * ratio;
+  const ctx = canvas.getContext("2d");
+  ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+  const width = canvas.clientWidth - MARGIN.left - MARGIN.right;
+  const height = canvas.clientHeight - MARGIN.top - MARGIN.bottom;
+  const [low, high] = extent(panel, width);
+  const x = op => MARGIN.left + (op - view[0]) / (view[1] - view[0]) * width;
+  const y = value => MARGIN.top + (high - value) / (high - low) * height;
+  ctx.clearRect(0, 0, canvas.clientWidth, canvas.clientHeight);
+  ctx.font = "12px serif";
+  ctx.fillStyle = "black";
+  ctx.fillText(panel.title, MARGIN.left, 14);
+  ctx.strokeStyle = "#ddd";
+  ctx.textAlign = "right";
+  for (const v of ticks(low, high, 5)) {
+    ctx.beginPath(); ctx.moveTo(MARGIN.left, y(v)); ctx.lineTo(MARGIN.left + width, y(v)); ctx.stroke();
+    ctx.fillText(v.toLocaleString(), MARGIN.left - 4, y(v) + 4);
+  }
+  ctx.textAlign = "center";
+  for (const v of ticks(view[0], view[1], 8)) {
+    ctx.beginPath(); ctx.moveTo(x(v), MARGIN.top); ctx.lineTo(x(v), MARGIN.top + height); ctx.stroke();
+    ctx.fillText(v.toLocaleString(), x(v), MARGIN.top + height + 16);
+  }
+  ctx.save();
+  ctx.beginPath(); ctx.rect(MARGIN.left, MARGIN.top, width, height); ctx.clip();
+  const readout = [];
+  panel.series.forEach((series, s) => {
+    const { level, first, last } = pick(series, width);
+    ctx.strokeStyle = COLORS[s % COLORS.length];
+    ctx.lineWidth = 1.5;
+    ctx.beginPath();
+    for (let i = first; i <= last; i++) {
+      // a bucket is drawn at its centre, every row of level 0 at its own op
+      const at = x(i * level.size + (level.size - 1) / 2);
+      if (i === first) ctx.moveTo(at, y(bucket(series, level, i, "min")));
+      ctx.lineTo(at, y(bucket(series, level, i, "min")));
+      if (level.max) ctx.lineTo(at, y(bucket(series, level, i, "max")));
+    }
+    ctx.stroke();
+    ctx.fillStyle = ctx.strokeStyle;
+    ctx.textAlign = "right";
+    ctx.fillText(series.name + " (" + (level.size === 1 ? "every op" : level.size + " ops per bucket") + ")", MARGIN.left + width - 4, MARGIN.top + 14 * (s + 1));
+    if (hover !== null && hover >= 0 && hover < series.rows) {
+      const i = Math.floor(hover / level.size);
+      const min = bucket(series, level, i, "min"), max = bucket(series, level, i, "max");
+      readout.push(series.name + ": " + (min === max ? min.toLocaleString() : min.toLocaleString() + " .. " + max.toLocaleString()));
+    }
+  });
+  ctx.restore();
+  if (hover !== null) {
+    ctx.strokeStyle = "gray";
+    ctx.beginPath(); ctx.moveTo(x(hover), MARGIN.top); ctx.lineTo(x(hover), MARGIN.top + height); ctx.stroke();
+  }
+  canvas.nextSibling.textContent = hover === null ? "" : "op " + hover.toLocaleString() + "   " + readout.join("   ");
+}
+
+let pending = false;
+function redraw() {
+  if (pending) return;
+  pending = true;
+  requestAnimationFrame(() => { pending = false; canvases.forEach((_, i) => draw(i)); });
+}
+
+function rows() {
+  return Math.max(1, ...group.panels.flatMap(panel => panel.series.map(series => series.rows)));
+}
+
+function clamp(start, end) {
+  const total = rows(), span = Math.min(Math.max(end - start, 10), total);
+  start = Math.min(Math.max(start, 0), total - span);
+  return [start, start + span];
+}
+
+function opAt(canvas, event) {
+  const width = canvas.clientWidth - MARGIN.left - MARGIN.right;
+  return view[0] + (event.offsetX - MARGIN.left) / width * (view[1] - view[0]);
+}
+
+function show(index) {
+  group = groups[index];
+  view = [0, rows()];
+  const container = document.getElementById("panels");
+  container.innerHTML = "";
+  canvases = group.panels.map(() => {
+    const div = document.createElement("div");
+    div.className = "panel";
+    const canvas = document.createElement("canvas");
+    const readout = document.createElement("div");
+    readout.className = "readout";
+    div.append(canvas, readout);
+    container.append(div);
+    let drag = null;
+    canvas.addEventListener("wheel", event => {
+      event.preventDefault();
+      const at = opAt(canvas, event), scale = Math.exp(event.deltaY * 0.002);
+      view = clamp(at - (at - view[0]) * scale, at + (view[1] - at) * scale);
+      redraw();
+    }, { passive: false });
+    canvas.addEventListener("mousedown", event => { drag = { x: event.offsetX, view: view.slice() }; });
+    window.addEventListener("mouseup", () => { drag = null; });
+    canvas.addEventListener("mousemove", event => {
+      if (drag) {
+        const width = canvas.clientWidth - MARGIN.left - MARGIN.right;
+        const shift = (drag.x - event.offsetX) / width * (drag.view[1] - drag.view[0]);
+        view = clamp(drag.view[0] + shift, drag.view[1] + shift);
+      }
+      hover = Math.round(opAt(canvas, event));
+      redraw();
+    });
+    canvas.addEventListener("mouseleave", () => { hover = null; redraw(); });
+    canvas.addEventListener("dblclick", () => { view = [0, rows()]; redraw(); });
+    return canvas;
+  });
+  redraw();
+}
+
+const select = document.getElementById("group");
+groups.forEach((g, i) => select.append(new Option(g.name, i)));
+select.addEventListener("change", () => show(Number(select.value)));
+window.addEventListener("resize", redraw);
+if (groups.length) show(0);
+</script>
+</body>
+</html>
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+            description="Write a self-contained HTML report for zooming through bytes in-use, fragmentation and instruction count of whole runs, with min/max levels of detail loaded per zoom window."
+            )
+
+    parser.add_argument(
+            "--results_dir",
+            type=str,
+            default=".",
+            help="Path pointing to the dir holding the best_fit/ and next_fit/ result trees.",
+            )
+    parser.add_argument(
+            "--log_files",
+            nargs="+",
+            help="Log files to include instead of discovering them in --results_dir, each as its own group.",
+            )
+    parser.add_argument(
+            "--kind",
+            type=str,
+            default="profile",
+            choices=("profile", "latency"),
+            help="Kind of the --log_files whose names do not follow the result naming scheme.",
+            )
+    parser.add_argument(
+            "--strategies",
+            nargs="+",
+            default=list(STRATEGIES),
+            choices=STRATEGIES,
+            help="Strategies whose runs are included.",
+            )
+    parser.add_argument(
+            "--workloads",
+            nargs="+",
+            default=list(WORKLOADS),
+            choices=WORKLOADS,
+            help="Workloads whose runs are included.",
+            )
+    parser.add_argument(
+            "--factor",
+            type=int,
+            default=DEFAULT_PYRAMID_FACTOR,
+            help="Rows per bucket of each level of detail, relative to the level below.",
+            )
+    parser.add_argument(
+            "--min_buckets",
+            type=int,
+            default=DEFAULT_PYRAMID_BUCKETS,
+            help="Levels are added until the coarsest one has at most this many buckets.",
+            )
+    parser.add_argument(
+            "--output_file",
+            type=str,
+            default="./plots/report.html",
+            help="Path of the HTML report to write.",
+            )
+    parser.add_argument(
+            "--cache_dir",
+            type=str,
+            default=DEFAULT_CACHE_DIR,
+            help="Path pointing to dir in which parsed logs are cached, keyed on the log contents.",
+            )
+    parser.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="If set, always re-parse the log files and leave the cache untouched.",
+            )
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    groups = [group_data(name, runs, args) for name, runs in find_groups(args).items()]
+    groups = [group for group in groups if group["panels"]]
+    if not groups:
+        raise SystemExit("No runs found")
+    write_report(args.output_file, groups)
+    print(f"Wrote {len(groups)} groups to {args.output_file} ({Path(args.output_file).stat().st_size / 1e6:.1f} MB)")